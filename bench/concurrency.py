@@ -0,0 +1,177 @@
+"""
+Sync vs async serving under concurrent clients. Starts the WSGI app under
+gunicorn sync workers and the ASGI app under uvicorn (same worker count, same
+database filled by bench/datagen.py), then holds N client connections
+open against each and reports throughput and latency percentiles:
+
+    python bench/concurrency.py --scale 1k --clients 10,100,1000 --duration 10
+    python bench/concurrency.py --paths /people,/planets/1 --workers 4 --output concurrency.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import subprocess
+from time import perf_counter
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from datagen import add_database_arguments, load, parse_scale
+from run import percentile
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+SERVERS = {
+    'sync': lambda port, workers: ['gunicorn', 'wsgi', '--chdir', SRC, '--bind', '127.0.0.1:{}'.format(port),
+                                   '--workers', str(workers), '--worker-class', 'sync', '--backlog', '2048',
+                                   '--log-level', 'warning'],
+    'async': lambda port, workers: ['uvicorn', 'asgi:application', '--app-dir', SRC, '--host', '127.0.0.1',
+                                    '--port', str(port), '--workers', str(workers), '--backlog', '2048',
+                                    '--log-level', 'warning', '--no-access-log'],
+}
+DEFAULT_PATHS = '/people?limit=20,/people/1,/planets?sort=-population&limit=20,/films/1,/starships?limit=20'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server on port {} did not start'.format(port))
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length, keep_alive = 0, True
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            length = int(value)
+        elif name == b'connection' and value.strip().lower() == b'close':
+            # gunicorn's sync workers close after every response
+            keep_alive = False
+    await reader.readexactly(length)
+    return status, keep_alive
+
+
+async def client(port, paths, offset, stop_at, latencies, statuses):
+    """One connection (kept alive when the server allows) issuing requests back to back until `stop_at`"""
+    reader, writer = None, None
+    i = offset
+    while time.monotonic() < stop_at:
+        if writer is None:
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            except OSError:
+                statuses['connect_error'] = statuses.get('connect_error', 0) + 1
+                await asyncio.sleep(0.05)
+                continue
+        path = paths[i % len(paths)]
+        i += 1
+        start = perf_counter()
+        try:
+            writer.write('GET {} HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept: application/json\r\n\r\n'.format(path).encode())
+            status, keep_alive = await read_response(reader)
+        except (OSError, asyncio.IncompleteReadError):
+            statuses['disconnected'] = statuses.get('disconnected', 0) + 1
+            writer.close()
+            reader, writer = None, None
+            continue
+        latencies.append(perf_counter() - start)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        if not keep_alive:
+            writer.close()
+            reader, writer = None, None
+    if writer is not None:
+        writer.close()
+
+
+async def drive(port, paths, clients, duration):
+    latencies, statuses = [], {}
+    stop_at = time.monotonic() + duration
+    started = perf_counter()
+    await asyncio.gather(*(client(port, paths, i, stop_at, latencies, statuses) for i in range(clients)))
+    elapsed = perf_counter() - started
+    latencies.sort()
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'statuses': statuses,
+        'throughput_rps': len(latencies) / elapsed,
+        'p50_ms': (percentile(latencies, 50) or 0) * 1000,
+        'p95_ms': (percentile(latencies, 95) or 0) * 1000,
+        'p99_ms': (percentile(latencies, 99) or 0) * 1000,
+    }
+
+
+def bench_server(mode, paths, client_counts, workers, duration, warmup):
+    port = free_port()
+    server = subprocess.Popen(SERVERS[mode](port, workers), env=dict(os.environ))
+    try:
+        wait_for(port)
+        asyncio.run(drive(port, paths, min(client_counts), warmup))
+        return {str(clients): asyncio.run(drive(port, paths, clients, duration)) for clients in client_counts}
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', default='1k', help='1k, 100k, 1m or a People row count')
+    parser.add_argument('--seed', type=int, default=42)
+    add_database_arguments(parser)
+    parser.add_argument('--skip-load', action='store_true', help='reuse an already generated database')
+    parser.add_argument('--clients', default='10,100,1000', help='comma-separated concurrent connection counts')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per concurrency level')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds before each server is measured')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes for both servers')
+    parser.add_argument('--paths', default=DEFAULT_PATHS, help='comma-separated paths requested round-robin')
+    parser.add_argument('--modes', default='sync,async')
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    args = parser.parse_args(argv)
+
+    os.environ['DATABASE_URL'] = args.database_url
+    people = parse_scale(args.scale)
+    if not args.skip_load:
+        sys.path.insert(0, SRC)
+        from app import create_app
+        app = create_app()
+        load(app, people, args.seed, args.drop)
+    # a path may itself contain commas in its query string; split on ",/" boundaries
+    paths = ['/' + path.lstrip('/') for path in args.paths.split(',/')]
+    client_counts = [int(count) for count in args.clients.split(',')]
+    report = {
+        'scale': people,
+        'database': urlsplit(args.database_url).scheme,
+        'workers': args.workers,
+        'duration_s': args.duration,
+        'paths': paths,
+        'python': platform.python_version(),
+        'modes': {mode: bench_server(mode, paths, client_counts, args.workers, args.duration, args.warmup)
+                  for mode in args.modes.split(',')},
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
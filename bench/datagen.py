@@ -0,0 +1,166 @@
+"""
+Seeded synthetic Star Wars dataset for benchmarks.
+
+    python bench/datagen.py --scale 100k
+    python bench/datagen.py --scale 100k --database-url postgresql://localhost/bench --drop
+
+Scales are named by the number of People rows (1k, 100k, 1m); every other
+table is sized relative to it. The same --seed always produces the same data.
+Loading drops every table first, so a database other than a scratch SQLite
+file under the temp directory needs an explicit --database-url and --drop
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+from time import perf_counter
+
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+TERRAINS = ('desert', 'grasslands', 'mountains', 'jungle', 'ocean', 'tundra', 'swamp', 'gas giant', 'cityscape', 'forests')
+SYLLABLES = ('ka', 'lo', 'ran', 'dor', 'vin', 'sky', 'wal', 'ker', 'tar', 'kin', 'an', 'ob', 'ben', 'yo', 'da', 'lei', 'han', 'so', 'mu', 'zu')
+CHUNK_SIZE = 5000
+
+
+def table_sizes(people):
+    return {
+        'Gender': 4,
+        'Specie': max(people // 100, 10),
+        'Director': max(people // 3000, 3),
+        'Film': max(people // 1000, 9),
+        'Planet': max(people // 10, 10),
+        'Vehicle': max(people // 10, 10),
+        'People': people,
+        'Starship': max(people // 10, 10),
+        'User': max(people // 10, 10),
+        'Favorite': people,
+    }
+
+
+def make_name(rng, parts=2):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(parts)).capitalize()
+
+
+def generate_rows(people, seed=42):
+    """Yield (model name, list of row dicts) chunks in foreign-key order"""
+    rng = random.Random(seed)
+    sizes = table_sizes(people)
+
+    def chunks(model, build):
+        batch = []
+        for i in range(1, sizes[model] + 1):
+            batch.append(build(i))
+            if len(batch) == CHUNK_SIZE:
+                yield model, batch
+                batch = []
+        if batch:
+            yield model, batch
+
+    yield from chunks('Gender', lambda i: {'gender_id': i, 'type': ('male', 'female', 'droid', 'n/a')[i - 1]})
+    yield from chunks('Specie', lambda i: {'specie_id': i, 'languaje': make_name(rng, 3)})
+    yield from chunks('Director', lambda i: {'directo_id': i, 'name': make_name(rng) + ' ' + make_name(rng)})
+    yield from chunks('Film', lambda i: {
+        'film_id': i, 'title': 'Episode ' + str(i) + ': ' + make_name(rng, 3),
+        'director_id': rng.randint(1, sizes['Director']), 'opening': make_name(rng, 6),
+    })
+    yield from chunks('Planet', lambda i: {
+        'planet_id': i, 'name': make_name(rng, rng.randint(2, 3)), 'population': rng.randint(0, 2 * 10 ** 9),
+        'terrain': rng.choice(TERRAINS), 'diameter': rng.randint(1000, 200000),
+    })
+    yield from chunks('Vehicle', lambda i: {'vehicle_id': i, 'name': make_name(rng), 'model': make_name(rng, 3)})
+    yield from chunks('People', lambda i: {
+        'character_id': i, 'name': make_name(rng) + ' ' + make_name(rng),
+        'gender_id': rng.randint(1, sizes['Gender']), 'specie_id': rng.randint(1, sizes['Specie']),
+        'vehicle_id': rng.randint(1, sizes['Vehicle']), 'height': rng.randint(60, 260),
+        'film_id': rng.randint(1, sizes['Film']), 'planet_id': rng.randint(1, sizes['Planet']),
+    })
+    yield from chunks('Starship', lambda i: {'starship_id': i, 'name': make_name(rng), 'pilot_id': rng.randint(1, people)})
+    yield from chunks('User', lambda i: {
+        'id': i, 'name': make_name(rng), 'username': 'user' + str(i), 'lastname': make_name(rng),
+        'suscription_dates': '2024-01-01', 'password': 'x' * 12, 'email': 'user{}@example.com'.format(i),
+    })
+
+    # favorites must respect the one-row-per-(user, target) unique indexes
+    users = sizes['User']
+    targets = (('planet_id', sizes['Planet']), ('people_id', people), ('film_id', sizes['Film']))
+    seen = set()
+
+    def favorite(i):
+        while True:
+            column, count = rng.choice(targets)
+            key = (rng.randint(1, users), column, rng.randint(1, count))
+            if key not in seen:
+                seen.add(key)
+                return {'id': i, 'user_id': key[0], column: key[2]}
+
+    yield from chunks('Favorite', favorite)
+
+
+DEFAULT_DATABASE_URL = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'bench.db')
+
+
+def is_scratch(database_url):
+    """True for in-memory SQLite and SQLite files under the temp directory"""
+    from sqlalchemy.engine import make_url
+    url = make_url(database_url)
+    if url.get_backend_name() != 'sqlite':
+        return False
+    if not url.database or url.database == ':memory:':
+        return True
+    return os.path.realpath(url.database).startswith(os.path.join(os.path.realpath(tempfile.gettempdir()), ''))
+
+
+def add_database_arguments(parser):
+    parser.add_argument('--database-url', default=DEFAULT_DATABASE_URL,
+                        help='default: a scratch SQLite file; $DATABASE_URL is deliberately not read')
+    parser.add_argument('--drop', action='store_true',
+                        help='allow dropping every table of a database that is not a scratch SQLite file')
+
+
+def load(app, people, seed=42, drop=False):
+    """Drop and recreate every table, then fill them. Refused unless the database is a
+    scratch SQLite file or `drop` confirms it may be wiped"""
+    from sqlalchemy import insert
+    from models import db
+    database_url = app.config['SQLALCHEMY_DATABASE_URI']
+    if not drop and not is_scratch(database_url):
+        raise SystemExit('refusing to drop every table in {}: pass --drop to confirm'.format(database_url))
+    from search import rebuild_search_index
+    from stats import rebuild_stats
+    models = {mapper.class_.__tablename__: mapper.class_ for mapper in db.Model.registry.mappers}
+    start = perf_counter()
+    total = 0
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        rebuild_search_index()
+        for model, rows in generate_rows(people, seed):
+            db.session.execute(insert(models[model]), rows)
+            db.session.commit()
+            total += len(rows)
+        # bulk inserts skip the ORM flush hook that maintains the counters
+        rebuild_stats()
+    return total, perf_counter() - start
+
+
+def parse_scale(value):
+    return SCALES[value.lower()] if value.lower() in SCALES else int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', default='1k', help='1k, 100k, 1m or a People row count')
+    parser.add_argument('--seed', type=int, default=42)
+    add_database_arguments(parser)
+    args = parser.parse_args(argv)
+
+    os.environ['DATABASE_URL'] = args.database_url
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+    from app import create_app
+    app = create_app()
+    rows, elapsed = load(app, parse_scale(args.scale), args.seed, args.drop)
+    print('loaded {} rows in {:.1f}s ({:.0f} rows/s)'.format(rows, elapsed, rows / elapsed))
+
+
+if __name__ == '__main__':
+    main()
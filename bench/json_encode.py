@@ -0,0 +1,73 @@
+"""
+Micro-benchmark for the JSON encoders on real serializer output: builds
+/people and /planets payloads from a bench/datagen.py database and compares
+encode time and allocated bytes (tracemalloc) for stdlib json vs orjson.
+
+    python bench/json_encode.py --rows 5000 --database-url sqlite:////tmp/bench.db
+"""
+import os
+import sys
+import json
+import argparse
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from datagen import add_database_arguments, load
+
+
+def encoders():
+    found = {'stdlib json': lambda obj: json.dumps(obj, separators=(',', ':')).encode()}
+    try:
+        import orjson
+        found['orjson'] = orjson.dumps
+    except ImportError:
+        pass
+    return found
+
+
+def measure(encode, payload, repeat):
+    encode(payload)
+    start = perf_counter()
+    for _ in range(repeat):
+        encode(payload)
+    elapsed = (perf_counter() - start) / repeat
+    tracemalloc.start()
+    encoded = encode(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'encode_ms': elapsed * 1000, 'peak_alloc_bytes': peak, 'output_bytes': len(encoded)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000, help='People rows to generate and encode')
+    parser.add_argument('--repeat', type=int, default=20)
+    add_database_arguments(parser)
+    parser.add_argument('--skip-load', action='store_true')
+    args = parser.parse_args(argv)
+
+    os.environ['DATABASE_URL'] = args.database_url
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+    from app import create_app
+    app = create_app()
+    from models import People, Planet
+    from queries import model_query
+
+    if not args.skip_load:
+        load(app, args.rows, drop=args.drop)
+    with app.app_context():
+        payloads = {
+            '/people': [People.serializer().getter()(row) for row in model_query(People).limit(args.rows)],
+            '/planets': [Planet.serializer().getter()(row) for row in model_query(Planet).limit(args.rows)],
+        }
+    report = {}
+    for route, payload in payloads.items():
+        report[route] = {'rows': len(payload)}
+        for name, encode in encoders().items():
+            report[route][name] = measure(encode, payload, args.repeat)
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
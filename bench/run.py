@@ -0,0 +1,213 @@
+"""
+API benchmark runner. Drives every route through Flask's test client against
+a database filled by bench/datagen.py and prints machine-readable JSON:
+
+    python bench/run.py --scale 1k --requests 200 --output bench_output.json
+    python bench/run.py --baseline bench/baseline.json        # exit 1 on regression
+    python bench/run.py --update-baseline bench/baseline.json
+
+For each route it reports p50/p95/p99 latency, throughput and SQL statements
+per request twice: cold, with the response and entity caches emptied before
+every request, and warm, with whatever the previous request left cached. It
+also reports the process peak RSS.
+"""
+import os
+import sys
+import json
+import argparse
+import resource
+import platform
+from time import perf_counter
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from datagen import add_database_arguments, load, parse_scale, table_sizes
+
+SKIPPED_PREFIXES = ('/admin', '/static', '/metrics')
+METHOD_ORDER = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+# sample values for URL arguments; every id below exists at any scale
+URL_ARGUMENTS = {'user_id': 1, 'metric': 'favorites_by_planet'}
+# writes that undo each other: each timed request is preceded by an untimed one of the other
+# method, so every POST inserts and every DELETE finds a row to remove
+UNDONE_BY = {'POST': 'DELETE', 'DELETE': 'POST'}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def search_term(app, db):
+    """A word from a generated name, so /search times a real lookup rather than its 400"""
+    from models import People
+    with app.app_context():
+        name = db.session.execute(db.select(People.name).order_by(People.character_id).limit(1)).scalar()
+    return name.split()[0] if name else 'a'
+
+
+def scenarios(app, query_args=None):
+    """(name, method, path, json body, setup) for every routed endpoint. `query_args`: {rule: {param: value}};
+    `setup`: an untimed (method, path, body) request to send before each timed one, or None"""
+    query_args = query_args or {}
+    rules = sorted(app.url_map.iter_rules(), key=lambda r: r.rule)
+    methods_by_rule = {}
+    for rule in rules:
+        methods_by_rule.setdefault(rule.rule, set()).update(rule.methods)
+    found = []
+    for rule in rules:
+        if rule.rule.startswith(SKIPPED_PREFIXES) or rule.rule == '/':
+            continue
+        path = rule.rule
+        for argument in rule.arguments:
+            value = str(URL_ARGUMENTS.get(argument, 1))
+            path = path.replace('<int:{}>'.format(argument), value).replace('<{}>'.format(argument), value)
+        if rule.rule in query_args:
+            path += '?' + urlencode(query_args[rule.rule])
+        body = None
+        if path.endswith(':batch'):
+            body = [{'kind': kind, 'id': i} for kind in ('planet', 'people', 'film') for i in range(1, 4)]
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}, key=METHOD_ORDER.index):
+            undo = UNDONE_BY.get(method)
+            setup = (undo, path, body) if undo in methods_by_rule[rule.rule] else None
+            found.append((method + ' ' + rule.rule, method, path, body, setup))
+    return found
+
+
+def clear_caches():
+    """Empty the response and entity caches, so the next request builds its response from the database"""
+    from cache import response_cache, entity_cache
+    response_cache.clear()
+    entity_cache.backend.clear()
+
+
+def measure(client, statements, method, path, body, prepare, requests):
+    latencies = []
+    statuses = {}
+    queries = 0
+    for _ in range(requests):
+        prepare()
+        counted = len(statements)
+        start = perf_counter()
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        latencies.append(perf_counter() - start)
+        queries += len(statements) - counted
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    elapsed = sum(latencies)
+    latencies.sort()
+    return {
+        'requests': requests,
+        'statuses': {str(code): count for code, count in statuses.items()},
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'throughput_rps': requests / elapsed,
+        'queries_per_request': queries / float(requests),
+    }
+
+
+def run(app, db, requests_per_route, warmup=5):
+    """{route: {'path', 'cold', 'warm'}}: `cold` empties the caches before every timed request,
+    `warm` times the repeat requests the caches serve"""
+    from sqlalchemy import event
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(1))
+    client = app.test_client()
+    results = {}
+    for name, method, path, body, setup in scenarios(app, {'/search': {'q': search_term(app, db)}}):
+        def send_setup():
+            if setup is not None:
+                setup_method, setup_path, setup_body = setup
+                client.open(setup_path, method=setup_method, json=setup_body).get_data()
+
+        def cold_setup():
+            send_setup()
+            clear_caches()
+        for _ in range(warmup):
+            send_setup()
+            client.open(path, method=method, json=body).get_data()
+        results[name] = {
+            'path': path,
+            'cold': measure(client, statements, method, path, body, cold_setup, requests_per_route),
+            'warm': measure(client, statements, method, path, body, send_setup, requests_per_route),
+        }
+    return results
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+def compare(report, baseline, tolerance, min_delta_ms):
+    """Routes whose query count grew, or whose p95 regressed by more than both
+    `tolerance` (a fraction) and `min_delta_ms` (to ignore sub-millisecond jitter)"""
+    regressions = []
+    for name, route in report['routes'].items():
+        for mode in ('cold', 'warm'):
+            current = route[mode]
+            previous = baseline.get('routes', {}).get(name, {}).get(mode)
+            if previous is None:
+                continue
+            slower = current['p95_ms'] - previous['p95_ms']
+            if slower > previous['p95_ms'] * tolerance and slower > min_delta_ms:
+                regressions.append({'route': name, 'mode': mode, 'metric': 'p95_ms',
+                                    'baseline': previous['p95_ms'], 'current': current['p95_ms']})
+            if current['queries_per_request'] > previous['queries_per_request']:
+                regressions.append({'route': name, 'mode': mode, 'metric': 'queries_per_request',
+                                    'baseline': previous['queries_per_request'], 'current': current['queries_per_request']})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', default='1k', help='1k, 100k, 1m or a People row count')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests per route')
+    add_database_arguments(parser)
+    parser.add_argument('--skip-load', action='store_true', help='reuse an already generated database')
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    parser.add_argument('--baseline', help='fail (exit 1) when a route regresses against this report')
+    parser.add_argument('--update-baseline', help='write the report as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown, as a fraction')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='ignore p95 slowdowns smaller than this')
+    args = parser.parse_args(argv)
+
+    os.environ['DATABASE_URL'] = args.database_url
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+    from app import create_app
+    app = create_app()
+    from models import db
+
+    people = parse_scale(args.scale)
+    if not args.skip_load:
+        load(app, people, args.seed, args.drop)
+    report = {
+        'scale': people,
+        'table_sizes': table_sizes(people),
+        'requests_per_route': args.requests,
+        'python': platform.python_version(),
+        'routes': run(app, db, args.requests, args.warmup),
+    }
+    report['peak_rss_bytes'] = peak_rss_bytes()
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(report, json.load(f), args.tolerance, args.min_delta_ms)
+        exit_code = 1 if report['regressions'] else 0
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    for path in (args.output, args.update_baseline):
+        if path:
+            with open(path, 'w') as f:
+                f.write(output + '\n')
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Import-time and cold-start benchmark. Every run is a fresh interpreter, so
+nothing is already imported or cached; each one times `import app`,
+create_app() and the first request, for each feature profile, and reports
+the median and minimum over the runs as JSON:
+
+    python bench/startup.py --runs 10
+    python bench/startup.py --profiles full,minimal --path /people/1 --importtime 15
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import statistics
+import subprocess
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+PROFILES = {
+    'full': {'ENABLE_ADMIN': True, 'ENABLE_MIGRATIONS': True, 'ENABLE_SWAGGER': True},
+    'default': {},
+    'serve': {'ENABLE_MIGRATIONS': False},
+    'minimal': {'ENABLE_ADMIN': False, 'ENABLE_MIGRATIONS': False, 'ENABLE_SWAGGER': False},
+}
+# runs inside the child interpreter; prints one JSON line of timings in ms
+CHILD = '''
+import sys, json
+from time import perf_counter
+start = perf_counter()
+sys.path.insert(0, {src!r})
+import app
+imported = perf_counter()
+flask_app = app.create_app({config!r})
+created = perf_counter()
+response = flask_app.test_client().get({path!r})
+served = perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (served - created) * 1000,
+    'total_ms': (served - start) * 1000,
+    'status': response.status_code,
+    'modules': len(sys.modules),
+}}))
+'''
+
+
+def run_once(profile, path):
+    code = CHILD.format(src=SRC, config=PROFILES[profile], path=path)
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, env=dict(os.environ))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def import_profile(top):
+    """The `top` slowest imports made directly by app.py, by cumulative time, from -X importtime"""
+    code = 'import sys; sys.path.insert(0, {!r}); import app'.format(SRC)
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, check=True)
+    modules = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # one space before a top-level name, two more per nesting level; app's own imports are level 1
+        if (len(name) - len(name.lstrip()) - 1) // 2 == 1:
+            modules.append((name.strip(), int(cumulative) / 1000))
+    modules.sort(key=lambda module: -module[1])
+    return [{'module': name, 'cumulative_ms': ms} for name, ms in modules[:top]]
+
+
+def summarize(samples, key):
+    values = [sample[key] for sample in samples]
+    return {'median': statistics.median(values), 'min': min(values)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per profile')
+    parser.add_argument('--profiles', default=','.join(PROFILES), help='comma-separated, from: ' + ', '.join(PROFILES))
+    parser.add_argument('--path', default='/people/1', help='the first request')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'sqlite:////tmp/bench.db'))
+    parser.add_argument('--importtime', type=int, default=10, metavar='N', help='list the N slowest imports made by app.py (0: skip)')
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    args = parser.parse_args(argv)
+
+    os.environ['DATABASE_URL'] = args.database_url
+    report = {'python': platform.python_version(), 'runs': args.runs, 'path': args.path, 'profiles': {}}
+    for profile in args.profiles.split(','):
+        samples = [run_once(profile, args.path) for _ in range(args.runs)]
+        report['profiles'][profile] = {
+            'config': PROFILES[profile],
+            'status': samples[-1]['status'],
+            'modules': samples[-1]['modules'],
+            **{key: summarize(samples, key) for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'total_ms')},
+        }
+    if args.importtime:
+        report['slowest_imports'] = import_profile(args.importtime)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""name indexes and search index
+
+Revision ID: 0f2baba0beb1
+Revises: 10cdc748f75d
+Create Date: 2026-10-17 19:10:42.581930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0f2baba0beb1'
+down_revision = '10cdc748f75d'
+branch_labels = None
+depends_on = None
+
+# kind, table, primary key, searchable column, FTS rowid kind code
+SEARCHABLE = (
+    ('people', 'People', 'character_id', 'name', 1),
+    ('planets', 'Planet', 'planet_id', 'name', 2),
+    ('films', 'Film', 'film_id', 'title', 3),
+    ('starships', 'Starship', 'starship_id', 'name', 4),
+    ('vehicles', 'Vehicle', 'vehicle_id', 'name', 5),
+)
+
+
+def upgrade():
+    for kind, table, pk, column, code in SEARCHABLE:
+        op.create_index('ix_{}_{}'.format(table, column), table, [column], unique=False)
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(text, prefix='2 3')")
+        for kind, table, pk, column, code in SEARCHABLE:
+            new = 'new.{} * 8 + {}'.format(pk, code)
+            old = 'old.{} * 8 + {}'.format(pk, code)
+            op.execute('CREATE TRIGGER IF NOT EXISTS search_{k}_ai AFTER INSERT ON "{t}" BEGIN '
+                       'INSERT INTO search_fts(rowid, text) VALUES ({new}, new.{c}); END'.format(k=kind, t=table, c=column, new=new))
+            op.execute('CREATE TRIGGER IF NOT EXISTS search_{k}_ad AFTER DELETE ON "{t}" BEGIN '
+                       'DELETE FROM search_fts WHERE rowid = {old}; END'.format(k=kind, t=table, old=old))
+            op.execute('CREATE TRIGGER IF NOT EXISTS search_{k}_au AFTER UPDATE OF {c} ON "{t}" BEGIN '
+                       'DELETE FROM search_fts WHERE rowid = {old}; '
+                       'INSERT INTO search_fts(rowid, text) VALUES ({new}, new.{c}); END'.format(k=kind, t=table, c=column, old=old, new=new))
+            op.execute('INSERT INTO search_fts(rowid, text) SELECT {pk} * 8 + {code}, {c} FROM "{t}" WHERE {c} IS NOT NULL'.format(
+                pk=pk, code=code, c=column, t=table))
+    elif dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for kind, table, pk, column, code in SEARCHABLE:
+            op.execute('CREATE INDEX IF NOT EXISTS ix_{k}_{c}_trgm ON "{t}" USING gin ({c} gin_trgm_ops)'.format(k=kind, c=column, t=table))
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for kind, table, pk, column, code in SEARCHABLE:
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute('DROP TRIGGER IF EXISTS search_{}_{}'.format(kind, suffix))
+        op.execute('DROP TABLE IF EXISTS search_fts')
+    elif dialect == 'postgresql':
+        for kind, table, pk, column, code in SEARCHABLE:
+            op.execute('DROP INDEX IF EXISTS ix_{}_{}_trgm'.format(kind, column))
+
+    for kind, table, pk, column, code in reversed(SEARCHABLE):
+        op.drop_index('ix_{}_{}'.format(table, column), table_name=table)
@@ -0,0 +1,44 @@
+"""favorite indexes and per-kind unique constraints
+
+Revision ID: 10cdc748f75d
+Revises: 65197b9eec39
+Create Date: 2026-10-17 18:02:11.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '10cdc748f75d'
+down_revision = '65197b9eec39'
+branch_labels = None
+depends_on = None
+
+FAVORITE_TARGETS = ('planet_id', 'people_id', 'film_id')
+
+
+def upgrade():
+    # drop the duplicates repeated POSTs created, keeping the oldest row of each
+    for column in FAVORITE_TARGETS:
+        op.execute(
+            'DELETE FROM "Favorite" WHERE {col} IS NOT NULL AND id NOT IN ('
+            'SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM "Favorite" '
+            'WHERE {col} IS NOT NULL GROUP BY user_id, {col}) AS keep)'.format(col=column)
+        )
+
+    with op.batch_alter_table('Favorite', schema=None) as batch_op:
+        batch_op.create_index('ix_favorite_user_id_id', ['user_id', 'id'], unique=False)
+        for column in FAVORITE_TARGETS:
+            where = sa.text('{} IS NOT NULL'.format(column))
+            batch_op.create_index(
+                'uq_favorite_user_{}'.format(column), ['user_id', column], unique=True,
+                postgresql_where=where, sqlite_where=where,
+            )
+
+
+def downgrade():
+    with op.batch_alter_table('Favorite', schema=None) as batch_op:
+        for column in reversed(FAVORITE_TARGETS):
+            batch_op.drop_index('uq_favorite_user_{}'.format(column))
+        batch_op.drop_index('ix_favorite_user_id_id')
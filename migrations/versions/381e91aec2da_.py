@@ -0,0 +1,47 @@
+"""materialized counters for /stats
+
+Revision ID: 381e91aec2da
+Revises: e397bf3354dd
+Create Date: 2026-10-17 21:14:05.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '381e91aec2da'
+down_revision = 'e397bf3354dd'
+branch_labels = None
+depends_on = None
+
+# metric, source table, counted column
+METRICS = (
+    ('people_by_planet', 'People', 'planet_id'),
+    ('people_by_specie', 'People', 'specie_id'),
+    ('people_by_gender', 'People', 'gender_id'),
+    ('films_by_director', 'Film', 'director_id'),
+    ('favorites_by_planet', 'Favorite', 'planet_id'),
+    ('favorites_by_people', 'Favorite', 'people_id'),
+    ('favorites_by_film', 'Favorite', 'film_id'),
+)
+
+
+def upgrade():
+    op.create_table('Stat',
+    sa.Column('metric', sa.String(length=50), nullable=False),
+    sa.Column('group_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('metric', 'group_id')
+    )
+    op.create_index('ix_stat_metric_count', 'Stat', ['metric', 'count'], unique=False)
+    for metric, table, column in METRICS:
+        op.execute(
+            'INSERT INTO "Stat" (metric, group_id, count) '
+            "SELECT '{m}', {c}, COUNT(*) FROM \"{t}\" WHERE {c} IS NOT NULL GROUP BY {c}".format(m=metric, t=table, c=column)
+        )
+
+
+def downgrade():
+    op.drop_index('ix_stat_metric_count', table_name='Stat')
+    op.drop_table('Stat')
@@ -0,0 +1,36 @@
+"""per-table change stamps for Last-Modified
+
+Revision ID: 5b8d2e7c41f9
+Revises: 381e91aec2da
+Create Date: 2026-10-17 23:05:41.220834
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8d2e7c41f9'
+down_revision = '381e91aec2da'
+branch_labels = None
+depends_on = None
+
+# tables served with Last-Modified; existing data is stamped as of the upgrade
+STAMPED = ('User', 'People', 'Planet', 'Film', 'Starship', 'Vehicle', 'Gender', 'Specie', 'Director', 'Favorite')
+
+
+def upgrade():
+    op.create_table('TableStamp',
+    sa.Column('table_name', sa.String(length=50), nullable=False),
+    sa.Column('modified', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    for table in STAMPED:
+        op.execute(
+            'INSERT INTO "TableStamp" (table_name, modified) '
+            "VALUES ('{}', CURRENT_TIMESTAMP)".format(table)
+        )
+
+
+def downgrade():
+    op.drop_table('TableStamp')
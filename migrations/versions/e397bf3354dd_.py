@@ -0,0 +1,41 @@
+"""indexes backing the collection filters and sorts
+
+Revision ID: e397bf3354dd
+Revises: 0f2baba0beb1
+Create Date: 2026-10-17 20:02:37.118402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e397bf3354dd'
+down_revision = '0f2baba0beb1'
+branch_labels = None
+depends_on = None
+
+FILTER_INDEXES = (
+    ('People', 'gender_id'),
+    ('People', 'specie_id'),
+    ('People', 'vehicle_id'),
+    ('People', 'height'),
+    ('People', 'film_id'),
+    ('People', 'planet_id'),
+    ('Film', 'director_id'),
+    ('Starship', 'pilot_id'),
+    ('Vehicle', 'model'),
+    ('Planet', 'population'),
+    ('Planet', 'terrain'),
+    ('Planet', 'diameter'),
+)
+
+
+def upgrade():
+    for table, column in FILTER_INDEXES:
+        op.create_index('ix_{}_{}'.format(table, column), table, [column], unique=False)
+
+
+def downgrade():
+    for table, column in reversed(FILTER_INDEXES):
+        op.drop_index('ix_{}_{}'.format(table, column), table_name=table)
@@ -1,337 +1,486 @@
 """
-This module takes care of starting the API Server, Loading the DB and Adding the endpoints
+This module takes care of starting the API Server, Loading the DB and Adding the endpoints.
+create_app() builds the app; admin, migrations and the swagger spec are only
+imported and registered when their ENABLE_* setting is on
 """
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+import click
+import tempfile
+from time import perf_counter
+from flask import Flask, Blueprint, Response, request, jsonify, current_app
 from flask_cors import CORS
+from sqlalchemy.exc import IntegrityError
 from utils import APIException, generate_sitemap
-from admin import setup_admin
+from queries import model_query
+from serializers import requested_fields
+from pagination import paginate
+from streaming import wants_stream, stream_ndjson
+from cache import cached, setup_cache, entity_cache
+from compression import setup_compression
+from stamps import conditional, setup_stamps
+from pool import engine_options, setup_pool, pool_metrics
+from metrics import setup_metrics, metrics_registry
+from search import SEARCHABLE, search, search_text, search_limit, apply_search_filters, rebuild_search_index
+from filters import apply_filters, requested_sort
+from loaders import setup_loaders
+from expand import Expander, requested_expand, expand_load_columns, source_models, source_tables
+from stats import METRICS, setup_stats, stats_limit, leaderboard, stat_count, check_metric, rebuild_stats
+from favorites import add_favorite, delete_favorite, add_favorites, delete_favorites, parse_batch
+from ratelimit import RATE_COST_COLLECTION, RATE_COST_STREAM, rate_cost, setup_rate_limit
+from replicas import REPLICA_BIND_PREFIX, replica_urls, read_primary, setup_replicas
 from models import db, User, People, Planet, Film, Starship, Vehicle, Gender, Specie, Director, Favorite
 
-app = Flask(__name__)
-app.url_map.strict_slashes = False
+api = Blueprint('api', __name__, cli_group=None)
 
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+def env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
 
-@app.errorhandler(APIException)
+
+def default_config():
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is not None:
+        db_url = db_url.replace("postgres://", "postgresql://")
+    else:
+        db_url = "sqlite:////tmp/test.db"
+    return {
+        'SQLALCHEMY_DATABASE_URI': db_url,
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'DATABASE_REPLICA_URLS': replica_urls(os.getenv('DATABASE_REPLICA_URLS')),
+        'ENABLE_ADMIN': env_flag('ENABLE_ADMIN', True),
+        'ENABLE_MIGRATIONS': env_flag('ENABLE_MIGRATIONS', True),
+        'ENABLE_SWAGGER': env_flag('ENABLE_SWAGGER', False),
+        'FAVORITES_WRITE_BEHIND': env_flag('FAVORITES_WRITE_BEHIND', False),
+        'ENABLE_RATE_LIMIT': env_flag('ENABLE_RATE_LIMIT', False),
+    }
+
+
+def create_app(config=None):
+    """Build the app from the environment, with `config` overriding any setting"""
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+    app.config.update(default_config())
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    for i, url in enumerate(app.config['DATABASE_REPLICA_URLS']):
+        binds[REPLICA_BIND_PREFIX + str(i)] = dict(engine_options(url), url=url)
+
+    if app.config['ENABLE_MIGRATIONS']:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    db.init_app(app)
+    setup_pool(app)
+    setup_metrics(app)
+    if app.config['ENABLE_RATE_LIMIT']:
+        setup_rate_limit(app)
+    setup_replicas(app)
+    CORS(app)
+    if app.config['ENABLE_ADMIN']:
+        from admin import setup_admin
+        setup_admin(app)
+    setup_cache(app)
+    setup_loaders(app)
+    setup_stats(app)
+    setup_stamps(app)
+    setup_compression(app)
+    if app.config['FAVORITES_WRITE_BEHIND']:
+        from writebehind import setup_write_behind
+        setup_write_behind(app)
+    app.register_blueprint(api)
+    if app.config['ENABLE_SWAGGER']:
+        app.add_url_rule('/spec', 'spec', swagger_spec)
+    return app
+
+
+def swagger_spec():
+    from flask_swagger import swagger
+    return jsonify(swagger(current_app)), 200
+
+@api.app_errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
-
-@app.route('/users', methods=['GET']) #FUNCIONA
+    return generate_sitemap(current_app)
+
+@api.route('/search', methods=['GET'])
+@rate_cost(RATE_COST_COLLECTION)
+def search_names():
+    q = search_text('q', request.args.get('q'))
+    kinds = request.args.get('kinds')
+    kinds = [kind.strip() for kind in kinds.split(',')] if kinds else list(SEARCHABLE)
+    unknown = [kind for kind in kinds if kind not in SEARCHABLE]
+    if unknown:
+        raise APIException('Unknown kind(s): ' + ', '.join(unknown), status_code=400)
+    return jsonify(search(q, kinds, search_limit())), 200
+
+@api.cli.command('search-reindex')
+def search_reindex():
+    """Create the search index if needed and repopulate it from the source tables"""
+    print('indexed {} rows'.format(rebuild_search_index()))
+
+@api.route('/stats', methods=['GET'])
+def get_stats():
+    limit = stats_limit()
+    return jsonify({metric: leaderboard(metric, limit) for metric in METRICS}), 200
+
+@api.route('/stats/<metric>', methods=['GET'])
+def get_stat_leaderboard(metric):
+    return jsonify(leaderboard(metric, stats_limit())), 200
+
+@api.route('/stats/<metric>/<int:group_id>', methods=['GET'])
+def get_stat(metric, group_id):
+    return jsonify({'metric': check_metric(metric), 'id': group_id, 'count': stat_count(metric, group_id)}), 200
+
+@api.cli.command('stats-rebuild')
+def stats_rebuild():
+    """Recompute the /stats counters from the source tables"""
+    written, drifted = rebuild_stats()
+    print('rebuilt {} counters, {} had drifted'.format(written, drifted))
+
+@api.cli.command('import')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--table', help='Target table when it cannot be told from the file name')
+@click.option('--format', 'fmt', type=click.Choice(['json', 'ndjson', 'csv']), help='Input format (default: from the extension)')
+@click.option('--batch-size', type=int, help='Rows per INSERT/COPY and per commit (default: IMPORT_BATCH_SIZE, 5000)')
+def import_data(paths, table, fmt, batch_size):
+    """Load JSON, NDJSON or CSV dumps (files or directories) into the model tables"""
+    from importer import IMPORT_BATCH_SIZE, sources, import_sources
+    start = perf_counter()
+    with tempfile.TemporaryDirectory(prefix='flask-import-') as spool:
+        try:
+            found = sources(paths, table, fmt, spool)
+        except ValueError as error:
+            raise click.BadParameter(str(error))
+        results = import_sources(found, batch_size or IMPORT_BATCH_SIZE)
+    # bulk inserts skip the ORM flush hook that maintains the /stats counters
+    rebuild_stats()
+    rows = sum(count for count, _ in results.values())
+    elapsed = perf_counter() - start
+    print('imported {} rows in {:.2f}s ({:.0f} rows/s)'.format(rows, elapsed, rows / elapsed if elapsed else 0))
+
+@api.cli.command('export')
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--codec', type=click.Choice(['lzma', 'none', 'zlib']), default='zlib', show_default=True)
+@click.option('--row-group', type=int, help='Rows per compressed column block (default: SNAPSHOT_ROW_GROUP, 50000)')
+def export_data(directory, codec, row_group):
+    """Write every table to a columnar snapshot in DIRECTORY"""
+    from snapshot import SNAPSHOT_ROW_GROUP, export_snapshot
+    start = perf_counter()
+    manifest = export_snapshot(directory, codec, row_group or SNAPSHOT_ROW_GROUP)
+    rows = sum(entry['rows'] for entry in manifest['tables'])
+    size = sum(entry['bytes'] for entry in manifest['tables'])
+    elapsed = perf_counter() - start
+    print('exported {} rows ({} bytes) in {:.2f}s ({:.0f} rows/s)'.format(rows, size, elapsed, rows / elapsed if elapsed else 0))
+
+@api.cli.command('restore')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--replace', is_flag=True, help='Delete the existing rows of the snapshot tables first')
+@click.option('--no-verify', is_flag=True, help='Skip the checksum check')
+def restore_data(directory, replace, no_verify):
+    """Load a snapshot written by `flask export`"""
+    from snapshot import restore_snapshot
+    start = perf_counter()
+    try:
+        restored = restore_snapshot(directory, replace, not no_verify)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    except IntegrityError as error:
+        db.session.rollback()
+        raise click.ClickException('restore stopped, earlier row groups are committed: {}'.format(error.orig))
+    rebuild_search_index()
+    rebuild_stats()
+    rows = sum(restored.values())
+    elapsed = perf_counter() - start
+    print('restored {} rows in {:.2f}s ({:.0f} rows/s)'.format(rows, elapsed, rows / elapsed if elapsed else 0))
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/metrics/pool', methods=['GET'])
+def get_pool_metrics():
+    return jsonify(pool_metrics.snapshot(db.engine.pool)), 200
+
+@api.route('/metrics/replicas', methods=['GET'])
+def get_replica_metrics():
+    replicas = current_app.extensions.get('replicas')
+    return jsonify(replicas.snapshot() if replicas is not None else []), 200
+
+def list_collection(key_column, query=None, tail=()):
+    """`tail`: unsaved rows served after the last page, unfiltered and unsorted"""
+    model = key_column.class_
+    fields = requested_fields(model)
+    sort = requested_sort(model)
+    expand = requested_expand(model)
+    query = model_query(model, fields, query, sort, expand_load_columns(model, expand))
+    query = apply_filters(apply_search_filters(query, model), model)
+    dump = model.serializer().getter(fields)
+    expander = Expander(model, expand) if expand else None
+    if wants_stream():
+        return stream_ndjson(query, key_column, dump, sort, expander, tail)
+    page = paginate(query, key_column, sort)
+    items = page.items
+    if tail and page.next_cursor is None:
+        items = list(items) + list(tail)
+    data = [dump(item) for item in items]
+    if expander is not None:
+        expander(items, data)
+    return jsonify(data), 200, page.headers()
+
+def get_expanded(model, pk):
+    """Single-entity GET honouring ?fields= and ?expand=; None when the row doesn't exist.
+    Reads through the entity cache, keyed by the versions of every table the result reads"""
+    fields = requested_fields(model)
+    expand = requested_expand(model)
+
+    def load():
+        item = model_query(model, fields, columns=expand_load_columns(model, expand)).get(pk)
+        if item is None:
+            return None
+        data = item.serialize(fields)
+        if expand:
+            Expander(model, expand)([item], [data])
+        return data
+    return entity_cache.read_through(source_tables(model, expand), (model.__tablename__, pk, fields, expand), load)
+
+@api.route('/users', methods=['GET']) #FUNCIONA
+@rate_cost(RATE_COST_COLLECTION, stream=RATE_COST_STREAM)
+@conditional(*source_models(User))
 def handle_hello():
-    users = User.query.all()
-    response_body = []
-    for user in users:
-        user_data = {
-            'id': user.id,
-            'name': user.name,
-            'username': user.username,
-            'lastname': user.lastname,
-            'suscription': user.suscription_dates,
-            'email': user.email,
-            'favorites': user.favorites,
-        }
-        response_body.append(user_data)
-
-    return jsonify(response_body), 200
-
-@app.route('/users/<int:user_id>', methods=['GET']) #FUNCIONA
+    return list_collection(User.id)
+
+@api.route('/users/<int:user_id>', methods=['GET']) #FUNCIONA
+@conditional(*source_models(User))
 def get_user(user_id):  
-    user = User.query.filter_by(id=user_id).first()  
-    if user:
-        user_data = {
-            'id': user.id,
-            'name': user.name,
-            'username': user.username,
-            'lastname': user.lastname,
-            'suscription': user.suscription_dates,
-            'email': user.email,
-            'favorites': user.favorites,
-        }
-        return jsonify(user_data), 200
+    user = get_expanded(User, user_id)
+    if user is not None:
+        return jsonify(user), 200
     else:
         return jsonify({'message': 'User not found'}), 404
 
     
 
-@app.route('/people/<int:people_id>', methods=['GET']) #FUNCIONA
+@api.route('/people/<int:people_id>', methods=['GET']) #FUNCIONA
+@conditional(*source_models(People))
 def get_person(people_id):
-    person = People.query.get(people_id)
-    if person:
-        person_data = {
-            'name': person.name,
-            'gender': person.gender.type if person.gender else None,
-            'specie': person.specie.language if person.specie else None,
-            'vehicle': person.vehicle.name if person.vehicle else None,
-            'height': person.height,
-            'films': [film.title for film in person.film] if person.film else []
-        }
-        return jsonify(person_data), 200
+    person = get_expanded(People, people_id)
+    if person is not None:
+        return jsonify(person), 200
     else:
         return jsonify({'error': 'Person not found'}), 404
 
-@app.route('/people', methods=['GET']) #FUNCIONA
+@api.route('/people', methods=['GET']) #FUNCIONA
+@rate_cost(RATE_COST_COLLECTION, stream=RATE_COST_STREAM)
+@conditional(*source_models(People))
 def get_people():
-    people = People.query.all()
-    result = []
-    for person in people:
-        person_data = {
-            'name': person.name,
-            'gender': person.gender.type if person.gender else None,
-            'specie': person.specie.language if person.specie else None,
-            'vehicle': person.vehicle.name if person.vehicle else None,
-            'height': person.height,
-            'films': [film.title for film in person.film] if person.film else []
-        }
-        result.append(person_data)
-    return jsonify(result), 200
-
-
-@app.route('/planets', methods=['GET']) #FUNCIONA
+    return list_collection(People.character_id)
+
+
+@api.route('/planets', methods=['GET']) #FUNCIONA
+@rate_cost(RATE_COST_COLLECTION, stream=RATE_COST_STREAM)
+@cached(*source_models(Planet))
 def get_planets():
-    planets = Planet.query.all()
-    result = []
-    for planet in planets:
-        result.append({
-            'id': planet.planet_id,
-            'name': planet.name,
-            'population': planet.population,
-            'terrain': planet.terrain,
-            'diameter': planet.diameter
-        })
-    return jsonify(result), 200
-
-@app.route('/planets/<int:planet_id>', methods=['GET']) #FUNCIONA
+    return list_collection(Planet.planet_id)
+
+@api.route('/planets/<int:planet_id>', methods=['GET']) #FUNCIONA
+@cached(*source_models(Planet))
 def get_planet(planet_id):
-    planet = Planet.query.get(planet_id)
-    if planet:
-        result = {
-            'id': planet.planet_id,
-            'name': planet.name,
-            'population': planet.population,
-            'terrain': planet.terrain,
-            'diameter': planet.diameter
-        }
-        return jsonify(result), 200
+    planet = get_expanded(Planet, planet_id)
+    if planet is not None:
+        return jsonify(planet), 200
     else:
         return jsonify({'error': 'Planet not found'}), 404
 
 
-@app.route('/user/<int:user_id>/favorites', methods=['GET']) #FUNCIONA
+def favorite_queue():
+    """The write-behind queue when FAVORITES_WRITE_BEHIND is on, else None"""
+    return current_app.extensions.get('favorite_queue')
+
+def has_queued_favorites(user_id):
+    # a listing that includes queued ops is newer than the Favorite change stamp
+    queue = favorite_queue()
+    return queue is not None and bool(queue.pending(user_id))
+
+def flush_queued_favorites():
+    # a batch must not be overtaken by single writes queued before it
+    queue = favorite_queue()
+    if queue is not None:
+        queue.flush(wait=True)
+
+@api.cli.command('favorites-flush')
+def favorites_flush():
+    """Apply every queued favorite write, e.g. before turning FAVORITES_WRITE_BEHIND off"""
+    from writebehind import make_queue
+    queue = favorite_queue() or make_queue(current_app)
+    print('applied {} queued favorite ops'.format(queue.flush(wait=True)))
+
+@api.route('/user/<int:user_id>/favorites', methods=['GET']) #FUNCIONA
+@rate_cost(RATE_COST_COLLECTION, stream=RATE_COST_STREAM)
+@read_primary
+@conditional(*source_models(Favorite), skip=has_queued_favorites)
 def get_user_favorites(user_id):
-    favorites = Favorite.query.filter_by(user_id=user_id).all()
-    result = []
-    for favorite in favorites:
-        result.append({
-            'user_id': favorite.user_id,
-            'planet_id': favorite.planet_id,
-            'film_id': favorite.film_id
-        })
-    return jsonify(result), 200
-
-@app.route('/favorite/user/<int:user_id>/planet/<int:planet_id>', methods=['POST']) #FUNCIONA
+    query = Favorite.query.filter_by(user_id=user_id)
+    queue = favorite_queue()
+    if queue is None:
+        return list_collection(Favorite.id, query)
+    query, queued = queue.overlay(query, user_id)
+    return list_collection(Favorite.id, query, queued)
+
+@api.route('/user/<int:user_id>/favorites:batch', methods=['POST'])
+def add_favorites_batch(user_id):
+    items = parse_batch(request.get_json(silent=True))
+    flush_queued_favorites()
+    return jsonify(add_favorites(user_id, items)), 200
+
+@api.route('/user/<int:user_id>/favorites:batch', methods=['DELETE'])
+def delete_favorites_batch(user_id):
+    items = parse_batch(request.get_json(silent=True))
+    flush_queued_favorites()
+    return jsonify(delete_favorites(user_id, items)), 200
+
+@api.route('/favorite/user/<int:user_id>/planet/<int:planet_id>', methods=['POST']) #FUNCIONA
 def add_favorite_planet(planet_id, user_id):
-    favorite = Favorite(user_id=user_id, planet_id=planet_id)
-    db.session.add(favorite)
-    db.session.commit()
+    queue = favorite_queue()
+    if queue is not None:
+        queue.add(user_id, 'planet', planet_id)
+        return jsonify({"message": "Favorite planet queued"}), 202
+    add_favorite(user_id, 'planet', planet_id)
     return jsonify({"message": "Favorite planet added successfully"}), 200
 
-@app.route('/favorite/user/<int:user_id>/planet/<int:planet_id>', methods=['DELETE']) #FUNCIONA
+@api.route('/favorite/user/<int:user_id>/planet/<int:planet_id>', methods=['DELETE']) #FUNCIONA
 def delete_favorite_planet(planet_id, user_id):
-    favorite = Favorite.query.filter_by(user_id=user_id, planet_id=planet_id).first()
-    if favorite:
-        db.session.delete(favorite)
-        db.session.commit()
+    queue = favorite_queue()
+    if queue is not None:
+        if queue.remove(user_id, 'planet', planet_id):
+            return jsonify({"message": "Favorite planet removal queued"}), 202
+        return jsonify({'error': 'Favorite planet not found'}), 404
+    if delete_favorite(user_id, 'planet', planet_id):
         return jsonify({"message": "Favorite planet deleted successfully"}), 200
     else:
         return jsonify({'error': 'Favorite planet not found'}), 404
     
-@app.route('/favorite/user/<int:user_id>/people/<int:people_id>', methods=['POST'])
+@api.route('/favorite/user/<int:user_id>/people/<int:people_id>', methods=['POST'])
 def add_favorite_people(people_id, user_id):
-    favorite = Favorite(user_id=user_id, people_id=people_id)
-    
-    db.session.add(favorite)
-    db.session.commit()
+    queue = favorite_queue()
+    if queue is not None:
+        queue.add(user_id, 'people', people_id)
+        return jsonify({"message": "Favorite people queued"}), 202
+    add_favorite(user_id, 'people', people_id)
     return jsonify({"message": "Favorite people added successfully"}), 200
     
 
-@app.route('/favorite/user/<int:user_id>/people/<int:people_id>', methods=['DELETE'])
+@api.route('/favorite/user/<int:user_id>/people/<int:people_id>', methods=['DELETE'])
 def delete_favorite_people(people_id, user_id):
-    favorite = Favorite.query.filter_by(user_id=user_id, people_id=people_id).first()  
-    if favorite:
-        db.session.delete(favorite)
-        db.session.commit()
+    queue = favorite_queue()
+    if queue is not None:
+        if queue.remove(user_id, 'people', people_id):
+            return jsonify({"message": "Favorite people removal queued"}), 202
+        return jsonify({'error': 'Favorite people not found'}), 404
+    if delete_favorite(user_id, 'people', people_id):
         return jsonify({"message": "Favorite people deleted successfully"}), 200
     else:
         return jsonify({'error': 'Favorite people not found'}), 404
 
     
 
-@app.route('/films', methods=['GET']) #FUNCIONA
+@api.route('/films', methods=['GET']) #FUNCIONA
+@rate_cost(RATE_COST_COLLECTION, stream=RATE_COST_STREAM)
+@cached(*source_models(Film))
 def get_films():
-    films = Film.query.all()
-    result = []
-    for film in films:
-        result.append({
-            'id': film.film_id,
-            'title': film.title,
-            'director': film.director_id if film.director_id else None,
-            'opening': film.opening
-        })
-    return jsonify(result), 200
-
-@app.route('/films/<int:film_id>', methods=['GET']) #FUNCIONA
+    return list_collection(Film.film_id)
+
+@api.route('/films/<int:film_id>', methods=['GET']) #FUNCIONA
+@cached(*source_models(Film))
 def get_film(film_id):
-    film = Film.query.get(film_id)
-    if film:
-        result = {
-            'id': film.film_id,
-            'title': film.title,
-            'director': film.director_id if film.director_id else None,
-            'opening': film.opening
-        }
-        return jsonify(result), 200
+    film = get_expanded(Film, film_id)
+    if film is not None:
+        return jsonify(film), 200
     else:
         return jsonify({'error': 'Film not found'}), 404
 
-@app.route('/starships', methods=['GET']) #FUNCIONA
+@api.route('/starships', methods=['GET']) #FUNCIONA
+@rate_cost(RATE_COST_COLLECTION, stream=RATE_COST_STREAM)
+@conditional(*source_models(Starship))
 def get_starships():
-    starships = Starship.query.all()
-    result = []
-    for starship in starships:
-        result.append({
-            'id': starship.starship_id,
-            'name': starship.name,
-            'pilot': starship.pilot,
-        })
-    return jsonify(result), 200
-
-@app.route('/starships/<int:starship_id>', methods=['GET']) #FUNCIONA
+    return list_collection(Starship.starship_id)
+
+@api.route('/starships/<int:starship_id>', methods=['GET']) #FUNCIONA
+@conditional(*source_models(Starship))
 def get_starship(starship_id):
-    starship = Starship.query.get(starship_id)
-    if starship:
-        result = {
-            'id': starship.starship_id,
-            'name': starship.name,
-            'pilot': starship.pilot,
-            
-        }
-        return jsonify(result), 200
+    starship = get_expanded(Starship, starship_id)
+    if starship is not None:
+        return jsonify(starship), 200
     else:
         return jsonify({'error': 'Starship not found'}), 404
 
-@app.route('/vehicles', methods=['GET']) #FUNCIONA
+@api.route('/vehicles', methods=['GET']) #FUNCIONA
+@rate_cost(RATE_COST_COLLECTION, stream=RATE_COST_STREAM)
+@cached(*source_models(Vehicle))
 def get_vehicles():
-    vehicles = Vehicle.query.all()
-    result = []
-    for vehicle in vehicles:
-        result.append({
-            'id': vehicle.vehicle_id,
-            'name': vehicle.name,
-            'model': vehicle.model,
-        })
-    return jsonify(result), 200
-
-@app.route('/vehicles/<int:vehicle_id>', methods=['GET']) #FUNCIONA
+    return list_collection(Vehicle.vehicle_id)
+
+@api.route('/vehicles/<int:vehicle_id>', methods=['GET']) #FUNCIONA
+@cached(*source_models(Vehicle))
 def get_vehicle(vehicle_id):
-    vehicle = Vehicle.query.get(vehicle_id)
-    if vehicle:
-        result = {
-            'id': vehicle.vehicle_id,
-            'name': vehicle.name,
-            'model': vehicle.model,
-        }
-        return jsonify(result), 200
+    vehicle = get_expanded(Vehicle, vehicle_id)
+    if vehicle is not None:
+        return jsonify(vehicle), 200
     else:
         return jsonify({'error': 'Vehicle not found'}), 404
 
-@app.route('/genders', methods=['GET']) #FUNCIONA
+@api.route('/genders', methods=['GET']) #FUNCIONA
+@rate_cost(RATE_COST_COLLECTION, stream=RATE_COST_STREAM)
+@cached(*source_models(Gender))
 def get_genders():
-    genders = Gender.query.all()
-    result = []
-    for gender in genders:
-        result.append({
-            'id': gender.gender_id,
-            'type': gender.type
-        })
-    return jsonify(result), 200
-
-@app.route('/genders/<int:gender_id>', methods=['GET']) #FUNCIONA
+    return list_collection(Gender.gender_id)
+
+@api.route('/genders/<int:gender_id>', methods=['GET']) #FUNCIONA
+@cached(*source_models(Gender))
 def get_gender(gender_id):
-    gender = Gender.query.get(gender_id)
-    if gender:
-        result = {
-            'id': gender.gender_id,
-            'type': gender.type
-        }
-        return jsonify(result), 200
+    gender = get_expanded(Gender, gender_id)
+    if gender is not None:
+        return jsonify(gender), 200
     else:
         return jsonify({'error': 'Gender not found'}), 404
 
-@app.route('/species', methods=['GET']) #FUNCIONA
+@api.route('/species', methods=['GET']) #FUNCIONA
+@rate_cost(RATE_COST_COLLECTION, stream=RATE_COST_STREAM)
+@cached(*source_models(Specie))
 def get_species():
-    species = Specie.query.all()
-    result = []
-    for specie in species:
-        result.append({
-            'id': specie.specie_id,
-            'languaje': specie.languaje,
-        })
-    return jsonify(result), 200
-
-@app.route('/species/<int:specie_id>', methods=['GET']) #FUNCIONA
+    return list_collection(Specie.specie_id)
+
+@api.route('/species/<int:specie_id>', methods=['GET']) #FUNCIONA
+@cached(*source_models(Specie))
 def get_specie(specie_id):
-    specie = Specie.query.get(specie_id)
-    if specie:
-        result = {
-            'id': specie.specie_id,
-            'languaje': specie.languaje,
-        }
-        return jsonify(result), 200
+    specie = get_expanded(Specie, specie_id)
+    if specie is not None:
+        return jsonify(specie), 200
     else:
         return jsonify({'error': 'Specie not found'}), 404
 
-@app.route('/directors', methods=['GET']) #FUNCIONA
+@api.route('/directors', methods=['GET']) #FUNCIONA
+@rate_cost(RATE_COST_COLLECTION, stream=RATE_COST_STREAM)
+@cached(*source_models(Director))
 def get_directors():
-    directors = Director.query.all()
-    result = []
-    for director in directors:
-        result.append({
-            'id': director.directo_id,
-            'name': director.name
-        })
-    return jsonify(result), 200
-
-@app.route('/directors/<int:director_id>', methods=['GET']) #FUNCIONA
+    return list_collection(Director.directo_id)
+
+@api.route('/directors/<int:director_id>', methods=['GET']) #FUNCIONA
+@cached(*source_models(Director))
 def get_director(director_id):
-    director = Director.query.get(director_id)
-    if director:
-        result = {
-            'id': director.directo_id,
-            'name': director.name
-        }
-        return jsonify(result), 200
+    director = get_expanded(Director, director_id)
+    if director is not None:
+        return jsonify(director), 200
     else:
         return jsonify({'error': 'Director not found'}), 404
 
 
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
+    app = create_app()
     app.run(host='0.0.0.0', port=PORT, debug=False)
-
@@ -0,0 +1,236 @@
+"""
+ASGI entry point, next to wsgi.py:
+
+    uvicorn asgi:application --app-dir src --workers 4
+
+The read-only collection and detail routes run as coroutines over
+SQLAlchemy's asyncio engine (aiosqlite locally, asyncpg on Postgres), so a
+slow query parks a coroutine instead of a whole worker. They reuse the Flask
+app's routing, serializers, filters, pagination, response cache,
+conditional GETs and before/after request hooks (compression included),
+and always read from the primary.
+Every other request (writes, ?expand=, NDJSON streams, /search, admin,
+metrics, and a user's favorites under FAVORITES_WRITE_BEHIND) is handed to
+the Flask app on a thread. The synchronous work an async view still does
+(hooks, change stamps, the response and entity caches) runs on a thread too,
+through asyncio.to_thread, which carries the request context along
+"""
+import io
+import sys
+import asyncio
+from asgiref.wsgi import WsgiToAsgi
+from flask import jsonify
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app import create_app
+from models import db, User, People, Planet, Film, Starship, Vehicle, Gender, Specie, Director, Favorite
+from queries import model_query
+from serializers import requested_fields
+from pagination import get_page_args, seek, ordered, page_of
+from search import apply_search_filters
+from filters import apply_filters, requested_sort
+from streaming import wants_stream
+from cache import cache_lookup, cache_store, cached_reply, entity_cache
+from expand import source_tables
+from stamps import last_modified, is_modified_since, not_modified, set_last_modified
+from pool import async_database_uri, async_engine_options, instrument_pool
+from metrics import instrument_engine
+
+# endpoint -> (key column, column the listing is scoped to by the view argument of the same name)
+COLLECTIONS = {
+    'api.handle_hello': (User.id, None),
+    'api.get_people': (People.character_id, None),
+    'api.get_planets': (Planet.planet_id, None),
+    'api.get_user_favorites': (Favorite.id, Favorite.user_id),
+    'api.get_films': (Film.film_id, None),
+    'api.get_starships': (Starship.starship_id, None),
+    'api.get_vehicles': (Vehicle.vehicle_id, None),
+    'api.get_genders': (Gender.gender_id, None),
+    'api.get_species': (Specie.specie_id, None),
+    'api.get_directors': (Director.directo_id, None),
+}
+# endpoint -> (model, view argument holding the primary key, 404 body)
+ENTITIES = {
+    'api.get_user': (User, 'user_id', {'message': 'User not found'}),
+    'api.get_person': (People, 'people_id', {'error': 'Person not found'}),
+    'api.get_planet': (Planet, 'planet_id', {'error': 'Planet not found'}),
+    'api.get_film': (Film, 'film_id', {'error': 'Film not found'}),
+    'api.get_starship': (Starship, 'starship_id', {'error': 'Starship not found'}),
+    'api.get_vehicle': (Vehicle, 'vehicle_id', {'error': 'Vehicle not found'}),
+    'api.get_gender': (Gender, 'gender_id', {'error': 'Gender not found'}),
+    'api.get_specie': (Specie, 'specie_id', {'error': 'Specie not found'}),
+    'api.get_director': (Director, 'director_id', {'error': 'Director not found'}),
+}
+# migrations run from the `flask` CLI, not from the server workers
+flask_app = create_app({'ENABLE_MIGRATIONS': False})
+if 'favorite_queue' in flask_app.extensions:
+    # the listing overlays queued write-behind ops, which only the Flask view knows how to do
+    del COLLECTIONS['api.get_user_favorites']
+# parameters only the synchronous views implement
+SYNC_ONLY_PARAMS = ('expand', 'profile')
+
+database_uri = flask_app.config['SQLALCHEMY_DATABASE_URI']
+async_engine = create_async_engine(async_database_uri(database_uri), **async_engine_options(database_uri))
+instrument_pool(async_engine.sync_engine)
+instrument_engine(async_engine.sync_engine)
+async_session = async_sessionmaker(async_engine, expire_on_commit=False)
+wsgi_application = WsgiToAsgi(flask_app)
+
+
+def _pk(model):
+    return model.__mapper__.primary_key[0]
+
+
+async def list_collection(key_column, condition=None):
+    model = key_column.class_
+    fields = requested_fields(model)
+    sort = requested_sort(model)
+    statement = select(model) if condition is None else select(model).where(condition)
+    statement = model_query(model, fields, statement, sort)
+    statement = apply_filters(apply_search_filters(statement, model), model)
+    limit, after = get_page_args()
+    statement = ordered(seek(statement, key_column, after, sort), key_column, sort).limit(limit + 1)
+    async with async_session() as session:
+        rows = (await session.execute(statement)).unique().scalars().all()
+    page = page_of(rows, limit, key_column, sort)
+    dump = model.serializer().getter(fields)
+    return jsonify([dump(item) for item in page.items]), 200, page.headers()
+
+
+async def get_entity(model, pk, missing):
+    fields = requested_fields(model)
+    # same key as app.get_expanded, so both front ends share entries
+    key = await asyncio.to_thread(entity_cache.key, source_tables(model), (model.__tablename__, pk, fields, ()))
+    hit, data = await asyncio.to_thread(entity_cache.get, key)
+    if not hit:
+        statement = model_query(model, fields, select(model)).where(_pk(model) == pk)
+        async with async_session() as session:
+            item = (await session.execute(statement)).unique().scalars().first()
+        data = None if item is None else item.serialize(fields)
+        await asyncio.to_thread(entity_cache.set, key, data)
+    if data is None:
+        return jsonify(missing), 404
+    return jsonify(data), 200
+
+
+async def run_view(endpoint, view_args):
+    if endpoint in COLLECTIONS:
+        key_column, scope = COLLECTIONS[endpoint]
+        condition = None if scope is None else scope == view_args[scope.key]
+        return await list_collection(key_column, condition)
+    model, argument, missing = ENTITIES[endpoint]
+    return await get_entity(model, view_args[argument], missing)
+
+
+async def dispatch(endpoint, view_args):
+    """Run an async view through the Flask app's hooks, error handlers and response cache"""
+    try:
+        rv = await asyncio.to_thread(flask_app.preprocess_request)
+        # the async engine reads from the primary, so its stamps apply
+        db.session.info.pop('replica', None)
+        if rv is None:
+            view = flask_app.view_functions[endpoint]
+            tables = getattr(view, 'cache_tables', None)
+            stamped = getattr(view, 'stamp_tables', None)
+            if stamped is not None:
+                modified = await asyncio.to_thread(last_modified, stamped)
+                if not is_modified_since(modified):
+                    rv = not_modified(modified)
+                else:
+                    rv = flask_app.make_response(await run_view(endpoint, view_args))
+                    if rv.status_code == 200:
+                        set_last_modified(rv, modified)
+            elif tables is None:
+                rv = await run_view(endpoint, view_args)
+            else:
+                key, entry, generation = await asyncio.to_thread(cache_lookup, tables)
+                if entry is None:
+                    rv = flask_app.make_response(await run_view(endpoint, view_args))
+                    entry = await asyncio.to_thread(cache_store, key, rv, tables, generation)
+                if entry is not None:
+                    # compresses the body on the entry's first hit for an encoding
+                    rv = await asyncio.to_thread(cached_reply, entry)
+        response = flask_app.make_response(rv)
+    except Exception as error:
+        try:
+            response = flask_app.make_response(flask_app.handle_user_exception(error))
+        except Exception as unhandled:
+            response = flask_app.make_response(flask_app.handle_exception(unhandled))
+    # after_request hooks: compression, metrics and rate limit headers
+    return await asyncio.to_thread(flask_app.process_response, response)
+
+
+def wsgi_environ(scope):
+    """A WSGI environ for a body-less ASGI HTTP request, so the Flask request context can be pushed"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+def async_endpoint(request):
+    """The endpoint to serve natively, or None to hand the request to the Flask app"""
+    if request.method != 'GET' or request.routing_exception is not None or request.url_rule is None:
+        return None
+    endpoint = request.url_rule.endpoint
+    if endpoint not in COLLECTIONS and endpoint not in ENTITIES:
+        return None
+    if any(param in request.args for param in SYNC_ONLY_PARAMS) or wants_stream():
+        return None
+    return endpoint
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        raise ValueError('Unsupported ASGI scope: ' + scope['type'])
+    with flask_app.request_context(wsgi_environ(scope)) as context:
+        endpoint = async_endpoint(context.request)
+        if endpoint is not None:
+            response = await dispatch(endpoint, context.request.view_args)
+    if endpoint is None:
+        return await wsgi_application(scope, receive, send)
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
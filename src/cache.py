@@ -0,0 +1,290 @@
+"""
+In-process read-through response cache for the reference-data routes.
+Entries are tagged with the tables they were built from and dropped when a
+commit (API route or Flask-Admin view) touches any of those tables. Each
+entry also keeps its compressed copies and the Last-Modified of its tables;
+a hit whose tables have since been stamped newer (a commit in another worker
+process) is dropped as well.
+
+Single-entity lookups read through a second tier, the entity cache, kept in
+a pluggable backend (cache_backends.py) that worker processes can share.
+Its keys embed a version per table the entity was built from; a commit bumps
+the versions of the tables it wrote, so stale keys are never read again and
+age out on their TTL
+"""
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, request, current_app
+from sqlalchemy import event
+from models import db
+from streaming import wants_stream
+from compression import COMPRESS_MIN_SIZE, compress, negotiate, encode_response
+from stamps import last_modified, replica_caught_up, set_last_modified
+from cache_backends import CACHE_BACKEND, CACHE_URL, LocalBackend, make_backend
+
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 300))
+RESPONSE_CACHE_MAX_BODY = int(os.environ.get('RESPONSE_CACHE_MAX_BODY', 1024 * 1024))
+CACHED_HEADERS = ('Content-Type', 'X-Next-Cursor', 'Link')
+ENTITY_CACHE_TTL = float(os.environ.get('ENTITY_CACHE_TTL', 300))
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    def __init__(self, body, headers, tables, modified=None):
+        self.body = body
+        self.headers = headers
+        self.tables = tables
+        self.modified = modified
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.expires = time.monotonic() + RESPONSE_CACHE_TTL
+        self._encoded = {}
+
+    def encoded(self, encoding):
+        """The body compressed with `encoding`, compressed on first use"""
+        body = self._encoded.get(encoding)
+        if body is None:
+            # racing threads compress the same bytes; either copy is fine
+            body = self._encoded[encoding] = compress(self.body, encoding)
+        return body
+
+
+class ResponseCache:
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def generation(self, tables):
+        with self._lock:
+            return tuple(self._generations.get(table, 0) for table in sorted(tables))
+
+    def set(self, key, entry, generation):
+        with self._lock:
+            # a commit landed while the response was being built: it may be stale
+            if generation != tuple(self._generations.get(table, 0) for table in sorted(entry.tables)):
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key, entry):
+        with self._lock:
+            # another thread may already have replaced it with a fresh entry
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def invalidate(self, tables):
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            stale = [key for key, entry in self._entries.items() if entry.tables & tables]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache()
+
+
+class EntityCache:
+    """Fails open: while the backend is unreachable every lookup is a miss"""
+
+    def __init__(self, backend, ttl=ENTITY_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    @staticmethod
+    def base():
+        # start from a random base: a version that was evicted and recreated
+        # must not line up with keys written under its earlier life
+        return random.getrandbits(48)
+
+    def versions(self, tables):
+        tables = sorted(tables)
+        names = ['version:' + table for table in tables]
+        versions = self.backend.get_many(names)
+        for i, version in enumerate(versions):
+            if version is None:
+                versions[i] = self.backend.add(names[i], str(self.base()).encode())
+        return [int(version) for version in versions]
+
+    def key(self, tables, parts):
+        """A key for `parts` that changes whenever any of `tables` is written; None when the backend is down"""
+        try:
+            versions = self.versions(tables)
+        except self.backend.errors as error:
+            logger.warning('entity cache unavailable: %s', error)
+            return None
+        digest = hashlib.sha1(repr((parts, versions)).encode()).hexdigest()
+        return 'entity:{}:{}'.format(parts[0], digest)
+
+    def get(self, key):
+        """(True, value) on a hit, (False, None) on a miss; value may be None for a missing row"""
+        if key is None:
+            return False, None
+        try:
+            raw = self.backend.get(key)
+        except self.backend.errors as error:
+            logger.warning('entity cache unavailable: %s', error)
+            return False, None
+        if raw is None:
+            return False, None
+        return True, current_app.json.loads(raw)
+
+    def set(self, key, value):
+        if key is None:
+            return
+        try:
+            self.backend.set(key, current_app.json.dumps(value).encode(), self.ttl)
+        except self.backend.errors as error:
+            logger.warning('entity cache unavailable: %s', error)
+
+    def read_through(self, tables, parts, build):
+        key = self.key(tables, parts)
+        hit, value = self.get(key)
+        if not hit:
+            value = build()
+            if replica_caught_up(tables):
+                self.set(key, value)
+        return value
+
+    def invalidate(self, tables):
+        try:
+            for table in tables:
+                self.backend.incr('version:' + table, seed=self.base())
+        except self.backend.errors as error:
+            # entries of these tables stay readable until ENTITY_CACHE_TTL runs out
+            logger.error('entity cache versions not bumped for %s: %s', ', '.join(sorted(tables)), error)
+
+
+entity_cache = EntityCache(LocalBackend())
+
+
+def cache_key():
+    return (request.host, request.path, tuple(sorted(request.args.items(multi=True))))
+
+
+def cache_lookup(tables):
+    """(key, entry or None, generation) for the current request; on a miss, generation
+    also pins the tables' change stamp from before the response is built"""
+    key = cache_key()
+    entry = response_cache.get(key)
+    modified = last_modified(tables)
+    if entry is not None:
+        # commits in other worker processes don't reach this cache; their stamps do
+        if modified is None or (entry.modified is not None and modified <= entry.modified):
+            return key, entry, None
+        response_cache.discard(key, entry)
+    return key, None, (response_cache.generation(tables), modified)
+
+
+def cache_store(key, response, tables, generation):
+    """Cache a freshly built response; None when it can't be cached"""
+    generation, modified = generation
+    if response.status_code != 200 or response.is_streamed or not replica_caught_up(tables):
+        return None
+    body = response.get_data()
+    if len(body) > RESPONSE_CACHE_MAX_BODY:
+        return None
+    headers = [(name, response.headers[name]) for name in CACHED_HEADERS if name in response.headers]
+    entry = CacheEntry(body, headers, tables, modified)
+    response_cache.set(key, entry, generation)
+    return entry
+
+
+def cached_reply(entry):
+    response = Response(entry.body, status=200, headers=entry.headers)
+    response.set_etag(entry.etag)
+    set_last_modified(response, entry.modified)
+    encoding = negotiate() if len(entry.body) >= COMPRESS_MIN_SIZE else None
+    if encoding is not None:
+        encode_response(response, encoding, entry.encoded(encoding))
+    return response.make_conditional(request)
+
+
+def cached(*models):
+    """Cache a GET view's 200 responses until TTL expiry or a commit on any of `models`"""
+    tables = frozenset(model.__tablename__ for model in models)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if wants_stream():
+                return view(*args, **kwargs)
+            key, entry, generation = cache_lookup(tables)
+            if entry is None:
+                response = current_app.make_response(view(*args, **kwargs))
+                entry = cache_store(key, response, tables, generation)
+                if entry is None:
+                    return response
+            return cached_reply(entry)
+        # lets other front ends (asgi.py) apply the same caching to this endpoint
+        wrapper.cache_tables = tables
+        return wrapper
+    return decorator
+
+
+def _record_changes(session, flush_context, instances):
+    changed = session.info.setdefault('changed_tables', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table is not None:
+            changed.add(table)
+
+
+def _record_statement(orm_execute_state):
+    # bulk INSERT/UPDATE/DELETE statements skip the flush, so catch them here
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        mark_changed(orm_execute_state.session, orm_execute_state.statement.table.name)
+
+
+def mark_changed(session, *tables):
+    """Record writes the session can't see (raw COPY), so they invalidate and stamp like any other"""
+    session.info.setdefault('changed_tables', set()).update(tables)
+
+
+def _invalidate_changes(session):
+    changed = session.info.pop('changed_tables', None)
+    if changed:
+        response_cache.invalidate(frozenset(changed))
+        entity_cache.invalidate(changed)
+
+
+def _discard_changes(session):
+    session.info.pop('changed_tables', None)
+
+
+def setup_cache(app):
+    entity_cache.backend = make_backend(app.config.get('CACHE_BACKEND', CACHE_BACKEND),
+                                        app.config.get('CACHE_URL', CACHE_URL))
+    # the session is shared by every app create_app() builds; hook it once
+    if event.contains(db.session, 'before_flush', _record_changes):
+        return
+    event.listen(db.session, 'before_flush', _record_changes)
+    event.listen(db.session, 'do_orm_execute', _record_statement)
+    event.listen(db.session, 'after_commit', _invalidate_changes)
+    event.listen(db.session, 'after_rollback', _discard_changes)
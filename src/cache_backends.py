@@ -0,0 +1,356 @@
+"""
+Key/value stores behind the entity cache. All three speak the same small
+bytes-in, bytes-out interface:
+
+- LocalBackend: an in-process LRU, one per worker
+- SharedMemoryBackend: a fixed-size hash table in an mmap'd file (under
+  /dev/shm when it exists) that every worker process on the host shares
+- RedisBackend: any Redis-compatible server, or a stand-in client with the
+  same methods (e.g. fakeredis)
+
+CACHE_BACKEND picks one: local, shared or redis (with CACHE_URL). The rate
+limiter (ratelimit.py) keeps its token buckets in a store of its own
+"""
+import os
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'local')
+CACHE_URL = os.environ.get('CACHE_URL', 'redis://localhost:6379/0')
+CACHE_PREFIX = os.environ.get('CACHE_PREFIX', 'api:')
+LOCAL_CACHE_SIZE = int(os.environ.get('LOCAL_CACHE_SIZE', 4096))
+SHARED_CACHE_PATH = os.environ.get('SHARED_CACHE_PATH', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'flask-api-cache'))
+SHARED_CACHE_SLOTS = int(os.environ.get('SHARED_CACHE_SLOTS', 8192))
+SHARED_CACHE_SLOT_SIZE = int(os.environ.get('SHARED_CACHE_SLOT_SIZE', 4096))
+
+
+class CacheBackend:
+    """Byte values under str keys; `ttl` is in seconds, None to keep until evicted"""
+    # what an unavailable store raises; callers treat these as a miss
+    errors = (OSError,)
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def add(self, key, value, ttl=None):
+        """Store `value` unless `key` is present; returns the value now stored"""
+        raise NotImplementedError
+
+    def incr(self, key, seed=0):
+        """Add one to the integer under `key` and return it; a missing key counts from `seed`"""
+        raise NotImplementedError
+
+    def update(self, key, function, ttl=None):
+        """Atomically store the first item of function(current value or None) and return
+        the second; `function` may run more than once and must not have side effects"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LocalBackend(CacheBackend):
+    def __init__(self, maxsize=LOCAL_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key, value, ttl):
+        self._entries[key] = (value, None if ttl is None else time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            current = self._live(key)
+            if current is not None:
+                return current
+            self._store(key, value, ttl)
+            return value
+
+    def incr(self, key, seed=0):
+        with self._lock:
+            value = int(self._live(key) or seed) + 1
+            self._store(key, str(value).encode(), None)
+            return value
+
+    def update(self, key, function, ttl=None):
+        with self._lock:
+            value, result = function(self._live(key))
+            self._store(key, value, ttl)
+            return result
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedMemoryBackend(CacheBackend):
+    """
+    An open-addressed hash table of fixed-size slots in a shared file mapping.
+    Each key hashes to a run of PROBES slots; a write takes the key's own slot,
+    an empty or expired one, or else evicts the one that expires soonest (keys
+    stored without a TTL go last). Values that don't fit in a slot are not
+    cached. flock() serializes processes and a lock serializes threads
+    """
+    MAGIC = b'APICACH1'
+    HEADER = struct.Struct('<8sII')
+    SLOT = struct.Struct('<QdII')  # key hash (0: empty), expiry (0: none), key length, value length
+    PROBES = 4
+
+    def __init__(self, path=SHARED_CACHE_PATH, slots=SHARED_CACHE_SLOTS, slot_size=SHARED_CACHE_SLOT_SIZE):
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.size = self.HEADER.size + slots * slot_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._open()
+
+    def _open(self):
+        # a forked worker must not share the parent's open file: flock() locks belong to it
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.size)
+            self._map = mmap.mmap(fd, self.size)
+            if self.HEADER.unpack_from(self._map, 0) != (self.MAGIC, self.slots, self.slot_size):
+                self._map[:] = bytes(self.size)
+                self.HEADER.pack_into(self._map, 0, self.MAGIC, self.slots, self.slot_size)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._pid = os.getpid()
+
+    @contextmanager
+    def _locked(self, exclusive):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _hash(self, key):
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') or 1
+
+    def _offsets(self, digest):
+        first = digest % self.slots
+        return [self.HEADER.size + ((first + i) % self.slots) * self.slot_size for i in range(self.PROBES)]
+
+    def _find(self, key, digest, now):
+        """(offset of the key's live slot or None, offset to write the key into)"""
+        target, victim = None, None
+        for offset in self._offsets(digest):
+            slot_hash, expires, key_length, value_length = self.SLOT.unpack_from(self._map, offset)
+            start = offset + self.SLOT.size
+            if slot_hash == digest and self._map[start:start + key_length] == key:
+                if expires and expires < now:
+                    return None, offset
+                return offset, offset
+            if not slot_hash or (expires and expires < now):
+                target = target or offset
+            elif victim is None or (expires or float('inf')) < victim[1]:
+                victim = (offset, expires or float('inf'))
+        return None, target or victim[0]
+
+    def _read(self, offset):
+        _, _, key_length, value_length = self.SLOT.unpack_from(self._map, offset)
+        start = offset + self.SLOT.size + key_length
+        return bytes(self._map[start:start + value_length])
+
+    def _write(self, offset, key, digest, value, ttl, now):
+        if self.SLOT.size + len(key) + len(value) > self.slot_size:
+            return False
+        self.SLOT.pack_into(self._map, offset, digest, now + ttl if ttl else 0.0, len(key), len(value))
+        start = offset + self.SLOT.size
+        self._map[start:start + len(key) + len(value)] = key + value
+        return True
+
+    def get(self, key):
+        key = key.encode()
+        digest = self._hash(key)
+        with self._locked(False):
+            found, _ = self._find(key, digest, time.time())
+            return None if found is None else self._read(found)
+
+    def get_many(self, keys):
+        now = time.time()
+        values = []
+        with self._locked(False):
+            for key in keys:
+                key = key.encode()
+                found, _ = self._find(key, self._hash(key), now)
+                values.append(None if found is None else self._read(found))
+        return values
+
+    def set(self, key, value, ttl=None):
+        key = key.encode()
+        digest = self._hash(key)
+        with self._locked(True):
+            now = time.time()
+            found, offset = self._find(key, digest, now)
+            if not self._write(offset, key, digest, value, ttl, now) and found is not None:
+                # too big for a slot: drop the old value rather than keep serving it
+                self.SLOT.pack_into(self._map, found, 0, 0.0, 0, 0)
+
+    def add(self, key, value, ttl=None):
+        key = key.encode()
+        digest = self._hash(key)
+        with self._locked(True):
+            now = time.time()
+            found, offset = self._find(key, digest, now)
+            if found is not None:
+                return self._read(found)
+            self._write(offset, key, digest, value, ttl, now)
+            return value
+
+    def incr(self, key, seed=0):
+        key = key.encode()
+        digest = self._hash(key)
+        with self._locked(True):
+            now = time.time()
+            found, offset = self._find(key, digest, now)
+            value = (int(self._read(found)) if found is not None else seed) + 1
+            self._write(offset, key, digest, str(value).encode(), None, now)
+            return value
+
+    def update(self, key, function, ttl=None):
+        key = key.encode()
+        digest = self._hash(key)
+        with self._locked(True):
+            now = time.time()
+            found, offset = self._find(key, digest, now)
+            value, result = function(None if found is None else self._read(found))
+            self._write(offset, key, digest, value, ttl, now)
+            return result
+
+    def delete(self, key):
+        key = key.encode()
+        digest = self._hash(key)
+        with self._locked(True):
+            found, _ = self._find(key, digest, time.time())
+            if found is not None:
+                self.SLOT.pack_into(self._map, found, 0, 0.0, 0, 0)
+
+    def clear(self):
+        with self._locked(True):
+            self._map[self.HEADER.size:] = bytes(self.size - self.HEADER.size)
+
+
+class RedisBackend(CacheBackend):
+    """Keys live under `prefix`, so clear() only removes this app's entries"""
+
+    def __init__(self, client=None, url=CACHE_URL, prefix=CACHE_PREFIX):
+        # imported here: redis costs every worker's startup even when another backend is in use
+        try:
+            import redis
+        except ImportError:
+            redis = None
+        if client is None:
+            if redis is None:
+                raise RuntimeError('CACHE_BACKEND=redis needs the redis package')
+            client = redis.Redis.from_url(url)
+        if redis is not None:
+            self.errors = (OSError, redis.RedisError)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def get_many(self, keys):
+        return self.client.mget([self.prefix + key for key in keys]) if keys else []
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, px=int(ttl * 1000) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        if self.client.set(self.prefix + key, value, px=int(ttl * 1000) if ttl else None, nx=True):
+            return value
+        return self.client.get(self.prefix + key)
+
+    def incr(self, key, seed=0):
+        key = self.prefix + key
+        if not seed:
+            return self.client.incr(key)
+        # MULTI/EXEC: nothing can evict the key between the seed and the increment
+        pipe = self.client.pipeline()
+        pipe.set(key, seed, nx=True)
+        pipe.incr(key)
+        return pipe.execute()[1]
+
+    def update(self, key, function, ttl=None):
+        key = self.prefix + key
+
+        def transaction(pipe):
+            # WATCH/MULTI: rerun when another client wrote the key in between
+            value, result = function(pipe.get(key))
+            pipe.multi()
+            pipe.set(key, value, px=int(ttl * 1000) if ttl else None)
+            return result
+        return self.client.transaction(transaction, key, value_from_callable=True)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def make_backend(name=CACHE_BACKEND, url=CACHE_URL, **shared):
+    """`shared`: SharedMemoryBackend settings (path, slots, slot_size)"""
+    if name == 'local':
+        return LocalBackend()
+    if name == 'shared':
+        return SharedMemoryBackend(**shared)
+    if name == 'redis':
+        return RedisBackend(url=url)
+    raise ValueError('Unknown CACHE_BACKEND: {}'.format(name))
@@ -0,0 +1,128 @@
+"""
+Negotiated response compression: zstd, brotli or gzip, picked from
+Accept-Encoding, for JSON and text bodies above COMPRESS_MIN_SIZE. Streamed
+(NDJSON) bodies are compressed chunk by chunk and flushed after each one.
+Cached responses carry their own compressed copies (see cache.py), so a hot
+entry is compressed once per encoding rather than on every hit
+"""
+import os
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+ZSTD_LEVEL = int(os.environ.get('ZSTD_LEVEL', 3))
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+
+def _gzip(body):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def _gzip_stream():
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return (lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)), compressor.flush
+
+
+def _brotli(body):
+    return brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+def _brotli_stream():
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    return (lambda chunk: compressor.process(chunk) + compressor.flush()), compressor.finish
+
+
+def _zstd(body):
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+
+
+def _zstd_stream():
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return (lambda chunk: compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)), compressor.flush
+
+
+# encoding -> (compress a whole body, make a (compress chunk, finish) pair), in server preference order
+ENCODERS = {}
+if zstandard is not None:
+    ENCODERS['zstd'] = (_zstd, _zstd_stream)
+if brotli is not None:
+    ENCODERS['br'] = (_brotli, _brotli_stream)
+ENCODERS['gzip'] = (_gzip, _gzip_stream)
+COMPRESS_ENCODINGS = [
+    encoding for encoding in os.environ.get('COMPRESS_ENCODINGS', ','.join(ENCODERS)).split(',')
+    if encoding in ENCODERS
+]
+
+
+def compressible(response):
+    mimetype = response.mimetype or ''
+    return mimetype.startswith(COMPRESSIBLE_TYPES) and 'Content-Encoding' not in response.headers
+
+
+def negotiate():
+    """The encoding to answer the current request with, or None for identity"""
+    if 'Accept-Encoding' not in request.headers or not COMPRESS_ENCODINGS:
+        return None
+    return request.accept_encodings.best_match(COMPRESS_ENCODINGS)
+
+
+def compress(body, encoding):
+    return ENCODERS[encoding][0](body)
+
+
+def compress_stream(chunks, encoding):
+    compress_chunk, finish = ENCODERS[encoding][1]()
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compress_chunk(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def encode_response(response, encoding, body=None):
+    """Switch `response` to `encoding`; `body` is an already compressed copy of its data"""
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(body if body is not None else compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        # a strong validator names one representation
+        response.set_etag('{}-{}'.format(etag, encoding))
+    return response
+
+
+def compress_response(response):
+    if not compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    if request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    if not response.is_streamed and (response.calculate_content_length() or 0) < COMPRESS_MIN_SIZE:
+        return response
+    encoding = negotiate()
+    if encoding is None:
+        return response
+    return encode_response(response, encoding)
+
+
+def setup_compression(app):
+    app.after_request(compress_response)
@@ -0,0 +1,128 @@
+"""
+?expand= support: embed related entities in a response, resolving each
+requested relation through the request's loaders (one batched `WHERE ... IN`
+query per relation for the whole page). Each distinct entity is serialized
+once per response and the same object is shared by every row that references it
+"""
+from flask import request
+from utils import APIException
+from models import People, Planet, Film, Starship, Vehicle, Gender, Specie, Director
+from loaders import loader_for
+
+
+class ToOne:
+    """Replace `name` with the entity the foreign key `fk` points at"""
+    many = False
+
+    def __init__(self, fk, target, as_list=False):
+        self.fk = fk
+        self.target = target
+        self.as_list = as_list
+
+
+class ToMany:
+    """Set `name` to the list of `target` rows whose `fk` points back at this row"""
+    many = True
+
+    def __init__(self, fk, target):
+        self.fk = fk
+        self.target = target
+
+
+EXPANSIONS = {
+    People: {
+        'planet': ToOne(People.planet_id, Planet),
+        # People.film is a single film, rendered as a list to match the `films` field
+        'films': ToOne(People.film_id, Film, as_list=True),
+        'vehicle': ToOne(People.vehicle_id, Vehicle),
+        'gender': ToOne(People.gender_id, Gender),
+        'specie': ToOne(People.specie_id, Specie),
+        'starships': ToMany(Starship.pilot_id, Starship),
+    },
+    Film: {
+        'director': ToOne(Film.director_id, Director),
+    },
+    Starship: {
+        'pilot': ToOne(Starship.pilot_id, People),
+    },
+}
+
+
+def requested_expand(model):
+    """Validated relation names from ?expand=a,b; empty when absent"""
+    raw = request.args.get('expand')
+    if not raw:
+        return ()
+    names = [name.strip() for name in raw.split(',') if name.strip()]
+    available = EXPANSIONS.get(model, {})
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise APIException('Cannot expand: ' + ', '.join(unknown), status_code=400)
+    return tuple(dict.fromkeys(names))
+
+
+def source_models(model, names=None):
+    """Every model a serialized `model` row, expanded by `names`, is read from: its serializer's
+    related models plus each expanded target's. None stands for every expansion `model` offers"""
+    if names is None:
+        names = EXPANSIONS.get(model, ())
+    models = dict.fromkeys(model.serializer().models())
+    for name in names:
+        models.update(dict.fromkeys(EXPANSIONS[model][name].target.serializer().models()))
+    return tuple(models)
+
+
+def source_tables(model, names=()):
+    """Names of every table a serialized `model` row, expanded by `names`, is read from"""
+    return {source.__tablename__ for source in source_models(model, names)}
+
+
+def expand_load_columns(model, names):
+    """Foreign key columns the rows must have loaded for `names` to expand without lazy loads"""
+    return [EXPANSIONS[model][name].fk for name in names if not EXPANSIONS[model][name].many]
+
+
+class Expander:
+    """Resolves expansions for one response, remembering every entity it has serialized"""
+
+    def __init__(self, model, names):
+        self.model = model
+        self.names = names
+        self.seen = {}
+
+    def _dump(self, target, row):
+        key = (target, row.__mapper__.primary_key_from_instance(row)[0])
+        dumped = self.seen.get(key)
+        if dumped is None:
+            dumped = self.seen[key] = target.serializer().getter()(row)
+        return dumped
+
+    def __call__(self, rows, data):
+        for name in self.names:
+            spec = EXPANSIONS[self.model][name]
+            if spec.many:
+                self._expand_many(name, spec, rows, data)
+            else:
+                self._expand_one(name, spec, rows, data)
+        return data
+
+    def _expand_one(self, name, spec, rows, data):
+        fk_key = spec.fk.key
+        entities = loader_for(spec.target).load_many(getattr(row, fk_key) for row in rows)
+        for row, item in zip(rows, data):
+            entity = entities.get(getattr(row, fk_key))
+            dumped = None if entity is None else self._dump(spec.target, entity)
+            if spec.as_list:
+                item[name] = [dumped] if dumped is not None else []
+            else:
+                item[name] = dumped
+
+    def _expand_many(self, name, spec, rows, data):
+        mapper = self.model.__mapper__
+        owners = [mapper.primary_key_from_instance(row)[0] for row in rows]
+        loader = loader_for(spec.target, spec.fk)
+        children = loader.load_many(owners)
+        for owner, item in zip(owners, data):
+            item[name] = [self._dump(spec.target, child) for child in children.get(owner, [])]
+        # each owner appears once per response: keeping its children would only grow an NDJSON export's memory
+        loader.forget(owners)
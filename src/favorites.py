@@ -0,0 +1,183 @@
+"""
+Favorite writes. Adding a favorite is an idempotent upsert that leans on the
+per-kind partial unique indexes instead of a read-then-write round trip;
+the batch helpers apply many of them in a single transaction
+"""
+import os
+from sqlalchemy import insert, delete, select, literal, union_all
+from sqlalchemy.exc import IntegrityError
+from utils import APIException
+from models import db, User, People, Planet, Film, Favorite
+from stats import record_favorites
+
+# URL kind -> Favorite column holding the target id
+FAVORITE_KINDS = {
+    'planet': 'planet_id',
+    'people': 'people_id',
+    'film': 'film_id',
+}
+
+
+def insert_ignore(column):
+    """INSERT ... ON CONFLICT DO NOTHING against the unique index for `column`"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert(Favorite).on_conflict_do_nothing(
+        index_elements=['user_id', column],
+        index_where=getattr(Favorite, column).isnot(None),
+    )
+
+
+def add_favorite(user_id, kind, target_id):
+    """Returns True if a row was created, False if the favorite already existed"""
+    column = FAVORITE_KINDS[kind]
+    values = {'user_id': user_id, column: target_id}
+    stmt = insert_ignore(column)
+    if stmt is None:
+        # no ON CONFLICT support: let the unique index reject the duplicate
+        try:
+            db.session.execute(insert(Favorite).values(**values))
+        except IntegrityError:
+            db.session.rollback()
+            return False
+        record_favorites(kind, [target_id], 1)
+        db.session.commit()
+        return True
+    result = db.session.execute(stmt.values(**values))
+    created = result.rowcount == 1
+    if created:
+        record_favorites(kind, [target_id], 1)
+    db.session.commit()
+    return created
+
+
+def delete_favorite(user_id, kind, target_id):
+    """Returns True if a row was deleted"""
+    column = FAVORITE_KINDS[kind]
+    result = db.session.execute(
+        delete(Favorite)
+        .where(Favorite.user_id == user_id, getattr(Favorite, column) == target_id)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount > 0:
+        record_favorites(kind, [target_id] * result.rowcount, -1)
+    db.session.commit()
+    return result.rowcount > 0
+
+
+# URL kind -> primary key of the table a favorite of that kind points at
+FAVORITE_TARGETS = {
+    'planet': Planet.planet_id,
+    'people': People.character_id,
+    'film': Film.film_id,
+}
+MAX_BATCH_SIZE = int(os.environ.get('FAVORITES_MAX_BATCH', 500))
+
+
+def parse_batch(payload):
+    """Validate a [{kind, id}, ...] body into unique (kind, id) pairs, keeping input order"""
+    if not isinstance(payload, list):
+        raise APIException('Expected a JSON list of {"kind", "id"} items', status_code=400)
+    if len(payload) > MAX_BATCH_SIZE:
+        raise APIException('At most {} items per batch'.format(MAX_BATCH_SIZE), status_code=400)
+    items = []
+    for item in payload:
+        kind = item.get('kind') if isinstance(item, dict) else None
+        target_id = item.get('id') if isinstance(item, dict) else None
+        if kind not in FAVORITE_KINDS or not isinstance(target_id, int) or isinstance(target_id, bool):
+            raise APIException('Invalid item: {}'.format(item), status_code=400)
+        items.append((kind, target_id))
+    return items
+
+
+def group_by_kind(items):
+    grouped = {}
+    for kind, target_id in dict.fromkeys(items):
+        grouped.setdefault(kind, []).append(target_id)
+    return grouped
+
+
+def existing_targets(user_id, grouped):
+    """One UNION ALL query telling which user and target rows exist"""
+    selects = [select(literal('user').label('kind'), User.id.label('id')).where(User.id == user_id)]
+    for kind, ids in grouped.items():
+        pk = FAVORITE_TARGETS[kind]
+        selects.append(select(literal(kind).label('kind'), pk.label('id')).where(pk.in_(ids)))
+    found = set(db.session.execute(union_all(*selects)).all())
+    if ('user', user_id) not in found:
+        raise APIException('User not found', status_code=404)
+    return found
+
+
+def insert_favorites(user_id, kind, ids):
+    """Insert the missing `kind` favorites among `ids` without committing; returns the ids inserted"""
+    column = FAVORITE_KINDS[kind]
+    stmt = insert_ignore(column)
+    if stmt is None or not db.session.get_bind().dialect.insert_returning:
+        existing = set(db.session.execute(
+            select(getattr(Favorite, column))
+            .where(Favorite.user_id == user_id, getattr(Favorite, column).in_(ids))
+        ).scalars())
+        ids = [target_id for target_id in ids if target_id not in existing]
+        if ids:
+            db.session.execute(insert(Favorite), [{'user_id': user_id, column: target_id} for target_id in ids])
+    else:
+        rows = [{'user_id': user_id, column: target_id} for target_id in ids]
+        ids = db.session.execute(stmt.values(rows).returning(getattr(Favorite, column))).scalars().all()
+    record_favorites(kind, ids, 1)
+    return ids
+
+
+def remove_favorites(user_id, kind, ids):
+    """Delete the `kind` favorites among `ids` without committing; returns the ids deleted"""
+    column = getattr(Favorite, FAVORITE_KINDS[kind])
+    stmt = (
+        delete(Favorite)
+        .where(Favorite.user_id == user_id, column.in_(ids))
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.get_bind().dialect.delete_returning:
+        targets = db.session.execute(stmt.returning(column)).scalars().all()
+    else:
+        targets = db.session.execute(
+            select(column).where(Favorite.user_id == user_id, column.in_(ids))
+        ).scalars().all()
+        db.session.execute(stmt)
+    record_favorites(kind, targets, -1)
+    return targets
+
+
+def add_favorites(user_id, items):
+    """Insert every (kind, id) in `items` in one transaction; returns per-item statuses"""
+    grouped = group_by_kind(items)
+    found = existing_targets(user_id, grouped)
+    added = set()
+    for kind, ids in grouped.items():
+        ids = [target_id for target_id in ids if (kind, target_id) in found]
+        if ids:
+            added.update((kind, target_id) for target_id in insert_favorites(user_id, kind, ids))
+    db.session.commit()
+
+    def status(pair):
+        if pair not in found:
+            return 'not_found'
+        return 'added' if pair in added else 'exists'
+
+    return [{'kind': kind, 'id': target_id, 'status': status((kind, target_id))} for kind, target_id in items]
+
+
+def delete_favorites(user_id, items):
+    """Delete every (kind, id) in `items` in one transaction; returns per-item statuses"""
+    deleted = set()
+    for kind, ids in group_by_kind(items).items():
+        deleted.update((kind, target_id) for target_id in remove_favorites(user_id, kind, ids))
+    db.session.commit()
+    return [
+        {'kind': kind, 'id': target_id, 'status': 'deleted' if (kind, target_id) in deleted else 'not_found'}
+        for kind, target_id in items
+    ]
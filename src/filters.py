@@ -0,0 +1,118 @@
+"""
+Typed filter and sort parameters for the collection endpoints:
+
+    ?population__gt=1000  ?diameter__between=5000,12000  ?terrain__in=desert,ocean
+    ?gender_id=1  ?name__prefix=Luk  ?sort=-population
+
+Each model whitelists its filterable columns in `__filterable__`; a column is
+only accepted when an index can serve it, so no filter or sort turns into a
+full table scan
+"""
+from flask import request
+from sqlalchemy import inspect
+from utils import APIException
+from search import prefix_filter, search_text
+
+MAX_IN_VALUES = 100
+# query parameters owned by other layers (pagination, fields, streaming, search, profiling, expansion)
+RESERVED_PARAMS = {'limit', 'after', 'fields', 'stream', 'q', 'sort', 'profile', 'kinds', 'expand'}
+
+
+def _between(column, values):
+    if len(values) != 2:
+        raise APIException('between takes exactly two comma-separated values', status_code=400)
+    return column.between(values[0], values[1])
+
+
+def _in(column, values):
+    if not values or len(values) > MAX_IN_VALUES:
+        raise APIException('in takes 1 to {} comma-separated values'.format(MAX_IN_VALUES), status_code=400)
+    return column.in_(values)
+
+
+# operator -> (takes a comma-separated list, builds the SQL condition)
+OPERATORS = {
+    'eq': (False, lambda column, value: column == value),
+    'gt': (False, lambda column, value: column > value),
+    'gte': (False, lambda column, value: column >= value),
+    'lt': (False, lambda column, value: column < value),
+    'lte': (False, lambda column, value: column <= value),
+    'between': (True, _between),
+    'in': (True, _in),
+    'prefix': (False, lambda column, value: prefix_filter(column, value)),
+}
+STRING_ONLY_OPERATORS = {'prefix'}
+INDEXED_COLUMNS = {}
+
+
+def indexed_columns(model):
+    """Column keys that lead an index (or the primary key) on `model`'s table"""
+    cached = INDEXED_COLUMNS.get(model)
+    if cached is None:
+        table = model.__table__
+        leading = {index.columns.values()[0].name for index in table.indexes}
+        leading.update(column.name for column in table.primary_key.columns)
+        mapper = inspect(model)
+        cached = INDEXED_COLUMNS[model] = frozenset(mapper.get_property_by_column(table.c[name]).key for name in leading)
+    return cached
+
+
+def filterable_column(model, name):
+    if name not in getattr(model, '__filterable__', ()):
+        raise APIException('Cannot filter or sort on: {}'.format(name), status_code=400)
+    if name not in indexed_columns(model):
+        raise APIException('Column is not indexed: {}'.format(name), status_code=400)
+    return getattr(model, name)
+
+
+def coerce(column, raw, operator=None):
+    if operator in STRING_ONLY_OPERATORS:
+        search_text(column.key + '__' + operator, raw)
+    python_type = column.type.python_type
+    try:
+        return python_type(raw)
+    except (TypeError, ValueError):
+        raise APIException('Invalid value for {}: {}'.format(column.key, raw), status_code=400)
+
+
+def parse_filters(model):
+    """SQL conditions for every filter parameter in the query string"""
+    conditions = []
+    columns = {prop.key for prop in inspect(model).column_attrs}
+    for param, raw in request.args.items(multi=True):
+        if param in RESERVED_PARAMS:
+            continue
+        name, _, operator = param.partition('__')
+        if not operator:
+            if name not in columns:
+                continue
+            operator = 'eq'
+        if operator not in OPERATORS:
+            raise APIException('Unknown filter operator: {}'.format(operator), status_code=400)
+        column = filterable_column(model, name)
+        takes_list, build = OPERATORS[operator]
+        if operator in STRING_ONLY_OPERATORS and column.type.python_type is not str:
+            raise APIException('{} only applies to text columns'.format(operator), status_code=400)
+        if takes_list:
+            value = [coerce(column, part) for part in raw.split(',') if part != '']
+        else:
+            value = coerce(column, raw, operator)
+        condition = build(column, value)
+        conditions.extend(condition if isinstance(condition, tuple) else (condition,))
+    return conditions
+
+
+def apply_filters(query, model):
+    conditions = parse_filters(model)
+    return query.filter(*conditions) if conditions else query
+
+
+def requested_sort(model):
+    """(column, descending) from ?sort=col or ?sort=-col; None when absent"""
+    raw = request.args.get('sort')
+    if not raw:
+        return None
+    if ',' in raw:
+        raise APIException('sort takes a single column', status_code=400)
+    descending = raw.startswith('-')
+    return filterable_column(model, raw.lstrip('-+')), descending
@@ -0,0 +1,331 @@
+"""
+Bulk loader behind `flask import`: streams JSON, NDJSON or CSV dumps into the
+model tables in batches (executemany, or COPY on Postgres), committing after
+every batch. Tables are loaded parents first, in foreign-key dependency
+order, so every reference points at a row that is already there. JSON
+documents are decoded one array element at a time, never whole; a
+whole-dataset object is split in a single pass into one NDJSON spool file
+per table, which are then loaded in dependency order like any other file
+"""
+import io
+import os
+import re
+import csv
+import json
+import click
+import tempfile
+from datetime import date, datetime
+from time import perf_counter
+from sqlalchemy import insert, text, func, select
+from sqlalchemy.exc import DataError, IntegrityError
+from models import db
+from cache import mark_changed
+
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 5000))
+FORMATS = {'.json': 'json', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.csv': 'csv'}
+# what SWAPI dumps (and empty CSV cells) put in a numeric or date field that has no value
+MISSING_VALUES = {'', 'unknown', 'n/a'}
+JSON_CHUNK_SIZE = 1 << 16
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+
+def _models():
+    return {mapper.class_.__tablename__: mapper.class_ for mapper in db.Model.registry.mappers}
+
+
+def resolve_table(name):
+    """Table name for a file stem or --table value: exact or case-insensitive, singular or plural"""
+    tables = {table.name.lower(): table.name for table in db.metadata.sorted_tables}
+    name = name.lower()
+    for candidate in (name, name[:-1] if name.endswith('s') else None, name[:-2] if name.endswith('es') else None):
+        if candidate in tables:
+            return tables[candidate]
+    raise ValueError('No table matches {!r}'.format(name))
+
+
+def column_aliases(table_name):
+    """Accepted input keys -> column names: the columns themselves plus the API's output names"""
+    table = db.metadata.tables[table_name]
+    aliases = {column.name: column.name for column in table.columns}
+    model = _models().get(table_name)
+    for output, source in getattr(model, '__fields__', {}).items():
+        if isinstance(source, str) and source in table.columns and output not in aliases:
+            aliases[output] = source
+    return aliases
+
+
+def read_ndjson(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(f):
+    yield from csv.DictReader(f)
+
+
+class JSONStream:
+    """Incremental reader for a JSON document's top level: the values of an array, or the
+    arrays of an object, decoded one value at a time from a file read in chunks"""
+
+    def __init__(self, f, chunk_size=JSON_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        # characters dropped from the front of the buffer, for error offsets
+        self.consumed = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return
+        self.consumed += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """The next non-whitespace character, '' at the end of the file"""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return ''
+            self._fill()
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError('expected {} at offset {}, found {!r}'.format(' or '.join(chars), self.consumed + self.pos, char or 'end of file'))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # a number cut off by the end of the buffer (`12` of `12.5e3`) goes on in the next chunk
+                if self.eof or (end < len(self.buffer) and self.buffer[end] not in NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            self._fill()
+
+    def items(self):
+        """The values of the array that comes next"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+    def sections(self):
+        """(key, values) for each member of the object that comes next; each member's
+        values must be consumed before the next member is read"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key, self.items()
+            if self.expect(',}') == '}':
+                return
+
+
+def split_json(path, spool, wanted=None):
+    """Write each array of a whole-dataset JSON object (or only the one for table `wanted`) to its
+    own NDJSON file under `spool`, reading the document once: [(table, spool file)], or None when
+    the document is an array"""
+    with open(path) as f:
+        stream = JSONStream(f)
+        if stream.peek() == '[':
+            return None
+        spooled = []
+        for key, values in stream.sections():
+            table_name = resolve_table(key)
+            if wanted is not None and table_name != wanted:
+                for _ in values:
+                    pass
+                continue
+            fd, spool_path = tempfile.mkstemp(suffix='.ndjson', prefix=table_name + '-', dir=spool)
+            with open(fd, 'w') as out:
+                for value in values:
+                    out.write(json.dumps(value))
+                    out.write('\n')
+            spooled.append((table_name, spool_path))
+        return spooled
+
+
+def read_json(path):
+    """Stream the values of a JSON array"""
+    with open(path) as f:
+        yield from JSONStream(f).items()
+
+
+def sources(paths, table=None, fmt=None, spool=None):
+    """[(table name, path, format, rows factory)] for every file, directory entry or JSON section, parents first.
+    The sections of whole-dataset JSON files are split into `spool`, a directory the caller removes afterwards"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            entries = sorted(os.path.join(path, entry) for entry in os.listdir(path))
+            found.extend(sources([entry for entry in entries if os.path.splitext(entry)[1].lower() in FORMATS], table, fmt, spool))
+            continue
+        stem, extension = os.path.splitext(os.path.basename(path))
+        file_format = fmt or FORMATS.get(extension.lower())
+        if file_format is None:
+            raise ValueError('Cannot tell the format of {}; pass --format'.format(path))
+        if file_format == 'json':
+            # a whole-dataset dump: {"People": [...], "Planet": [...]}; --table picks one of its tables
+            spooled = split_json(path, spool, resolve_table(table) if table else None)
+            if spooled is not None:
+                found.extend((table_name, path, file_format, lambda spool_path=spool_path: read_file(spool_path, 'ndjson'))
+                             for table_name, spool_path in spooled)
+            else:
+                found.append((resolve_table(table or stem), path, file_format, lambda path=path: read_json(path)))
+            continue
+        found.append((resolve_table(table or stem), path, file_format, lambda path=path, file_format=file_format: read_file(path, file_format)))
+    order = {table.name: i for i, table in enumerate(db.metadata.sorted_tables)}
+    return sorted(found, key=lambda source: order[source[0]])
+
+
+def read_file(path, file_format):
+    """Stream the rows of an NDJSON or CSV file"""
+    with open(path, newline='' if file_format == 'csv' else None) as f:
+        yield from (read_csv(f) if file_format == 'csv' else read_ndjson(f))
+
+
+def coerce(python_type, value):
+    """A text value read into a non-text column: NULL for a placeholder, else parsed as `python_type`"""
+    if python_type is str or not isinstance(value, str):
+        return value
+    if value.strip().lower() in MISSING_VALUES:
+        return None
+    if python_type in (date, datetime):
+        return python_type.fromisoformat(value.strip())
+    return python_type(value.strip())
+
+
+def normalize(rows, table_name, path):
+    """Map input keys onto columns and coerce text values to the column types"""
+    table = db.metadata.tables[table_name]
+    aliases = column_aliases(table_name)
+    types = {column.name: column.type.python_type for column in table.columns}
+    for number, row in enumerate(rows, 1):
+        out = {}
+        for key, value in row.items():
+            column = aliases.get(key)
+            if column is None:
+                continue
+            try:
+                out[column] = coerce(types[column], value)
+            except (TypeError, ValueError):
+                raise click.ClickException('{} row {}, column {}: cannot read {!r} as {}; earlier batches are committed'.format(
+                    os.path.basename(path), number, key, value, types[column].__name__))
+        yield out
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_batch(table, columns, batch):
+    """COPY ... FROM STDIN in text format through the psycopg2 connection"""
+    buffer = io.StringIO()
+    for row in batch:
+        buffer.write('\t'.join(_copy_value(row.get(column)) for column in columns))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor = db.session.connection().connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert('COPY "{}" ({}) FROM STDIN'.format(
+            table.name, ', '.join('"{}"'.format(column) for column in columns)), buffer)
+    finally:
+        cursor.close()
+
+
+def insert_batch(table, batch, use_copy):
+    # rows may omit columns (e.g. a favorite names only one target); fill the gaps with NULL
+    columns = [column.name for column in table.columns if any(column.name in row for row in batch)]
+    if use_copy:
+        copy_batch(table, columns, batch)
+        mark_changed(db.session, table.name)
+    else:
+        db.session.execute(insert(table), [{column: row.get(column) for column in columns} for row in batch])
+    db.session.commit()
+
+
+def reset_sequences(table_names):
+    """Move Postgres serial sequences past the ids that were loaded explicitly"""
+    for name in table_names:
+        table = db.metadata.tables[name]
+        columns = list(table.primary_key.columns)
+        if len(columns) != 1 or columns[0].autoincrement is False or columns[0].type.python_type is not int:
+            continue
+        highest = db.session.execute(select(func.max(columns[0]))).scalar()
+        if highest is not None:
+            db.session.execute(text('SELECT setval(pg_get_serial_sequence(:table, :column), :value)'),
+                               {'table': '"{}"'.format(name), 'column': columns[0].name, 'value': highest})
+    db.session.commit()
+
+
+def import_sources(found, batch_size=IMPORT_BATCH_SIZE, use_copy=None, report=print):
+    """Load every source; returns {table: (rows, seconds)}"""
+    if use_copy is None:
+        use_copy = db.engine.dialect.name == 'postgresql' and db.engine.dialect.driver == 'psycopg2'
+    # COPY goes through the raw psycopg2 cursor, whose errors SQLAlchemy doesn't wrap
+    dbapi = db.engine.dialect.dbapi
+    rejected = (DataError, IntegrityError) + ((dbapi.DataError, dbapi.IntegrityError) if use_copy else ())
+    results = {}
+    for table_name, path, file_format, read in found:
+        table = db.metadata.tables[table_name]
+        start = perf_counter()
+        count = 0
+        rows = normalize(read(), table_name, path)
+        for batch in batches(rows, batch_size):
+            try:
+                insert_batch(table, batch, use_copy)
+            except rejected as error:
+                db.session.rollback()
+                raise click.ClickException('{} rows {}-{} ({}): {}; earlier batches are committed'.format(
+                    os.path.basename(path), count + 1, count + len(batch), table_name,
+                    str(getattr(error, 'orig', error)).strip()))
+            count += len(batch)
+        elapsed = perf_counter() - start
+        previous_rows, previous_time = results.get(table_name, (0, 0.0))
+        results[table_name] = (previous_rows + count, previous_time + elapsed)
+        report('{}: {} rows from {} in {:.2f}s ({:.0f} rows/s)'.format(
+            table_name, count, os.path.basename(path), elapsed, count / elapsed if elapsed else 0))
+    if db.engine.dialect.name == 'postgresql':
+        reset_sequences(results)
+    return results
@@ -0,0 +1,85 @@
+"""
+Per-request batching loaders (DataLoader style): callers hand over every key
+they need at once, each entity type is resolved with one `WHERE key IN (...)`
+query and the results are memoized for the rest of the request, so the same
+planet or director is never fetched twice while building a response
+"""
+from flask import g, has_request_context
+from sqlalchemy import event, inspect
+from models import db
+
+IN_CHUNK_SIZE = 500
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), IN_CHUNK_SIZE):
+        yield values[start:start + IN_CHUNK_SIZE]
+
+
+class Loader:
+    """
+    Loads `model` rows by `key` (the primary key by default). Keyed by the
+    primary key a loader returns one entity per key; keyed by any other
+    column (a foreign key pointing back at a parent) it returns a list
+    """
+
+    def __init__(self, model, key=None):
+        mapper = inspect(model)
+        self.model = model
+        self.pk = getattr(model, mapper.get_property_by_column(mapper.primary_key[0]).key)
+        self.key = self.pk if key is None else key
+        self.many = self.key is not self.pk
+        self._memo = {}
+
+    def _query(self, keys):
+        # the serializer's joins come along, so dumping a loaded entity runs no further SQL
+        options = self.model.serializer().load_options()
+        return self.model.query.options(*options).filter(self.key.in_(keys)).order_by(self.pk)
+
+    def load_many(self, keys):
+        """{key: entity, or list of entities when keyed by a foreign key}; missing keys map to None / []"""
+        keys = set(keys) - {None}
+        missing = [key for key in keys if key not in self._memo]
+        for chunk in _chunks(missing):
+            found = {} if not self.many else {key: [] for key in chunk}
+            for row in self._query(chunk):
+                value = getattr(row, self.key.key)
+                if self.many:
+                    found[value].append(row)
+                else:
+                    found[value] = row
+            for key in chunk:
+                self._memo[key] = found.get(key)
+        return {key: self._memo[key] for key in keys}
+
+    def forget(self, keys):
+        for key in keys:
+            self._memo.pop(key, None)
+
+    def clear(self):
+        self._memo.clear()
+
+
+def loader_for(model, key=None):
+    """The current request's loader for `model` by `key` (a fresh, unshared one outside a request)"""
+    if not has_request_context():
+        return Loader(model, key)
+    loaders = g.setdefault('loaders', {})
+    name = (model, None if key is None else key.key)
+    loader = loaders.get(name)
+    if loader is None:
+        loader = loaders[name] = Loader(model, key)
+    return loader
+
+
+def _clear_loaders(session):
+    # committed writes may have changed memoized rows: the next lookup re-reads them
+    if has_request_context():
+        for loader in g.get('loaders', {}).values():
+            loader.clear()
+
+
+def setup_loaders(app):
+    if not event.contains(db.session, 'after_commit', _clear_loaders):
+        event.listen(db.session, 'after_commit', _clear_loaders)
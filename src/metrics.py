@@ -0,0 +1,192 @@
+"""
+Request instrumentation: per-endpoint latency and response size histograms,
+SQL statement counts and time (from cursor events) and JSON encoding time,
+exposed in Prometheus text format. With PROFILING_ENABLED set, ?profile=1
+returns a cProfile summary of the request instead of its body
+"""
+import io
+import os
+import pstats
+import cProfile
+import threading
+from time import perf_counter
+from flask import Response, g, request, has_request_context
+from sqlalchemy import event
+from models import db
+from pool import pool_metrics
+from json_provider import FastJSONProvider
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0').lower() in ('1', 'true', 'yes', 'on')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield '{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative)
+        yield '{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, self.count)
+        yield '{}_sum{{{}}} {}'.format(name, labels, self.sum)
+        yield '{}_count{{{}}} {}'.format(name, labels, self.count)
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.response_bytes = Histogram(SIZE_BUCKETS)
+        self.sql_statements = Histogram(SQL_COUNT_BUCKETS)
+        self.sql_seconds = 0.0
+        self.serialize_seconds = 0.0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, endpoint, method, status, latency, size, sql_count, sql_time, serialize_time):
+        key = (endpoint, method, status)
+        with self._lock:
+            route = self._routes.get(key)
+            if route is None:
+                route = self._routes[key] = RouteMetrics()
+            route.latency.observe(latency)
+            if size is not None:
+                route.response_bytes.observe(size)
+            route.sql_statements.observe(sql_count)
+            route.sql_seconds += sql_time
+            route.serialize_seconds += serialize_time
+
+    def render(self):
+        out = []
+        with self._lock:
+            routes = sorted(self._routes.items())
+            series = (
+                ('api_request_duration_seconds', 'histogram', 'Request latency', lambda r: r.latency),
+                ('api_response_bytes', 'histogram', 'Response body size', lambda r: r.response_bytes),
+                ('api_sql_statements', 'histogram', 'SQL statements per request', lambda r: r.sql_statements),
+            )
+            for name, kind, help_text, get in series:
+                out.append('# HELP {} {}'.format(name, help_text))
+                out.append('# TYPE {} {}'.format(name, kind))
+                for (endpoint, method, status), route in routes:
+                    labels = 'endpoint="{}",method="{}",status="{}"'.format(endpoint, method, status)
+                    out.extend(get(route).lines(name, labels))
+            for name, help_text, attr in (
+                ('api_sql_duration_seconds_total', 'Time spent in SQL', 'sql_seconds'),
+                ('api_serialization_seconds_total', 'Time spent encoding JSON', 'serialize_seconds'),
+            ):
+                out.append('# HELP {} {}'.format(name, help_text))
+                out.append('# TYPE {} counter'.format(name))
+                for (endpoint, method, status), route in routes:
+                    labels = 'endpoint="{}",method="{}",status="{}"'.format(endpoint, method, status)
+                    out.append('{}{{{}}} {}'.format(name, labels, getattr(route, attr)))
+        for name, value in sorted(pool_metrics.snapshot(db.engine.pool).items()):
+            out.append('# TYPE db_pool_{} gauge'.format(name))
+            out.append('db_pool_{} {}'.format(name, value))
+        return '\n'.join(out) + '\n'
+
+
+metrics_registry = MetricsRegistry()
+
+
+class TimedJSONProvider(FastJSONProvider):
+    """JSON provider that adds its encoding time to the current request"""
+
+    def _timed(self, encode, *args, **kwargs):
+        # without orjson, dumps_bytes() goes through dumps(): only the outer call is timed
+        if not has_request_context() or 'metrics_start' not in g or g.get('serializing'):
+            return encode(*args, **kwargs)
+        g.serializing = True
+        start = perf_counter()
+        try:
+            return encode(*args, **kwargs)
+        finally:
+            g.serialize_time += perf_counter() - start
+            g.serializing = False
+
+    def dumps(self, obj, **kwargs):
+        return self._timed(super().dumps, obj, **kwargs)
+
+    def dumps_bytes(self, obj):
+        return self._timed(super().dumps_bytes, obj)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # keyed by execution context, so a statement that fails can drop its own start time (_handle_error)
+    conn.info.setdefault('query_start', {})[id(context)] = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info['query_start'].pop(id(context))
+    if has_request_context() and 'metrics_start' in g:
+        g.sql_count += 1
+        g.sql_time += elapsed
+
+
+def _handle_error(context):
+    if context.connection is not None and context.execution_context is not None:
+        context.connection.info.get('query_start', {}).pop(id(context.execution_context), None)
+
+
+def _start_request():
+    g.metrics_start = perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    g.serialize_time = 0.0
+    if PROFILING_ENABLED and request.args.get('profile') == '1':
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _finish_request(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        stream = io.StringIO()
+        stream.write('{} SQL statements, {:.6f}s in SQL, {:.6f}s encoding JSON\n\n'.format(
+            g.sql_count, g.sql_time, g.serialize_time))
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(40)
+        return Response(stream.getvalue(), mimetype='text/plain')
+    if 'metrics_start' in g:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        size = None if response.is_streamed else response.calculate_content_length()
+        metrics_registry.observe(
+            endpoint, request.method, response.status_code, perf_counter() - g.metrics_start,
+            size, g.sql_count, g.sql_time, g.serialize_time,
+        )
+    return response
+
+
+def instrument_engine(engine):
+    """Count `engine`'s SQL into the current request (an async engine passes its sync_engine)"""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+def setup_metrics(app):
+    app.json = TimedJSONProvider(app)
+    with app.app_context():
+        # read replicas (replicas.py) are binds of their own
+        for engine in db.engines.values():
+            instrument_engine(engine)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
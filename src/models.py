@@ -1,9 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
+from replicas import RoutingSession
+from serializers import Serializable, related
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
-class User(db.Model):
+class User(db.Model, Serializable):
     __tablename__ = 'User'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(250), nullable=False)
@@ -14,67 +16,138 @@ class User(db.Model):
     email = db.Column(db.String(250), nullable=False)
     favorites = db.Column(db.String(250))
 
-class People(db.Model):
+    __fields__ = {
+        'id': 'id',
+        'name': 'name',
+        'username': 'username',
+        'lastname': 'lastname',
+        'suscription': 'suscription_dates',
+        'email': 'email',
+        'favorites': 'favorites',
+    }
+
+class People(db.Model, Serializable):
      __tablename__ = 'People'
      character_id = db.Column(db.Integer, primary_key=True)
-     name = db.Column(db.String(250))
-     gender_id = db.Column(db.Integer, db.ForeignKey('Gender.gender_id'))
+     name = db.Column(db.String(250), index=True)
+     gender_id = db.Column(db.Integer, db.ForeignKey('Gender.gender_id'), index=True)
      gender = db.relationship('Gender')
-     specie_id = db.Column(db.Integer, db.ForeignKey('Specie.specie_id'))
+     specie_id = db.Column(db.Integer, db.ForeignKey('Specie.specie_id'), index=True)
      specie = db.relationship('Specie')
-     vehicle_id = db.Column(db.Integer, db.ForeignKey('Vehicle.vehicle_id'))
+     vehicle_id = db.Column(db.Integer, db.ForeignKey('Vehicle.vehicle_id'), index=True)
      vehicle = db.relationship('Vehicle')
-     height = db.Column(db.Integer)
-     film_id = db.Column(db.Integer, db.ForeignKey('Film.film_id'))
+     height = db.Column(db.Integer, index=True)
+     film_id = db.Column(db.Integer, db.ForeignKey('Film.film_id'), index=True)
      film = db.relationship('Film')
-     planet_id = db.Column(db.Integer, db.ForeignKey('Planet.planet_id'))
+     planet_id = db.Column(db.Integer, db.ForeignKey('Planet.planet_id'), index=True)
      planet = db.relationship('Planet')
 
-class Film(db.Model):
+     __fields__ = {
+         'name': 'name',
+         'gender': related('gender', 'type'),
+         'specie': related('specie', 'languaje'),
+         'vehicle': related('vehicle', 'name'),
+         'height': 'height',
+         'films': related('film', 'title', as_list=True),
+     }
+
+     __filterable__ = ('name', 'height', 'gender_id', 'specie_id', 'vehicle_id', 'film_id', 'planet_id')
+
+class Film(db.Model, Serializable):
      __tablename__ = 'Film'
      film_id = db.Column(db.Integer, primary_key=True)
-     director_id = db.Column(db.Integer, db.ForeignKey('Director.directo_id'))
-     title = db.Column(db.String(250))
+     director_id = db.Column(db.Integer, db.ForeignKey('Director.directo_id'), index=True)
+     title = db.Column(db.String(250), index=True)
      opening = db.Column(db.String(250))
      director = db.relationship('Director')
 
-class Starship(db.Model):
+     __fields__ = {
+         'id': 'film_id',
+         'title': 'title',
+         'director': 'director_id',
+         'opening': 'opening',
+     }
+
+     __filterable__ = ('title', 'director_id')
+
+class Starship(db.Model, Serializable):
      __tablename__ = 'Starship'
      starship_id = db.Column(db.Integer, primary_key=True)
-     name = db.Column(db.String(250))
-     pilot_id = db.Column(db.Integer, db.ForeignKey('People.character_id'))
+     name = db.Column(db.String(250), index=True)
+     pilot_id = db.Column(db.Integer, db.ForeignKey('People.character_id'), index=True)
      pilot = db.relationship('People')
 
-class Vehicle(db.Model):
+     __fields__ = {
+         'id': 'starship_id',
+         'name': 'name',
+         'pilot': 'pilot_id',
+     }
+
+     __filterable__ = ('name', 'pilot_id')
+
+class Vehicle(db.Model, Serializable):
      __tablename__ = 'Vehicle'
      vehicle_id = db.Column(db.Integer, primary_key=True)
-     name = db.Column(db.String(250))
-     model = db.Column(db.String(250))
+     name = db.Column(db.String(250), index=True)
+     model = db.Column(db.String(250), index=True)
 
-class Gender(db.Model):
+     __fields__ = {
+         'id': 'vehicle_id',
+         'name': 'name',
+         'model': 'model',
+     }
+
+     __filterable__ = ('name', 'model')
+
+class Gender(db.Model, Serializable):
      __tablename__ = 'Gender'
      gender_id = db.Column(db.Integer, primary_key=True)
      type = db.Column(db.String(250))
 
-class Specie(db.Model):
+     __fields__ = {
+         'id': 'gender_id',
+         'type': 'type',
+     }
+
+class Specie(db.Model, Serializable):
      __tablename__ = 'Specie'
      specie_id = db.Column(db.Integer, primary_key=True)
      languaje = db.Column(db.String(250))
 
-class Planet(db.Model):
+     __fields__ = {
+         'id': 'specie_id',
+         'languaje': 'languaje',
+     }
+
+class Planet(db.Model, Serializable):
     __tablename__ = 'Planet'
     planet_id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(250))
-    population = db.Column(db.Integer)
-    terrain = db.Column(db.String(250))
-    diameter = db.Column(db.Integer)
+    name = db.Column(db.String(250), index=True)
+    population = db.Column(db.Integer, index=True)
+    terrain = db.Column(db.String(250), index=True)
+    diameter = db.Column(db.Integer, index=True)
+
+    __fields__ = {
+        'id': 'planet_id',
+        'name': 'name',
+        'population': 'population',
+        'terrain': 'terrain',
+        'diameter': 'diameter',
+    }
 
-class Director(db.Model):
+    __filterable__ = ('name', 'population', 'terrain', 'diameter')
+
+class Director(db.Model, Serializable):
      __tablename__ = 'Director'
      directo_id = db.Column(db.Integer, primary_key=True)
      name = db.Column(db.String(250))
 
-class Favorite(db.Model):
+     __fields__ = {
+         'id': 'directo_id',
+         'name': 'name',
+     }
+
+class Favorite(db.Model, Serializable):
     __tablename__ = 'Favorite'
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('User.id'))
@@ -85,10 +158,45 @@ class Favorite(db.Model):
     film = db.relationship('Film')
     people_id = db.Column(db.Integer, db.ForeignKey('People.character_id'))
     people = db.relationship('People')
-    
-    
 
+    # one row per (user, target) for each kind of favorite; the partial unique
+    # indexes double as the lookup indexes for the DELETE routes
+    __table_args__ = (
+        db.Index('ix_favorite_user_id_id', 'user_id', 'id'),
+        db.Index('uq_favorite_user_planet_id', 'user_id', 'planet_id', unique=True,
+                 postgresql_where=planet_id.isnot(None), sqlite_where=planet_id.isnot(None)),
+        db.Index('uq_favorite_user_people_id', 'user_id', 'people_id', unique=True,
+                 postgresql_where=people_id.isnot(None), sqlite_where=people_id.isnot(None)),
+        db.Index('uq_favorite_user_film_id', 'user_id', 'film_id', unique=True,
+                 postgresql_where=film_id.isnot(None), sqlite_where=film_id.isnot(None)),
+    )
+
+    __fields__ = {
+        'user_id': 'user_id',
+        'planet_id': 'planet_id',
+        'film_id': 'film_id',
+        'people_id': 'people_id',
+    }
+
+class Stat(db.Model, Serializable):
+    __tablename__ = 'Stat'
+    # one counter per (metric, group); maintained by stats.py in the writing transaction
+    metric = db.Column(db.String(50), primary_key=True)
+    group_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    # leaderboards are an index range scan: WHERE metric = ? ORDER BY count DESC LIMIT n
+    __table_args__ = (
+        db.Index('ix_stat_metric_count', 'metric', 'count'),
+    )
 
-def to_dict(self):
-    return {}
+    __fields__ = {
+        'id': 'group_id',
+        'count': 'count',
+    }
 
+class TableStamp(db.Model):
+    __tablename__ = 'TableStamp'
+    # when each table was last written; maintained by stamps.py right after the writing transaction
+    table_name = db.Column(db.String(50), primary_key=True)
+    modified = db.Column(db.DateTime, nullable=False)
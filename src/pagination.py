@@ -0,0 +1,141 @@
+"""
+Keyset (cursor) pagination for the collection endpoints.
+Pages are seeks on the primary key (WHERE pk > :after ORDER BY pk LIMIT n), or
+on (sort column, pk) for sorted listings, so a deep page costs the same as the
+first one. NULLs in a sort column rank after every value. A cursor names the
+table it pages and its values are checked against the column types, so a
+cursor edited by hand or issued by another listing is a 400, not a 500
+"""
+import os
+import json
+import base64
+from decimal import Decimal
+from urllib.parse import urlencode
+from flask import request
+from sqlalchemy import and_, or_
+from utils import APIException
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('PAGE_SIZE_DEFAULT', 50))
+MAX_PAGE_SIZE = int(os.environ.get('PAGE_SIZE_MAX', 200))
+# column python type -> JSON types a cursor value for it may have
+CURSOR_TYPES = {int: (int,), float: (int, float), Decimal: (int, float), str: (str,)}
+
+
+class Page:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def headers(self):
+        if self.next_cursor is None:
+            return {}
+        args = request.args.to_dict()
+        args['after'] = self.next_cursor
+        next_url = request.base_url + '?' + urlencode(args)
+        return {
+            'X-Next-Cursor': self.next_cursor,
+            'Link': '<' + next_url + '>; rel="next"',
+        }
+
+
+def encode_cursor(value, table, sort=None):
+    payload = {'k': value, 't': table}
+    if sort is not None:
+        payload['s'] = sort_token(sort)
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(token):
+    """The cursor payload: {'k': key, 't': table} or, for sorted listings, {'k': [value, key], 't': table, 's': sort}"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        payload['k'], payload['t']
+        return payload
+    except (ValueError, KeyError, TypeError):
+        raise APIException('Invalid cursor', status_code=400)
+
+
+def sort_token(sort):
+    column, descending = sort
+    return ('-' if descending else '') + column.key
+
+
+def ordered(query, key_column, sort=None):
+    if sort is None:
+        return query.order_by(key_column)
+    column, descending = sort
+    # descending is the exact reverse of ascending, so one index serves both
+    if descending:
+        return query.order_by(column.desc().nulls_first(), key_column.desc())
+    return query.order_by(column.asc().nulls_last(), key_column.asc())
+
+
+def cursor_value(column, value, nullable=False):
+    """`value` from a cursor, once it is known to fit `column`"""
+    if value is None and nullable:
+        return value
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = None
+    if isinstance(value, bool) or not isinstance(value, CURSOR_TYPES.get(python_type, (int, float, str))):
+        raise APIException('Invalid cursor', status_code=400)
+    return value
+
+
+def seek(query, key_column, cursor, sort=None):
+    """Filter `query` to the rows after `cursor` in `ordered()` order"""
+    if cursor is None:
+        return query
+    if cursor['t'] != key_column.table.name:
+        raise APIException('Cursor belongs to another listing', status_code=400)
+    if cursor.get('s') != (sort_token(sort) if sort is not None else None):
+        raise APIException('Cursor does not match the requested sort', status_code=400)
+    if sort is None:
+        return query.filter(key_column > cursor_value(key_column, cursor['k']))
+    try:
+        value, key = cursor['k']
+    except (TypeError, ValueError):
+        raise APIException('Invalid cursor', status_code=400)
+    column, descending = sort
+    value, key = cursor_value(column, value, nullable=True), cursor_value(key_column, key)
+    if descending:
+        if value is None:
+            return query.filter(or_(column.isnot(None), key_column < key))
+        return query.filter(or_(column < value, and_(column == value, key_column < key)))
+    if value is None:
+        return query.filter(column.is_(None), key_column > key)
+    return query.filter(or_(column > value, column.is_(None), and_(column == value, key_column > key)))
+
+
+def cursor_for(row, key_column, sort=None):
+    key = getattr(row, key_column.key)
+    if sort is None:
+        return encode_cursor(key, key_column.table.name)
+    return encode_cursor([getattr(row, sort[0].key), key], key_column.table.name, sort)
+
+
+def get_page_args():
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    if limit is None or limit < 1:
+        raise APIException('limit must be a positive integer', status_code=400)
+    after = request.args.get('after')
+    return min(limit, MAX_PAGE_SIZE), (decode_cursor(after) if after else None)
+
+
+def paginate(query, key_column, sort=None):
+    limit, after = get_page_args()
+    query = ordered(seek(query, key_column, after, sort), key_column, sort)
+    # fetch one extra row to know whether there is a next page without a COUNT
+    return page_of(query.limit(limit + 1).all(), limit, key_column, sort)
+
+
+def page_of(rows, limit, key_column, sort=None):
+    """Page from the `limit + 1` rows fetched by a paginated query"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = cursor_for(rows[-1], key_column, sort)
+    return Page(rows, next_cursor)
@@ -0,0 +1,159 @@
+"""
+Engine / connection pool configuration driven by environment variables, plus
+pool instrumentation (checkout wait, in-use connections, overflow, timeouts)
+so saturation is visible before it shows up as request latency
+"""
+import os
+import threading
+from time import perf_counter
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from models import db
+
+
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self.invalidated = 0
+
+    def record_checkout(self, wait, overflowed):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if overflowed:
+                self.overflow_checkouts += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_invalidated(self):
+        with self._lock:
+            self.invalidated += 1
+
+    def snapshot(self, pool):
+        with self._lock:
+            data = {
+                'checkouts_total': self.checkouts,
+                'checkout_wait_seconds_total': self.wait_total,
+                'checkout_wait_seconds_max': self.wait_max,
+                'overflow_checkouts_total': self.overflow_checkouts,
+                'checkout_timeouts_total': self.timeouts,
+                'invalidated_total': self.invalidated,
+            }
+        if isinstance(pool, QueuePool):
+            data.update({
+                'pool_size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': max(pool.overflow(), 0),
+            })
+        return data
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        start = perf_counter()
+        before = self.overflow()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            pool_metrics.record_timeout()
+            raise
+        # only a checkout that opened a connection past pool_size counts, not one that reused
+        # a pooled connection while an overflow connection was open elsewhere
+        after = self.overflow()
+        pool_metrics.record_checkout(perf_counter() - start, after > 0 and after > before)
+        return connection
+
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """The same instrumentation for asyncio engines (asgi.py)"""
+
+
+def _env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options(database_uri):
+    options = {
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', True),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    if database_uri.startswith('sqlite') and ':memory:' in database_uri:
+        # in-memory SQLite lives in a single connection; leave SQLAlchemy's default pool
+        return options
+    options.update({
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    })
+    return options
+
+
+# sync driver -> asyncio driver for the ASGI front end
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+    'mysql+mysqldb': 'mysql+aiomysql',
+    'mysql+mysqlconnector': 'mysql+aiomysql',
+}
+
+
+def async_database_uri(database_uri):
+    scheme, separator, rest = database_uri.partition('://')
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+
+def async_engine_options(database_uri):
+    options = engine_options(database_uri)
+    if options.get('poolclass') is InstrumentedQueuePool:
+        options['poolclass'] = InstrumentedAsyncQueuePool
+    return options
+
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')),
+    ('synchronous', os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+    ('busy_timeout', os.environ.get('SQLITE_BUSY_TIMEOUT', '5000')),
+    ('cache_size', os.environ.get('SQLITE_CACHE_SIZE', '-20000')),
+    ('temp_store', 'MEMORY'),
+    ('mmap_size', os.environ.get('SQLITE_MMAP_SIZE', '268435456')),
+)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute('PRAGMA {}={}'.format(name, value))
+    cursor.close()
+
+
+def setup_pool(app):
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        instrument_pool(engine)
+
+
+def instrument_pool(engine):
+    """SQLite pragmas and invalidation counting for `engine` (sync, or an async engine's sync_engine)"""
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+    event.listen(engine.pool, 'invalidate', lambda *args: pool_metrics.record_invalidated())
+    return engine
@@ -0,0 +1,19 @@
+"""
+Shared query layer: routes build their queries here so the SELECT is narrowed
+to the requested fields and every relationship those fields read is loaded
+in the same round trip
+"""
+from sqlalchemy.orm import undefer
+
+
+def model_query(model, fields=None, query=None, sort=None, columns=()):
+    if query is None:
+        query = model.query
+    # the serializer knows which columns and many-to-one joins each field needs
+    options = model.serializer().load_options(fields)
+    if sort is not None:
+        # the keyset cursor reads the sort column even when it isn't an output field
+        options.append(undefer(sort[0]))
+    # extra columns read outside the serializer (e.g. foreign keys for ?expand=)
+    options.extend(undefer(column) for column in columns)
+    return query.options(*options)
@@ -0,0 +1,233 @@
+"""
+Admission control, checked before a request reaches its view (ENABLE_RATE_LIMIT):
+
+- a token bucket per client (the X-API-Key header when sent, else the client
+  address) holding RATE_LIMIT_BURST tokens and refilled at RATE_LIMIT_RATE
+  tokens a second. A request takes its route's cost (@rate_cost); a client
+  short of tokens gets 429 with Retry-After
+- a gate on how many requests are served at once, MAX_CONCURRENCY (by
+  default as many as the DB pools of the host's WEB_CONCURRENCY workers hand
+  out connections). Requests past it are shed with 503 and Retry-After
+  instead of queueing for a connection
+
+Buckets and the gate's slots live in a cache_backends store (RATE_LIMIT_BACKEND,
+shared memory by default) so that every worker on the host draws from the same
+ones. A sync gunicorn worker serves one request at a time, so the gate only
+sheds once threads, gevent or more workers than MAX_CONCURRENCY let more
+requests in at once than that
+"""
+import os
+import math
+import time
+import random
+import hashlib
+import logging
+from flask import g, request, jsonify, current_app
+from streaming import wants_stream
+from cache_backends import CACHE_URL, SHARED_CACHE_PATH, make_backend
+
+RATE_LIMIT_RATE = float(os.environ.get('RATE_LIMIT_RATE', 10))
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', 100))
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'shared')
+RATE_LIMIT_URL = os.environ.get('RATE_LIMIT_URL', CACHE_URL)
+RATE_LIMIT_PATH = os.environ.get('RATE_LIMIT_PATH', SHARED_CACHE_PATH + '-ratelimit')
+RATE_LIMIT_KEY_HEADER = os.environ.get('RATE_LIMIT_KEY_HEADER', 'X-API-Key')
+# behind a proxy the client address is the X-Forwarded-For hop the proxy appended (the last:
+# clients can send the header themselves); left off there, every client shares the proxy's
+# address and so a single bucket
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', '0').lower() in ('1', 'true', 'yes', 'on')
+# tokens per request: detail routes take the default, collection pages more, whole-table NDJSON streams most
+RATE_COST_DEFAULT = float(os.environ.get('RATE_COST_DEFAULT', 1))
+RATE_COST_COLLECTION = float(os.environ.get('RATE_COST_COLLECTION', 5))
+RATE_COST_STREAM = float(os.environ.get('RATE_COST_STREAM', 50))
+MAX_CONCURRENCY = os.environ.get('MAX_CONCURRENCY')  # unset: the DB pools' size plus overflow, 0: no gate
+# gunicorn's default worker count
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+# a slot whose worker died mid-request is free again after this many seconds
+SHED_SLOT_LEASE = float(os.environ.get('SHED_SLOT_LEASE', 60))
+SHED_RETRY_AFTER = int(os.environ.get('SHED_RETRY_AFTER', 1))
+
+logger = logging.getLogger(__name__)
+
+
+def rate_cost(cost, stream=None):
+    """Tokens a request to the view takes; `stream`: what it takes when streamed as NDJSON"""
+    def decorator(view):
+        view.rate_cost = cost
+        view.rate_cost_stream = stream
+        return view
+    return decorator
+
+
+def request_cost(view):
+    stream = getattr(view, 'rate_cost_stream', None)
+    if stream is not None and wants_stream():
+        return stream
+    return getattr(view, 'rate_cost', RATE_COST_DEFAULT)
+
+
+def client_key():
+    api_key = request.headers.get(RATE_LIMIT_KEY_HEADER)
+    if api_key:
+        # the store may be shared with other apps: keep the key itself out of it
+        return 'rate:key:' + hashlib.sha1(api_key.encode()).hexdigest()
+    address = request.access_route[-1] if RATE_LIMIT_TRUST_FORWARDED and request.access_route else request.remote_addr
+    return 'rate:ip:' + str(address)
+
+
+class TokenBucket:
+    """Stored as b'<tokens> <time>'; refilled lazily from the time elapsed since the last take"""
+
+    def __init__(self, store, rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST):
+        self.store = store
+        self.rate = rate
+        self.burst = burst
+
+    def take(self, key, cost):
+        """(allowed, tokens left, seconds until `cost` tokens are available)"""
+        # a cost above the burst could never be paid
+        cost = min(cost, self.burst)
+
+        def take(raw):
+            now = time.time()
+            if raw is None:
+                tokens = self.burst
+            else:
+                tokens, stamp = (float(part) for part in raw.split())
+                tokens = min(self.burst, tokens + max(now - stamp, 0.0) * self.rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / self.rate
+            return '{:.6f} {:.6f}'.format(tokens, now).encode(), (wait == 0.0, tokens, wait)
+        # an idle bucket is full again after burst / rate seconds, so the key can go
+        return self.store.update(key, take, ttl=self.burst / self.rate + 1)
+
+
+class ConcurrencyGate:
+    """`limit` slots shared by every worker using `store`; a request holds one, a key leased for
+    `lease` seconds, while it is served"""
+
+    def __init__(self, store, limit, lease=SHED_SLOT_LEASE):
+        self.store = store
+        self.limit = limit
+        self.lease = lease
+        self.keys = ['gate:slot:{}'.format(i) for i in range(limit)]
+
+    def in_flight(self):
+        return sum(holder is not None for holder in self.store.get_many(self.keys))
+
+    def enter(self):
+        """A function that gives the slot back (calls after the first do nothing), or None when full"""
+        token = '{} {}'.format(os.getpid(), random.getrandbits(64)).encode()
+        for key, holder in zip(self.keys, self.store.get_many(self.keys)):
+            # add() returns another request's token when it took the slot in between
+            if holder is None and self.store.add(key, token, self.lease) == token:
+                break
+        else:
+            return None
+        released = []
+
+        def release():
+            if released:
+                return
+            released.append(True)
+            try:
+                if self.store.get(key) == token:
+                    self.store.delete(key)
+            except self.store.errors as error:
+                logger.warning('rate limit store unavailable, slot held until its lease ends: %s', error)
+        return release
+
+
+def rejected(status, message, retry_after, headers=()):
+    response = jsonify({'message': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(int(math.ceil(retry_after)), 1))
+    response.headers.extend(headers)
+    return response
+
+
+def _admit():
+    if request.method == 'OPTIONS':
+        return None
+    limiter = current_app.extensions['rate_limit']
+    bucket, gate = limiter['bucket'], limiter['gate']
+    view = current_app.view_functions.get(request.endpoint)
+    try:
+        allowed, tokens, wait = bucket.take(client_key(), request_cost(view))
+    except bucket.store.errors as error:
+        # fail open: an unreachable store must not take the API down with it
+        logger.warning('rate limit store unavailable: %s', error)
+    else:
+        g.rate_limit = (bucket.burst, tokens)
+        if not allowed:
+            return rejected(429, 'Too many requests', wait, rate_limit_headers())
+    if gate is not None:
+        try:
+            release = gate.enter()
+        except gate.store.errors as error:
+            logger.warning('rate limit store unavailable: %s', error)
+            return None
+        if release is None:
+            return rejected(503, 'Server busy, retry shortly', SHED_RETRY_AFTER)
+        g.release_slot = release
+
+
+def rate_limit_headers():
+    limit, tokens = g.rate_limit
+    return [('X-RateLimit-Limit', '{:g}'.format(limit)), ('X-RateLimit-Remaining', str(int(tokens)))]
+
+
+def _release_after(chunks, release):
+    try:
+        yield from chunks
+    finally:
+        release()
+
+
+def _finish(response):
+    if 'rate_limit' in g:
+        for name, value in rate_limit_headers():
+            response.headers.setdefault(name, value)
+    if response.is_streamed and 'release_slot' in g:
+        # teardown runs before a stream is sent: hold the slot until it is drained or closed
+        release = g.pop('release_slot')
+        response.response = _release_after(response.response, release)
+        response.call_on_close(release)
+    return response
+
+
+def _release(exc):
+    release = g.pop('release_slot', None)
+    if release is not None:
+        release()
+
+
+def pool_capacity(app, workers=1):
+    options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if 'pool_size' not in options:
+        return 0
+    return (options['pool_size'] + max(options.get('max_overflow', 0), 0)) * workers
+
+
+def setup_rate_limit(app):
+    store = make_backend(
+        app.config.get('RATE_LIMIT_BACKEND', RATE_LIMIT_BACKEND),
+        app.config.get('RATE_LIMIT_URL', RATE_LIMIT_URL),
+        path=app.config.get('RATE_LIMIT_PATH', RATE_LIMIT_PATH), slots=16384, slot_size=128,
+    )
+    limit = app.config.get('MAX_CONCURRENCY', MAX_CONCURRENCY)
+    if limit is None:
+        limit = pool_capacity(app, app.config.get('WEB_CONCURRENCY', WEB_CONCURRENCY))
+    limit = int(limit)
+    lease = app.config.get('SHED_SLOT_LEASE', SHED_SLOT_LEASE)
+    app.extensions['rate_limit'] = {
+        'bucket': TokenBucket(store, app.config.get('RATE_LIMIT_RATE', RATE_LIMIT_RATE),
+                              app.config.get('RATE_LIMIT_BURST', RATE_LIMIT_BURST)),
+        'gate': ConcurrencyGate(store, limit, lease) if limit > 0 else None,
+    }
+    app.before_request(_admit)
+    app.after_request(_finish)
+    app.teardown_request(_release)
@@ -0,0 +1,213 @@
+"""
+Read replicas. Each URL in DATABASE_REPLICA_URLS (comma separated) becomes a
+SQLAlchemy bind, and RoutingSession sends the SELECTs of a GET request to a
+healthy replica, picked round robin. Writes, flushes, views marked
+@read_primary and every request from a client that wrote within the last
+REPLICA_PIN_SECONDS (remembered in a cookie) stay on the primary. A checker
+thread in each worker takes a replica out of rotation while it is
+unreachable or a write it hasn't replayed yet (judged by the primary's newest
+TableStamp) is more than REPLICA_MAX_LAG seconds old
+"""
+import os
+import math
+import time
+import logging
+import itertools
+import threading
+from datetime import datetime, timezone
+from flask import request, current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, select, func, table, column, DateTime
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.selectable import SelectBase
+
+REPLICA_BIND_PREFIX = 'replica_'
+REPLICA_PIN_SECONDS = float(os.environ.get('REPLICA_PIN_SECONDS', 5))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 5))
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 30))  # 0: don't check lag
+PIN_COOKIE = 'read_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# models.py builds its session from this module, so the stamp table is spelled out here
+NEWEST_STAMP = select(func.max(column('modified', DateTime))).select_from(table('TableStamp'))
+
+logger = logging.getLogger(__name__)
+
+
+def replica_urls(value):
+    return [url.strip().replace('postgres://', 'postgresql://') for url in (value or '').split(',') if url.strip()]
+
+
+class RoutingSession(Session):
+    """Runs SELECTs on the engine in info['replica'] when a request put one there; anything
+    else (flushes, DML, raw SQL, session.connection()) goes to the bind Flask-SQLAlchemy picks"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if replica is not None and bind is None and not self._flushing and isinstance(clause, SelectBase):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_primary(view):
+    """Serve a GET view from the primary: its clients expect to see their writes at once"""
+    view.read_primary = True
+    return view
+
+
+class Replica:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = False
+        self.lag = None
+        # the primary's newest stamp when the replica was first seen without it
+        self.behind = None
+        self.error = None
+        self.checked = None
+
+
+class ReplicaSet:
+    def __init__(self, primary, replicas, pin=REPLICA_PIN_SECONDS, interval=REPLICA_CHECK_INTERVAL,
+                 max_lag=REPLICA_MAX_LAG):
+        self.primary = primary
+        self.replicas = replicas
+        self.pin = pin
+        self.interval = interval
+        self.max_lag = max_lag
+        self._next = itertools.count()
+        self._pid = None
+        self._lock = threading.Lock()
+        for replica in replicas:
+            event.listen(replica.engine, 'handle_error', self._error_handler(replica))
+
+    def _error_handler(self, replica):
+        def handle_error(context):
+            # a dropped or refused connection: out of rotation until the checker sees it answer
+            if context.is_disconnect or context.connection is None:
+                self._mark(replica, False, str(context.original_exception))
+        return handle_error
+
+    def _mark(self, replica, healthy, error=None):
+        if replica.healthy != healthy:
+            if healthy:
+                logger.warning('replica %s back in rotation', replica.name)
+            else:
+                logger.warning('replica %s out of rotation: %s', replica.name, error)
+        replica.healthy = healthy
+        replica.error = error
+
+    def _newest(self, engine):
+        with engine.connect() as connection:
+            return connection.execute(NEWEST_STAMP).scalar()
+
+    def check(self):
+        try:
+            newest = self._newest(self.primary)
+        except SQLAlchemyError as error:
+            logger.warning('replica lag unknown, primary unreachable: %s', error)
+            newest = None
+        for replica in self.replicas:
+            try:
+                seen = self._newest(replica.engine)
+            except SQLAlchemyError as error:
+                replica.lag = None
+                self._mark(replica, False, str(error))
+            else:
+                if newest is None or (seen is not None and seen >= newest):
+                    replica.behind = None
+                    replica.lag = 0.0
+                else:
+                    if replica.behind is None or (seen is not None and seen >= replica.behind):
+                        replica.behind = newest
+                    now = datetime.now(timezone.utc).replace(tzinfo=None)
+                    replica.lag = max((now - replica.behind).total_seconds(), 0.0)
+                if self.max_lag > 0 and replica.lag > self.max_lag:
+                    self._mark(replica, False, 'lagging {:.1f}s behind the primary'.format(replica.lag))
+                else:
+                    self._mark(replica, True)
+            replica.checked = time.time()
+
+    def choose(self):
+        """A healthy replica's engine, or None to read from the primary"""
+        self._start_checker()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)].engine
+
+    def _start_checker(self):
+        # per process, like the write-behind flusher: a forked worker doesn't inherit the thread
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # the first request waits for one check instead of reading from the primary until the next
+            self.check()
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='replica-checker', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                logger.exception('replica check failed')
+
+    def snapshot(self):
+        return [{
+            'name': replica.name,
+            'healthy': replica.healthy,
+            'lag_seconds': replica.lag,
+            'error': replica.error,
+            'checked': replica.checked,
+        } for replica in self.replicas]
+
+
+def pinned():
+    try:
+        return float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _route_request():
+    replicas = current_app.extensions['replicas']
+    view = current_app.view_functions.get(request.endpoint)
+    replica = None
+    if request.method in ('GET', 'HEAD') and not getattr(view, 'read_primary', False) and not pinned():
+        replica = replicas.choose()
+    info = current_app.extensions['sqlalchemy'].session.info
+    if replica is None:
+        info.pop('replica', None)
+    else:
+        info['replica'] = replica
+
+
+def _pin_writer(response):
+    if request.method not in SAFE_METHODS and response.status_code < 400:
+        pin = current_app.extensions['replicas'].pin
+        response.set_cookie(PIN_COOKIE, '{:.3f}'.format(time.time() + pin), max_age=math.ceil(pin),
+                            httponly=True, samesite='Lax')
+    return response
+
+
+def setup_replicas(app):
+    db = app.extensions['sqlalchemy']
+    with app.app_context():
+        engines = db.engines
+        replicas = [Replica(key, engine) for key, engine in engines.items()
+                    if key is not None and key.startswith(REPLICA_BIND_PREFIX)]
+        primary = db.engine
+    if not replicas:
+        return
+    app.extensions['replicas'] = ReplicaSet(
+        primary, replicas,
+        pin=app.config.get('REPLICA_PIN_SECONDS', REPLICA_PIN_SECONDS),
+        interval=app.config.get('REPLICA_CHECK_INTERVAL', REPLICA_CHECK_INTERVAL),
+        max_lag=app.config.get('REPLICA_MAX_LAG', REPLICA_MAX_LAG),
+    )
+    app.before_request(_route_request)
+    app.after_request(_pin_writer)
@@ -0,0 +1,177 @@
+"""
+Name search over characters, planets, films, starships and vehicles.
+SQLite uses an FTS5 index kept in sync by triggers (rowid = pk * 8 + kind
+code, so trigger maintenance is a rowid seek); Postgres uses pg_trgm GIN
+indexes. Other dialects fall back to a LIKE scan. The migrations create the
+index, and so does create_all() on SQLite, where search can't run without it
+"""
+import os
+import re
+from flask import request
+from sqlalchemy import event, text, func, literal, select, union_all
+from utils import APIException
+from models import db, People, Planet, Film, Starship, Vehicle
+
+SEARCH_DEFAULT_LIMIT = int(os.environ.get('SEARCH_DEFAULT_LIMIT', 10))
+SEARCH_MAX_LIMIT = int(os.environ.get('SEARCH_MAX_LIMIT', 50))
+
+# kind -> (model, searchable column, FTS rowid kind code)
+SEARCHABLE = {
+    'people': (People, People.name, 1),
+    'planets': (Planet, Planet.name, 2),
+    'films': (Film, Film.title, 3),
+    'starships': (Starship, Starship.name, 4),
+    'vehicles': (Vehicle, Vehicle.name, 5),
+}
+KIND_BY_MODEL = {model: kind for kind, (model, _, _) in SEARCHABLE.items()}
+KIND_BY_CODE = {code: kind for kind, (_, _, code) in SEARCHABLE.items()}
+
+
+def _pk(model):
+    return model.__mapper__.primary_key[0]
+
+
+def search_ddl(dialect):
+    """Statements creating the search index for `dialect` (idempotent)"""
+    if dialect == 'sqlite':
+        statements = ["CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(text, prefix='2 3')"]
+        for kind, (model, column, code) in SEARCHABLE.items():
+            table, pk, col = model.__tablename__, _pk(model).name, column.key
+            rowid = '{{}}.{} * 8 + {}'.format(pk, code)
+            statements += [
+                'CREATE TRIGGER IF NOT EXISTS search_{k}_ai AFTER INSERT ON "{t}" BEGIN '
+                'INSERT INTO search_fts(rowid, text) VALUES ({new}, new.{c}); END'.format(k=kind, t=table, c=col, new=rowid.format('new')),
+                'CREATE TRIGGER IF NOT EXISTS search_{k}_ad AFTER DELETE ON "{t}" BEGIN '
+                'DELETE FROM search_fts WHERE rowid = {old}; END'.format(k=kind, t=table, old=rowid.format('old')),
+                'CREATE TRIGGER IF NOT EXISTS search_{k}_au AFTER UPDATE OF {c} ON "{t}" BEGIN '
+                'DELETE FROM search_fts WHERE rowid = {old}; '
+                'INSERT INTO search_fts(rowid, text) VALUES ({new}, new.{c}); END'.format(
+                    k=kind, t=table, c=col, old=rowid.format('old'), new=rowid.format('new')),
+            ]
+        return statements
+    if dialect == 'postgresql':
+        statements = ['CREATE EXTENSION IF NOT EXISTS pg_trgm']
+        for kind, (model, column, _) in SEARCHABLE.items():
+            statements.append('CREATE INDEX IF NOT EXISTS ix_{k}_{c}_trgm ON "{t}" USING gin ({c} gin_trgm_ops)'.format(
+                k=kind, c=column.key, t=model.__tablename__))
+        return statements
+    return []
+
+
+def ensure_search_index():
+    for statement in search_ddl(db.engine.dialect.name):
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+def _create_search_index(metadata, connection, **kw):
+    # Postgres only loses the speed-up without its GIN indexes, and CREATE EXTENSION may need a superuser
+    if connection.dialect.name == 'sqlite':
+        for statement in search_ddl('sqlite'):
+            connection.execute(text(statement))
+
+
+def _drop_search_index(metadata, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DROP TABLE IF EXISTS search_fts'))
+
+
+event.listen(db.metadata, 'after_create', _create_search_index)
+event.listen(db.metadata, 'before_drop', _drop_search_index)
+
+
+def rebuild_search_index():
+    """Repopulate the FTS table from the source tables (SQLite only; GIN indexes maintain themselves)"""
+    if db.engine.dialect.name != 'sqlite':
+        return 0
+    ensure_search_index()
+    db.session.execute(text('DELETE FROM search_fts'))
+    total = 0
+    for model, column, code in SEARCHABLE.values():
+        result = db.session.execute(text(
+            'INSERT INTO search_fts(rowid, text) SELECT {pk} * 8 + {code}, {col} FROM "{t}" WHERE {col} IS NOT NULL'.format(
+                pk=_pk(model).name, code=code, col=column.key, t=model.__tablename__)))
+        total += result.rowcount
+    db.session.commit()
+    return total
+
+
+def search_text(name, raw):
+    """`raw` stripped; a 400 when nothing but whitespace is left"""
+    value = (raw or '').strip()
+    if not value:
+        raise APIException('{} must not be empty'.format(name), status_code=400)
+    return value
+
+
+def fts_match(q):
+    """User text -> FTS5 MATCH expression: every word must match as a prefix"""
+    words = re.findall(r'\w+', q)
+    if not words:
+        raise APIException('q must contain at least one word', status_code=400)
+    return ' '.join('"{}"*'.format(word) for word in words)
+
+
+def search_limit():
+    limit = request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int)
+    if limit is None or limit < 1:
+        raise APIException('limit must be a positive integer', status_code=400)
+    return min(limit, SEARCH_MAX_LIMIT)
+
+
+def search(q, kinds, limit):
+    """Ranked [{kind, id, name, score}] across `kinds`"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        codes = ', '.join(str(SEARCHABLE[kind][2]) for kind in kinds)
+        rows = db.session.execute(text(
+            'SELECT rowid, text, bm25(search_fts) AS score FROM search_fts '
+            'WHERE search_fts MATCH :match AND (rowid % 8) IN ({}) '
+            'ORDER BY score LIMIT :limit'.format(codes)), {'match': fts_match(q), 'limit': limit})
+        return [
+            {'kind': KIND_BY_CODE[rowid % 8], 'id': rowid // 8, 'name': name, 'score': -score}
+            for rowid, name, score in rows
+        ]
+    selects = []
+    for kind in kinds:
+        model, column, _ = SEARCHABLE[kind]
+        score = func.similarity(column, q) if dialect == 'postgresql' else literal(0.0)
+        selects.append(
+            select(literal(kind).label('kind'), _pk(model).label('id'), column.label('name'), score.label('score'))
+            .where(contains_filter(column, q))
+        )
+    query = union_all(*selects).subquery()
+    rows = db.session.execute(select(query).order_by(query.c.score.desc()).limit(limit))
+    return [{'kind': kind, 'id': pk, 'name': name, 'score': score} for kind, pk, name, score in rows]
+
+
+def contains_filter(column, q):
+    return column.ilike('%' + q.replace('%', r'\%').replace('_', r'\_') + '%', escape='\\')
+
+
+def prefix_filter(column, prefix):
+    # an empty prefix has no upper bound; coerce() turns it away before it gets here
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite's LIKE is case-insensitive and skips the index; a range seek uses it
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return column >= prefix, column < upper
+    # LIKE 'abc%' is served by the trigram GIN index on Postgres
+    return (column.startswith(prefix, autoescape=True),)
+
+
+def apply_search_filters(query, model):
+    """Apply ?q= to a collection query of a searchable model (prefixes are a filters.py operator)"""
+    kind = KIND_BY_MODEL.get(model)
+    if kind is None:
+        return query
+    _, column, code = SEARCHABLE[kind]
+    if 'q' in request.args:
+        q = search_text('q', request.args['q'])
+        if db.engine.dialect.name == 'sqlite':
+            matches = text(
+                'SELECT rowid / 8 AS id FROM search_fts WHERE search_fts MATCH :match AND rowid % 8 = :code'
+            ).bindparams(match=fts_match(q), code=code).columns(id=_pk(model).type)
+            query = query.filter(_pk(model).in_(matches))
+        else:
+            query = query.filter(contains_filter(column, q))
+    return query
@@ -0,0 +1,124 @@
+"""
+Declarative serializer registry.
+Each model lists its output fields once in `__fields__`; the first time a given
+field set is requested it is compiled into a single getter and cached, so
+serializing a row is one attrgetter call plus any related lookups
+"""
+from operator import attrgetter
+from flask import request
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, load_only
+from utils import APIException
+
+MAX_COMPILED_FIELDSETS = 64
+
+
+class related:
+    """A field read through a many-to-one relationship, e.g. related('gender', 'type')"""
+
+    def __init__(self, relationship, attr, as_list=False):
+        self.relationship = relationship
+        self.attr = attr
+        self.as_list = as_list
+
+    def __call__(self, obj):
+        target = getattr(obj, self.relationship)
+        if target is None:
+            return [] if self.as_list else None
+        value = getattr(target, self.attr)
+        return [value] if self.as_list else value
+
+
+class Serializer:
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self._compiled = {}
+
+    def resolve(self, names=None):
+        """Requested field names in declaration order; None means all fields"""
+        if not names:
+            return tuple(self.fields)
+        unknown = set(names) - set(self.fields)
+        if unknown:
+            raise APIException('Unknown field(s): ' + ', '.join(sorted(unknown)), status_code=400)
+        return tuple(name for name in self.fields if name in names)
+
+    def getter(self, names=None):
+        names = self.resolve(names)
+        dump = self._compiled.get(names)
+        if dump is None:
+            dump = self._compile(names)
+            if len(self._compiled) < MAX_COMPILED_FIELDSETS:
+                self._compiled[names] = dump
+        return dump
+
+    def _compile(self, names):
+        plain = [(name, self.fields[name]) for name in names if isinstance(self.fields[name], str)]
+        computed = [(name, self.fields[name]) for name in names if not isinstance(self.fields[name], str)]
+        keys = tuple(name for name, _ in plain)
+        if len(plain) > 1:
+            get = attrgetter(*[source for _, source in plain])
+        elif plain:
+            single = attrgetter(plain[0][1])
+            get = lambda obj: (single(obj),)
+        else:
+            get = lambda obj: ()
+
+        def dump(obj):
+            data = dict(zip(keys, get(obj)))
+            for name, source in computed:
+                data[name] = source(obj)
+            return data
+
+        return dump
+
+    def models(self):
+        """The model itself and every model a `related` field reads from"""
+        mapper = inspect(self.model)
+        related_models = (
+            mapper.relationships[source.relationship].mapper.class_
+            for source in self.fields.values() if not isinstance(source, str)
+        )
+        return tuple(dict.fromkeys((self.model,) + tuple(related_models)))
+
+    def load_options(self, names=None):
+        """load_only() for the columns the fields read, plus a narrowed joinedload per relationship"""
+        mapper = inspect(self.model)
+        columns = [getattr(self.model, mapper.get_property_by_column(col).key) for col in mapper.primary_key]
+        options = []
+        for name in self.resolve(names):
+            source = self.fields[name]
+            if isinstance(source, str):
+                columns.append(getattr(self.model, source))
+                continue
+            rel = mapper.relationships[source.relationship]
+            columns.extend(getattr(self.model, mapper.get_property_by_column(col).key) for col in rel.local_columns)
+            options.append(joinedload(rel.class_attribute).load_only(getattr(rel.mapper.class_, source.attr)))
+        return [load_only(*columns)] + options
+
+
+class Serializable:
+    """Mixin for models that declare `__fields__ = {output_name: attribute or related(...)}`"""
+
+    @classmethod
+    def serializer(cls):
+        registered = SERIALIZERS.get(cls)
+        if registered is None:
+            registered = SERIALIZERS[cls] = Serializer(cls, cls.__fields__)
+        return registered
+
+    def serialize(self, fields=None):
+        return type(self).serializer().getter(fields)(self)
+
+
+SERIALIZERS = {}
+
+
+def requested_fields(model):
+    """The ?fields=a,b sparse fieldset for `model`, validated; None when absent"""
+    raw = request.args.get('fields')
+    if not raw:
+        return None
+    names = [name.strip() for name in raw.split(',') if name.strip()]
+    return model.serializer().resolve(names)
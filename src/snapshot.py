@@ -0,0 +1,225 @@
+"""
+Database snapshots behind `flask export` / `flask restore`: one compressed
+columnar file per table plus a manifest.json. A table file is a sequence of
+row groups; each row group stores every column as its own compressed block
+(a null mask followed by packed int64 values, or string lengths followed by
+the UTF-8 bytes), so similar values sit together and compress well. Export
+streams through a server-side cursor and restore bulk-inserts row group by
+row group, so memory stays bounded by one row group
+"""
+import os
+import sys
+import json
+import lzma
+import zlib
+import struct
+import hashlib
+from array import array
+from datetime import datetime, timezone
+from sqlalchemy import select, delete, inspect as inspect_db, text
+from models import db
+from importer import insert_batch, reset_sequences
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ROW_GROUP = int(os.environ.get('SNAPSHOT_ROW_GROUP', 50000))
+MAGIC = b'SWSNAP1\n'
+# derived tables are rebuilt (or, for change stamps, rewritten) by the restore instead of being copied
+DERIVED_TABLES = {'Stat', 'TableStamp'}
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    'lzma': (lambda data: lzma.compress(data, preset=1), lzma.decompress),
+    'none': (bytes, bytes),
+}
+GROUP_HEADER = struct.Struct('<II')
+BLOCK_HEADER = struct.Struct('<I')
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def column_kind(column):
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return 'json'
+    if python_type is int:
+        return 'int'
+    if python_type is str:
+        return 'str'
+    return 'json'
+
+
+def encode_column(kind, values):
+    mask = bytes(value is None for value in values)
+    if kind == 'int':
+        packed = _little_endian(array('q', (0 if value is None else value for value in values))).tobytes()
+        return mask + packed
+    if kind == 'json':
+        values = [None if value is None else json.dumps(value) for value in values]
+    encoded = [b'' if value is None else value.encode('utf-8') for value in values]
+    lengths = _little_endian(array('I', (len(value) for value in encoded))).tobytes()
+    return mask + lengths + b''.join(encoded)
+
+
+def decode_column(kind, data, count):
+    mask = data[:count]
+    if kind == 'int':
+        values = array('q')
+        values.frombytes(data[count:count + 8 * count])
+        values = _little_endian(values)
+        return [None if null else value for null, value in zip(mask, values)]
+    lengths = array('I')
+    lengths.frombytes(data[count:count + 4 * count])
+    lengths = _little_endian(lengths)
+    out, offset = [], count + 4 * count
+    for null, length in zip(mask, lengths):
+        if null:
+            out.append(None)
+        else:
+            value = data[offset:offset + length].decode('utf-8')
+            out.append(json.loads(value) if kind == 'json' else value)
+        offset += length
+    return out
+
+
+def snapshot_tables():
+    return [table for table in db.metadata.sorted_tables if table.name not in DERIVED_TABLES]
+
+
+def write_table(table, path, codec, row_group=SNAPSHOT_ROW_GROUP):
+    """Stream `table` into `path`; returns (rows, row groups, sha256)"""
+    compress = CODECS[codec][0]
+    columns = list(table.columns)
+    kinds = [column_kind(column) for column in columns]
+    digest = hashlib.sha256()
+    rows = groups = 0
+    query = select(table).order_by(*table.primary_key.columns)
+    with open(path, 'wb') as f, db.engine.connect() as connection:
+        def write(chunk):
+            f.write(chunk)
+            digest.update(chunk)
+
+        write(MAGIC)
+        result = connection.execution_options(stream_results=True, yield_per=row_group).execute(query)
+        for partition in result.partitions(row_group):
+            write(GROUP_HEADER.pack(len(partition), len(columns)))
+            for i, kind in enumerate(kinds):
+                block = compress(encode_column(kind, [row[i] for row in partition]))
+                write(BLOCK_HEADER.pack(len(block)))
+                write(block)
+            rows += len(partition)
+            groups += 1
+    return rows, groups, digest.hexdigest()
+
+
+def read_table(path, kinds, codec):
+    """Yield each row group of a table file as a list of column value lists"""
+    decompress = CODECS[codec][1]
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a snapshot table file'.format(path))
+        while True:
+            header = f.read(GROUP_HEADER.size)
+            if not header:
+                return
+            count, column_count = GROUP_HEADER.unpack(header)
+            if column_count != len(kinds):
+                raise ValueError('{}: expected {} columns, found {}'.format(path, len(kinds), column_count))
+            group = []
+            for kind in kinds:
+                size, = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+                group.append(decode_column(kind, decompress(f.read(size)), count))
+            yield group
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def schema_revision():
+    if not inspect_db(db.engine).has_table('alembic_version'):
+        return None
+    return db.session.execute(text('SELECT version_num FROM alembic_version')).scalar()
+
+
+def export_snapshot(directory, codec='zlib', row_group=SNAPSHOT_ROW_GROUP, report=print):
+    os.makedirs(directory, exist_ok=True)
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'dialect': db.engine.dialect.name,
+        'schema_revision': schema_revision(),
+        'codec': codec,
+        'row_group': row_group,
+        'tables': [],
+    }
+    for table in snapshot_tables():
+        filename = table.name + '.col'
+        path = os.path.join(directory, filename)
+        rows, groups, sha256 = write_table(table, path, codec, row_group)
+        manifest['tables'].append({
+            'name': table.name,
+            'file': filename,
+            'rows': rows,
+            'row_groups': groups,
+            'bytes': os.path.getsize(path),
+            'sha256': sha256,
+            'columns': [{'name': column.name, 'kind': column_kind(column)} for column in table.columns],
+        })
+        report('{}: {} rows, {} bytes'.format(table.name, rows, os.path.getsize(path)))
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(directory):
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        raise ValueError('Unsupported snapshot version: {}'.format(manifest.get('version')))
+    for entry in manifest['tables']:
+        table = db.metadata.tables.get(entry['name'])
+        if table is None:
+            raise ValueError('Snapshot table {} is not in the schema'.format(entry['name']))
+        missing = [column['name'] for column in entry['columns'] if column['name'] not in table.columns]
+        if missing:
+            raise ValueError('{}: columns not in the schema: {}'.format(entry['name'], ', '.join(missing)))
+    return manifest
+
+
+def restore_snapshot(directory, replace=False, verify=True, report=print):
+    """Load a snapshot; with `replace`, empty the snapshot's tables first (children first)"""
+    manifest = load_manifest(directory)
+    entries = manifest['tables']
+    if verify:
+        for entry in entries:
+            if file_digest(os.path.join(directory, entry['file'])) != entry['sha256']:
+                raise ValueError('{}: checksum mismatch'.format(entry['file']))
+    use_copy = db.engine.dialect.name == 'postgresql' and db.engine.dialect.driver == 'psycopg2'
+    if replace:
+        for entry in reversed(entries):
+            db.session.execute(delete(db.metadata.tables[entry['name']]))
+        db.session.commit()
+    restored = {}
+    for entry in entries:
+        table = db.metadata.tables[entry['name']]
+        names = [column['name'] for column in entry['columns']]
+        kinds = [column['kind'] for column in entry['columns']]
+        rows = 0
+        for group in read_table(os.path.join(directory, entry['file']), kinds, manifest['codec']):
+            batch = [dict(zip(names, values)) for values in zip(*group)]
+            if batch:
+                insert_batch(table, batch, use_copy)
+            rows += len(batch)
+        restored[entry['name']] = rows
+        report('{}: {} rows'.format(entry['name'], rows))
+    if db.engine.dialect.name == 'postgresql':
+        reset_sequences(restored)
+    return restored
@@ -0,0 +1,214 @@
+"""
+Per-table change stamps behind Last-Modified / If-Modified-Since. A commit
+that writes a table (ORM flushes and bulk statements alike, as recorded by
+cache.py's session hooks) stamps it right after, in a short transaction of
+its own: stamping inside the writer's transaction would hold the hot
+TableStamp rows locked, and so serialize writers, until it committed. Stamps
+only move forward, whatever order concurrent commits stamp in. Reads come from
+an in-process copy that the process's own commits keep current and that is
+reloaded every STAMP_TTL seconds to pick up other workers' writes. A request
+routed to a read replica (replicas.py) reads that replica's stamps instead,
+so Last-Modified never runs ahead of the data it was served with
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timezone, timedelta
+from functools import wraps
+from flask import Response, request, current_app
+from sqlalchemy import event, select, update, insert, func
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, TableStamp
+from streaming import wants_stream
+
+STAMP_TTL = float(os.environ.get('STAMP_TTL', 5))
+
+logger = logging.getLogger(__name__)
+
+
+class StampCache:
+    def __init__(self, ttl=STAMP_TTL, engine=None):
+        self.ttl = ttl
+        self.engine = engine
+        self._stamps = {}
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        engine = self.engine if self.engine is not None else db.engine
+        with engine.connect() as connection:
+            rows = connection.execute(select(TableStamp.table_name, TableStamp.modified)).all()
+        with self._lock:
+            self._stamps = dict(rows)
+            self._expires = time.monotonic() + self.ttl
+
+    def get(self, tables):
+        """The newest stamp among `tables`, or None when none of them has been stamped"""
+        if self._expires < time.monotonic():
+            self._reload()
+        with self._lock:
+            stamps = [self._stamps[table] for table in tables if table in self._stamps]
+        return max(stamps) if stamps else None
+
+    def update(self, tables, when):
+        with self._lock:
+            for table in tables:
+                self._stamps[table] = when
+
+    def clear(self):
+        with self._lock:
+            self._stamps = {}
+            self._expires = 0.0
+
+
+table_stamps = StampCache()
+# replica engine -> the stamps as replicated to it so far
+replica_stamps = {}
+
+
+def request_stamps():
+    replica = db.session.info.get('replica')
+    if replica is None:
+        return table_stamps
+    stamps = replica_stamps.get(replica)
+    if stamps is None:
+        stamps = replica_stamps.setdefault(replica, StampCache(engine=replica))
+    return stamps
+
+
+def last_modified(tables):
+    return request_stamps().get(tables)
+
+
+def replica_caught_up(tables):
+    """False while the request reads `tables` from a replica that hasn't replayed the newest
+    write to them this process knows of: what it returns must not be cached"""
+    stamps = request_stamps()
+    if stamps is table_stamps:
+        return True
+    newest = table_stamps.get(tables)
+    seen = stamps.get(tables)
+    return newest is None or (seen is not None and seen >= newest)
+
+
+def stamp_tables(connection, tables, when):
+    """Move the stamps of `tables` forward to `when`; a newer stamp already there is kept"""
+    dialect = connection.dialect.name
+    rows = [{'table_name': table, 'modified': when} for table in sorted(tables)]
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            newest = func.greatest
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            newest = func.max
+        stmt = dialect_insert(TableStamp)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=['table_name'],
+            set_={'modified': newest(TableStamp.modified, stmt.excluded['modified'])},
+        ), rows)
+        return
+    for row in rows:
+        current = connection.execute(
+            select(TableStamp.modified).where(TableStamp.table_name == row['table_name'])
+        ).scalar()
+        if current is None:
+            connection.execute(insert(TableStamp).values(**row))
+        elif current < when:
+            connection.execute(
+                update(TableStamp).where(TableStamp.table_name == row['table_name']).values(modified=when)
+            )
+
+
+def _stamp_commit(session):
+    # flush first so the tables of still-pending objects are recorded too; cache.py's
+    # after_commit hook takes the record away, so it is copied here
+    session.flush()
+    changed = session.info.get('changed_tables')
+    if changed:
+        session.info['stamped'] = frozenset(changed) - {TableStamp.__tablename__}
+
+
+def _publish_stamps(session):
+    tables = session.info.pop('stamped', None)
+    if not tables:
+        return
+    # taken once the data is visible, so a reader never pairs old data with the new stamp
+    when = datetime.now(timezone.utc).replace(tzinfo=None)
+    try:
+        with session.get_bind().begin() as connection:
+            stamp_tables(connection, tables, when)
+    except SQLAlchemyError as error:
+        # the commit stands; other workers see the change once a later write stamps these tables
+        logger.error('change stamps not written for %s: %s', ', '.join(sorted(tables)), error)
+    table_stamps.update(tables, when)
+
+
+def _discard_stamps(session):
+    session.info.pop('stamped', None)
+
+
+def http_date(modified):
+    """`modified` rounded up to the whole second an HTTP date carries; None until that second is
+    over, as a second write within it would get the same date and a client holding it a stale 304"""
+    if modified is None:
+        return None
+    rounded = modified.replace(microsecond=0, tzinfo=timezone.utc)
+    if modified.microsecond:
+        rounded += timedelta(seconds=1)
+    if rounded > datetime.now(timezone.utc):
+        return None
+    return rounded
+
+
+def is_modified_since(modified):
+    """False when the request's If-Modified-Since already covers `modified`"""
+    modified = http_date(modified)
+    since = request.if_modified_since
+    if modified is None or since is None:
+        return True
+    return modified > since
+
+
+def set_last_modified(response, modified):
+    modified = http_date(modified)
+    if modified is not None:
+        response.last_modified = modified
+    return response
+
+
+def not_modified(modified):
+    return set_last_modified(Response(status=304), modified)
+
+
+def conditional(*models, skip=None):
+    """Answer If-Modified-Since for a GET view from the change stamps of every table its output reads.
+    `skip(**view_args)` returning true serves the view as is: its output isn't covered by the stamps"""
+    tables = frozenset(model.__tablename__ for model in models)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if wants_stream() or (skip is not None and skip(*args, **kwargs)):
+                return view(*args, **kwargs)
+            # read before the view runs, so the stamp is never newer than the data
+            modified = last_modified(tables)
+            if not is_modified_since(modified):
+                return not_modified(modified)
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                set_last_modified(response, modified)
+            return response
+        # lets other front ends (asgi.py) apply the same check to this endpoint
+        wrapper.stamp_tables = tables
+        return wrapper
+    return decorator
+
+
+def setup_stamps(app):
+    if event.contains(db.session, 'before_commit', _stamp_commit):
+        return
+    event.listen(db.session, 'before_commit', _stamp_commit)
+    event.listen(db.session, 'after_commit', _publish_stamps)
+    event.listen(db.session, 'after_rollback', _discard_stamps)
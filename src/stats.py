@@ -0,0 +1,208 @@
+"""
+Materialized counters behind /stats: characters per planet, species and
+gender, films per director and favorites per target. Each write collects
+the changes it makes to the counters (ORM flushes from the API and
+Flask-Admin through an after_flush hook, the favorites module's bulk
+statements explicitly) and applies them once it has committed, as increments
+in a short transaction of its own, so the hot counter rows of popular groups
+are never held locked while a request runs. Reads are primary key or index
+lookups instead of GROUP BYs. A process that dies between the two commits
+leaves the counters behind; `flask stats-rebuild` recomputes everything to
+repair drift
+"""
+import os
+import logging
+from collections import Counter
+from flask import request
+from sqlalchemy import event, inspect, select, func, delete, insert, update
+from sqlalchemy.exc import SQLAlchemyError
+from utils import APIException
+from models import db, People, Film, Favorite, Stat
+
+STATS_DEFAULT_LIMIT = int(os.environ.get('STATS_DEFAULT_LIMIT', 10))
+STATS_MAX_LIMIT = int(os.environ.get('STATS_MAX_LIMIT', 100))
+
+logger = logging.getLogger(__name__)
+
+# metric -> column whose non-NULL values are counted
+METRICS = {
+    'people_by_planet': People.planet_id,
+    'people_by_specie': People.specie_id,
+    'people_by_gender': People.gender_id,
+    'films_by_director': Film.director_id,
+    'favorites_by_planet': Favorite.planet_id,
+    'favorites_by_people': Favorite.people_id,
+    'favorites_by_film': Favorite.film_id,
+}
+# model -> [(metric, attribute key)] for the flush hook
+TRACKED = {}
+for _metric, _column in METRICS.items():
+    TRACKED.setdefault(_column.class_, []).append((_metric, _column.key))
+
+
+def favorite_metric(kind):
+    return 'favorites_by_' + kind
+
+
+def upsert_counts(connection, deltas):
+    """Add {(metric, group_id): delta} to the counters, creating missing rows"""
+    rows = [
+        {'metric': metric, 'group_id': group_id, 'count': delta}
+        for (metric, group_id), delta in deltas.items() if delta and group_id is not None
+    ]
+    if not rows:
+        return
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(Stat)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=['metric', 'group_id'],
+            set_={'count': Stat.count + stmt.excluded['count']},
+        ), rows)
+        return
+    for row in rows:
+        result = connection.execute(
+            update(Stat)
+            .where(Stat.metric == row['metric'], Stat.group_id == row['group_id'])
+            .values(count=Stat.count + row['count'])
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(Stat).values(**row))
+
+
+def pending_deltas(session):
+    return session.info.setdefault('stat_deltas', Counter())
+
+
+def record_favorites(kind, target_ids, delta):
+    """Adjust favorite counters, once the session commits, for rows the favorites module wrote
+    with bulk statements"""
+    metric = favorite_metric(kind)
+    deltas = pending_deltas(db.session)
+    for target_id in target_ids:
+        deltas[(metric, target_id)] += delta
+
+
+def _flush_deltas(session):
+    deltas = Counter()
+    for obj in session.new:
+        for metric, key in TRACKED.get(type(obj), ()):
+            deltas[(metric, getattr(obj, key))] += 1
+    for obj in session.deleted:
+        state = inspect(obj)
+        for metric, key in TRACKED.get(type(obj), ()):
+            history = state.attrs[key].history
+            for value in history.deleted or history.unchanged:
+                deltas[(metric, value)] -= 1
+    for obj in session.dirty:
+        tracked = TRACKED.get(type(obj))
+        if not tracked or obj in session.deleted:
+            continue
+        state = inspect(obj)
+        for metric, key in tracked:
+            history = state.attrs[key].history
+            if not history.has_changes():
+                continue
+            for value in history.deleted:
+                deltas[(metric, value)] -= 1
+            for value in history.added:
+                deltas[(metric, value)] += 1
+    return deltas
+
+
+def _record_flush(session, flush_context):
+    # new/dirty/deleted and attribute history still describe the flush here,
+    # and foreign keys set through relationships have been synced
+    pending_deltas(session).update(_flush_deltas(session))
+
+
+def _apply_deltas(session):
+    deltas = session.info.pop('stat_deltas', None)
+    if not deltas:
+        return
+    try:
+        with session.get_bind().begin() as connection:
+            upsert_counts(connection, deltas)
+    except SQLAlchemyError as error:
+        # the write itself is committed: the counters drift until the next stats-rebuild
+        logger.error('stats counters not updated (run flask stats-rebuild): %s', error)
+
+
+def _discard_deltas(session):
+    session.info.pop('stat_deltas', None)
+
+
+def _load_previous_value(target, value, oldvalue, initiator):
+    pass
+
+
+def stats_limit():
+    limit = request.args.get('limit', STATS_DEFAULT_LIMIT, type=int)
+    if limit is None or limit < 1:
+        raise APIException('limit must be a positive integer', status_code=400)
+    return min(limit, STATS_MAX_LIMIT)
+
+
+def check_metric(metric):
+    if metric not in METRICS:
+        raise APIException('Unknown metric: {}'.format(metric), status_code=404)
+    return metric
+
+
+def leaderboard(metric, limit):
+    """Top `limit` groups of `metric` by count, from the (metric, count) index"""
+    rows = db.session.execute(
+        select(Stat.group_id, Stat.count)
+        .where(Stat.metric == check_metric(metric), Stat.count > 0)
+        .order_by(Stat.count.desc(), Stat.group_id)
+        .limit(limit)
+    )
+    return [{'id': group_id, 'count': count} for group_id, count in rows]
+
+
+def stat_count(metric, group_id):
+    count = db.session.execute(
+        select(Stat.count).where(Stat.metric == check_metric(metric), Stat.group_id == group_id)
+    ).scalar()
+    return count or 0
+
+
+def computed_counts():
+    """{(metric, group_id): count} straight from the source tables"""
+    counts = {}
+    for metric, column in METRICS.items():
+        rows = db.session.execute(
+            select(column, func.count()).where(column.isnot(None)).group_by(column)
+        )
+        counts.update(((metric, group_id), count) for group_id, count in rows)
+    return counts
+
+
+def rebuild_stats():
+    """Recompute every counter from the source tables; returns (counters written, counters that had drifted)"""
+    current = {(metric, group_id): count for metric, group_id, count in db.session.execute(
+        select(Stat.metric, Stat.group_id, Stat.count).where(Stat.count != 0))}
+    counts = computed_counts()
+    drifted = sum(1 for key in set(current) | set(counts) if current.get(key) != counts.get(key))
+    db.session.execute(delete(Stat))
+    if counts:
+        db.session.execute(insert(Stat), [
+            {'metric': metric, 'group_id': group_id, 'count': count} for (metric, group_id), count in counts.items()
+        ])
+    db.session.commit()
+    return len(counts), drifted
+
+
+def setup_stats(app):
+    if event.contains(db.session, 'after_flush', _record_flush):
+        return
+    event.listen(db.session, 'after_flush', _record_flush)
+    event.listen(db.session, 'after_commit', _apply_deltas)
+    event.listen(db.session, 'after_rollback', _discard_deltas)
+    # make assignments load the value they replace, so the flush hook can decrement its group
+    for column in METRICS.values():
+        event.listen(column, 'set', _load_previous_value, active_history=True)
@@ -0,0 +1,234 @@
+"""
+Write-behind for the single favorite POST/DELETE routes (FAVORITES_WRITE_BEHIND).
+A mutation is appended to a local log file, fsync'd and acknowledged; a
+flusher thread in each worker periodically renames the log aside, keeps
+only the last op per (user_id, kind, target_id) and applies what is left to
+Favorite in batched transactions. Ops are idempotent, so a file whose flush
+was interrupted is simply replayed. GET /user/<id>/favorites overlays the
+ops still queued so a client always reads its own writes
+"""
+import os
+import json
+import time
+import fcntl
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from sqlalchemy import select, or_
+from utils import APIException
+from models import db, User, Favorite
+from favorites import FAVORITE_KINDS, FAVORITE_TARGETS, existing_targets, insert_favorites, remove_favorites
+
+FAVORITES_QUEUE_PATH = os.environ.get('FAVORITES_QUEUE_PATH', os.path.join(tempfile.gettempdir(), 'favorites-queue.log'))
+FAVORITES_FLUSH_INTERVAL = float(os.environ.get('FAVORITES_FLUSH_INTERVAL', 1.0))
+FAVORITES_FLUSH_BATCH = int(os.environ.get('FAVORITES_FLUSH_BATCH', 1000))
+FAVORITES_QUEUE_FSYNC = os.environ.get('FAVORITES_QUEUE_FSYNC', '1').strip().lower() in ('1', 'true', 'yes', 'on')
+
+logger = logging.getLogger(__name__)
+
+
+class FavoriteQueue:
+    """
+    Appenders hold a shared flock on `<path>.lock` while writing, and the
+    flusher takes it exclusively to rename the log to `<path>.flushing`, so no
+    op lands in a file that is already being applied. `<path>.flush.lock`
+    keeps the workers' flushers from applying the same file twice
+    """
+
+    def __init__(self, app, path=FAVORITES_QUEUE_PATH, interval=FAVORITES_FLUSH_INTERVAL,
+                 batch=FAVORITES_FLUSH_BATCH, fsync=FAVORITES_QUEUE_FSYNC):
+        self.app = app
+        self.path = path
+        self.flushing_path = path + '.flushing'
+        self.interval = interval
+        self.batch = batch
+        self.fsync = fsync
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self, path, operation):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, operation)
+            yield
+        finally:
+            os.close(fd)
+
+    def _append(self, op, user_id, kind, target_id):
+        # user_id leads each line so pending() can pick a user's ops without parsing the rest
+        record = {'user_id': user_id, 'op': op, 'kind': kind, 'id': target_id, 'ts': time.time()}
+        line = json.dumps(record, separators=(',', ':')).encode() + b'\n'
+        with self._locked(self.path + '.lock', fcntl.LOCK_SH):
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, line)
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+        self._start_flusher()
+
+    def add(self, user_id, kind, target_id):
+        """Queue a favorite; raises a 404 APIException for an unknown user or target"""
+        found = existing_targets(user_id, {kind: [target_id]})
+        if (kind, target_id) not in found:
+            raise APIException('{} not found'.format(kind.capitalize()), status_code=404)
+        self._append('add', user_id, kind, target_id)
+
+    def remove(self, user_id, kind, target_id):
+        """Queue a removal; False when the favorite doesn't exist once queued ops are counted"""
+        op = self.pending(user_id).get((kind, target_id))
+        if op is None:
+            column = getattr(Favorite, FAVORITE_KINDS[kind])
+            exists = db.session.execute(
+                select(Favorite.id).where(Favorite.user_id == user_id, column == target_id).limit(1)
+            ).first() is not None
+        else:
+            exists = op == 'add'
+        if not exists:
+            return False
+        self._append('remove', user_id, kind, target_id)
+        return True
+
+    def _records(self, path, prefix=b'{'):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        for line in data.splitlines():
+            if not line.startswith(prefix):
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the tail of a write cut short by a crash
+                continue
+            yield record
+
+    def pending(self, user_id):
+        """{(kind, target_id): 'add' or 'remove'} for the user's ops not yet applied.
+        Read these before querying Favorite: a flush commits before it drops its file"""
+        prefix = '{{"user_id":{},'.format(user_id).encode()
+        ops = {}
+        with self._locked(self.path + '.lock', fcntl.LOCK_SH):
+            # the file being flushed holds the older ops
+            for path in (self.flushing_path, self.path):
+                for record in self._records(path, prefix):
+                    ops[(record['kind'], record['id'])] = record['op']
+        # ops left by an earlier run get a flusher even if no write comes first
+        self._start_flusher()
+        return ops
+
+    def overlay(self, query, user_id):
+        """(query, extra rows): the user's Favorite query without the rows queued ops
+        replace, and unsaved Favorite objects for the queued adds"""
+        ops = self.pending(user_id)
+        if not ops:
+            return query, []
+        by_kind = {}
+        for kind, target_id in ops:
+            by_kind.setdefault(kind, []).append(target_id)
+        for kind, ids in by_kind.items():
+            column = getattr(Favorite, FAVORITE_KINDS[kind])
+            query = query.filter(or_(column.is_(None), column.notin_(ids)))
+        added = [
+            Favorite(user_id=user_id, **{FAVORITE_KINDS[kind]: target_id})
+            for (kind, target_id), op in ops.items() if op == 'add'
+        ]
+        return query, added
+
+    def flush(self, wait=False):
+        """Apply queued ops; returns how many were applied. Without `wait`, returns 0
+        right away when another thread or worker is already flushing"""
+        fd = os.open(self.path + '.flush.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            applied = 0
+            # a leftover file from an interrupted flush goes first, then one rotation of the log
+            for _ in range(2):
+                if not os.path.exists(self.flushing_path):
+                    with self._locked(self.path + '.lock', fcntl.LOCK_EX):
+                        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+                            break
+                        os.rename(self.path, self.flushing_path)
+                applied += self._apply(self._records(self.flushing_path))
+                os.unlink(self.flushing_path)
+            return applied
+        finally:
+            os.close(fd)
+
+    def _apply(self, records):
+        latest = {}
+        for record in records:
+            latest[(record['user_id'], record['kind'], record['id'])] = record['op']
+        ops = list(latest.items())
+        for start in range(0, len(ops), self.batch):
+            self._apply_batch(ops[start:start + self.batch])
+        return len(ops)
+
+    def _apply_batch(self, ops):
+        grouped = {}
+        for (user_id, kind, target_id), op in ops:
+            grouped.setdefault((user_id, kind, op), []).append(target_id)
+        # adds were validated when queued; drop any whose user or target has since been deleted
+        adds = [(user_id, kind, ids) for (user_id, kind, op), ids in grouped.items() if op == 'add']
+        users = {user_id for user_id, _, _ in adds}
+        if users:
+            users = set(db.session.execute(select(User.id).where(User.id.in_(users))).scalars())
+        targets = {}
+        for _, kind, ids in adds:
+            targets.setdefault(kind, set()).update(ids)
+        for kind, ids in targets.items():
+            pk = FAVORITE_TARGETS[kind]
+            targets[kind] = set(db.session.execute(select(pk).where(pk.in_(ids))).scalars())
+        for (user_id, kind, op), ids in grouped.items():
+            if op == 'remove':
+                remove_favorites(user_id, kind, ids)
+                continue
+            valid = [target_id for target_id in ids if user_id in users and target_id in targets[kind]]
+            if len(valid) < len(ids):
+                logger.warning('dropped %d queued %s favorites of user %s: user or target no longer exists',
+                               len(ids) - len(valid), kind, user_id)
+            if valid:
+                insert_favorites(user_id, kind, valid)
+        db.session.commit()
+
+    def _start_flusher(self):
+        # per process: a worker forked from a parent that had started one doesn't inherit the thread
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='favorites-flusher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception:
+                # the file stays in place and is replayed on the next round
+                logger.exception('favorites flush failed')
+
+
+def make_queue(app):
+    return FavoriteQueue(
+        app,
+        path=app.config.get('FAVORITES_QUEUE_PATH', FAVORITES_QUEUE_PATH),
+        interval=app.config.get('FAVORITES_FLUSH_INTERVAL', FAVORITES_FLUSH_INTERVAL),
+        batch=app.config.get('FAVORITES_FLUSH_BATCH', FAVORITES_FLUSH_BATCH),
+        fsync=app.config.get('FAVORITES_QUEUE_FSYNC', FAVORITES_QUEUE_FSYNC),
+    )
+
+
+def setup_write_behind(app):
+    app.extensions['favorite_queue'] = make_queue(app)
@@ -0,0 +1,53 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+# keep the change stamps in memory for the whole run, so no reload lands inside a counted request
+os.environ.setdefault('STAMP_TTL', '3600')
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Builds an app on a fresh SQLite file; `config` overrides the defaults below"""
+    from app import create_app
+    from models import db
+    from cache import response_cache
+    from stamps import table_stamps, replica_stamps
+    apps = []
+
+    def make(**config):
+        # these outlive an app: don't let one test's entries answer the next one's requests
+        response_cache.clear()
+        table_stamps.clear()
+        replica_stamps.clear()
+        app = create_app(dict({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'test.db'),
+            'ENABLE_MIGRATIONS': False,
+            'ENABLE_ADMIN': False,
+            'ENABLE_SWAGGER': False,
+            'FAVORITES_WRITE_BEHIND': False,
+            'ENABLE_RATE_LIMIT': False,
+            'DATABASE_REPLICA_URLS': [],
+        }, **config))
+        with app.app_context():
+            # the primary only: replicas get their schema the way they get their rows
+            db.create_all(bind_key=None)
+        apps.append(app)
+        return app
+    yield make
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
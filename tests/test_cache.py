@@ -0,0 +1,22 @@
+"""The response cache must not outlive a commit made by another worker process"""
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import update
+from models import db, Planet
+from stamps import stamp_tables, table_stamps
+
+
+def test_hit_dropped_when_another_worker_stamps_newer(app, client):
+    with app.app_context():
+        db.session.add(Planet(planet_id=1, name='Tatooine', population=200000, terrain='desert', diameter=10465))
+        db.session.commit()
+    assert client.get('/planets').get_json()[0]['name'] == 'Tatooine'
+    assert client.get('/planets').get_json()[0]['name'] == 'Tatooine'
+
+    # a write on the engine directly, as another process would make it: none of this process's
+    # session hooks run, so only the stamp it leaves behind can tell the cached entry is stale
+    with app.app_context(), db.engine.begin() as connection:
+        connection.execute(update(Planet).where(Planet.planet_id == 1).values(name='Alderaan'))
+        stamp_tables(connection, {Planet.__tablename__}, datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=1))
+    table_stamps.clear()  # as STAMP_TTL running out would
+
+    assert client.get('/planets').get_json()[0]['name'] == 'Alderaan'
@@ -0,0 +1,99 @@
+"""Every entity cache backend must behave the same behind the CacheBackend interface"""
+import time
+import pytest
+import fakeredis
+from cache import EntityCache
+from cache_backends import LocalBackend, SharedMemoryBackend, RedisBackend
+
+
+@pytest.fixture(params=['local', 'shared', 'redis'])
+def backend(request, tmp_path):
+    if request.param == 'local':
+        return LocalBackend(maxsize=8)
+    if request.param == 'shared':
+        return SharedMemoryBackend(path=str(tmp_path / 'cache'), slots=8, slot_size=128)
+    return RedisBackend(client=fakeredis.FakeRedis())
+
+
+def test_add_keeps_the_first_value(backend):
+    assert backend.add('key', b'first') == b'first'
+    assert backend.add('key', b'second') == b'first'
+    assert backend.get('key') == b'first'
+
+
+def test_incr(backend):
+    assert backend.incr('counter') == 1
+    assert backend.incr('counter') == 2
+    assert backend.incr('seeded', seed=41) == 42
+    # the seed only applies to a missing key
+    assert backend.incr('counter', seed=41) == 3
+
+
+def test_get_many(backend):
+    backend.set('a', b'1')
+    backend.set('c', b'3')
+    assert backend.get_many(['a', 'b', 'c']) == [b'1', None, b'3']
+    assert backend.get_many([]) == []
+
+
+def test_update(backend):
+    def bump(current):
+        count = int(current or 0) + 1
+        return str(count).encode(), count
+    assert backend.update('key', bump) == 1
+    assert backend.update('key', bump) == 2
+    assert backend.get('key') == b'2'
+
+
+def test_delete_and_clear(backend):
+    backend.set('a', b'1')
+    backend.set('b', b'2')
+    backend.delete('a')
+    assert backend.get('a') is None
+    backend.clear()
+    assert backend.get('b') is None
+
+
+def test_ttl_expiry(backend):
+    backend.set('short', b'1', ttl=0.05)
+    backend.set('long', b'2', ttl=60)
+    backend.set('forever', b'3')
+    assert backend.get('short') == b'1'
+    time.sleep(0.1)
+    assert backend.get_many(['short', 'long', 'forever']) == [None, b'2', b'3']
+    # an expired key is missing for add and incr too
+    backend.set('short', b'1', ttl=0.05)
+    time.sleep(0.1)
+    assert backend.add('short', b'new') == b'new'
+
+
+@pytest.mark.parametrize('make', [
+    lambda tmp_path: LocalBackend(maxsize=4),
+    lambda tmp_path: SharedMemoryBackend(path=str(tmp_path / 'cache'), slots=4, slot_size=128),
+])
+def test_eviction_when_full(make, tmp_path):
+    backend = make(tmp_path)
+    for i in range(16):
+        backend.set('key{}'.format(i), b'x', ttl=60)
+    stored = backend.get_many(['key{}'.format(i) for i in range(16)])
+    assert stored.count(b'x') <= 4
+    assert stored[-1] == b'x'
+
+
+def test_version_changes_after_eviction(backend):
+    cache = EntityCache(backend)
+    before = cache.key({'planet'}, ('planet', 1))
+    backend.delete('version:planet')  # as an eviction would
+    cache.invalidate({'planet'})
+    after = cache.key({'planet'}, ('planet', 1))
+    assert after != before
+    # reseeded from a random base, not counted up from nothing
+    assert int(backend.get('version:planet')) > 1
+
+
+def test_version_changes_on_invalidate(backend):
+    cache = EntityCache(backend)
+    before = cache.key({'planet', 'people'}, ('people', 1))
+    assert cache.key({'planet', 'people'}, ('people', 1)) == before
+    cache.invalidate({'planet'})
+    assert cache.key({'planet', 'people'}, ('people', 1)) != before
@@ -0,0 +1,36 @@
+"""Filters and sorts are only accepted on indexed columns"""
+import pytest
+from models import db, User
+from filters import indexed_columns
+
+
+def test_indexed_filter_and_sort(client):
+    assert client.get('/planets?population__gt=10&sort=-diameter').status_code == 200
+
+
+@pytest.mark.parametrize('path', ['/users?lastname=Skywalker', '/users?lastname__prefix=Sky', '/users?sort=lastname'])
+def test_column_outside_the_whitelist(client, path):
+    response = client.get(path)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Cannot filter or sort on: lastname'
+
+
+@pytest.mark.parametrize('path', ['/users?lastname=Skywalker', '/users?sort=-lastname'])
+def test_whitelisted_column_without_an_index(client, monkeypatch, path):
+    monkeypatch.setattr(User, '__filterable__', ('lastname',), raising=False)
+    response = client.get(path)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Column is not indexed: lastname'
+
+
+def test_every_whitelisted_column_is_indexed(app):
+    for mapper in db.Model.registry.mappers:
+        model = mapper.class_
+        assert set(getattr(model, '__filterable__', ())) <= indexed_columns(model), model.__name__
+
+
+def test_bad_operator_and_value(client):
+    assert client.get('/planets?population__near=1').status_code == 400
+    assert client.get('/planets?population__gt=lots').status_code == 400
+    assert client.get('/planets?population__between=1').status_code == 400
+    assert client.get('/planets?diameter__prefix=1').status_code == 400
@@ -0,0 +1,51 @@
+"""`flask import` reads a whole-dataset JSON once and reports a rejected batch"""
+import json
+import click
+import pytest
+import importer
+from sqlalchemy import select
+from models import db, People, Planet
+from importer import sources, import_sources
+
+
+def write_dataset(tmp_path, data):
+    path = tmp_path / 'dataset.json'
+    path.write_text(json.dumps(data))
+    return str(path)
+
+
+def test_dataset_is_read_once_and_loaded_parents_first(app, tmp_path, monkeypatch):
+    # children before their parents, as a dump may well list them
+    path = write_dataset(tmp_path, {
+        'people': [{'character_id': 1, 'name': 'Luke', 'planet_id': 1}, {'character_id': 2, 'name': 'Leia', 'planet_id': 2}],
+        'planets': [{'planet_id': 1, 'name': 'Tatooine', 'population': 'unknown'}, {'planet_id': 2, 'name': 'Alderaan'}],
+    })
+    opened = []
+
+    class CountingStream(importer.JSONStream):
+        def __init__(self, f, *args, **kwargs):
+            opened.append(f.name)
+            super().__init__(f, *args, **kwargs)
+    monkeypatch.setattr(importer, 'JSONStream', CountingStream)
+    spool = tmp_path / 'spool'
+    spool.mkdir()
+    with app.app_context():
+        found = sources([path], spool=str(spool))
+        assert [source[0] for source in found] == ['Planet', 'People']
+        results = import_sources(found, batch_size=1, report=lambda line: None)
+        assert results['People'][0] == 2 and results['Planet'][0] == 2
+        assert db.session.execute(select(People.name).order_by(People.character_id)).scalars().all() == ['Luke', 'Leia']
+        assert db.session.get(Planet, 1).population is None
+    assert opened == [path]
+
+
+def test_rejected_batch_is_reported(app, tmp_path):
+    path = write_dataset(tmp_path, {'planets': [{'planet_id': 1, 'name': 'Tatooine'}, {'planet_id': 1, 'name': 'Tatooine'}]})
+    with app.app_context():
+        found = sources([path], spool=str(tmp_path))
+        with pytest.raises(click.ClickException) as raised:
+            import_sources(found, batch_size=1, report=lambda line: None)
+        assert 'dataset.json rows 2-2 (Planet)' in raised.value.message
+        # the first batch stays committed
+        assert db.session.execute(select(Planet.name)).scalars().all() == ['Tatooine']
+
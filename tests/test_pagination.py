@@ -0,0 +1,62 @@
+"""A cursor the API didn't issue for the listing it is sent to is a 400"""
+import json
+import base64
+import pytest
+from models import db, Planet
+
+
+def token(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).rstrip(b'=').decode()
+
+
+@pytest.fixture
+def planets(app):
+    with app.app_context():
+        db.session.add_all(Planet(planet_id=pk, name='planet {}'.format(pk), population=pk * 10) for pk in range(1, 6))
+        db.session.commit()
+
+
+def test_issued_cursor_pages_on(client, planets):
+    first = client.get('/planets?limit=2')
+    after = first.headers['X-Next-Cursor']
+    assert [row['name'] for row in client.get('/planets?limit=2&after=' + after).get_json()] == ['planet 3', 'planet 4']
+    first = client.get('/planets?limit=2&sort=-population')
+    after = first.headers['X-Next-Cursor']
+    assert len(client.get('/planets?limit=2&sort=-population&after=' + after).get_json()) == 2
+
+
+@pytest.mark.parametrize('after', [
+    '!!!',
+    token([1]),
+    token({'k': 2}),  # no table
+    token({'k': {'a': 1}, 't': 'Planet'}),
+    token({'k': 'x', 't': 'Planet'}),
+    token({'k': 1.5, 't': 'Planet'}),
+    token({'k': True, 't': 'Planet'}),
+    token({'k': None, 't': 'Planet'}),
+])
+def test_tampered_cursor(client, planets, after):
+    response = client.get('/planets?after=' + after)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Invalid cursor'
+
+
+@pytest.mark.parametrize('after', [
+    token({'k': [{'a': 1}, 1], 't': 'Planet', 's': '-population'}),
+    token({'k': ['many', 1], 't': 'Planet', 's': '-population'}),
+    token({'k': [10, 'x'], 't': 'Planet', 's': '-population'}),
+    token({'k': 10, 't': 'Planet', 's': '-population'}),
+])
+def test_tampered_sorted_cursor(client, planets, after):
+    assert client.get('/planets?sort=-population&after=' + after).status_code == 400
+
+
+def test_foreign_cursor(client, planets):
+    after = client.get('/planets?limit=2').headers['X-Next-Cursor']
+    response = client.get('/people?after=' + after)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Cursor belongs to another listing'
+    # issued for another order of the same table
+    sorted_after = client.get('/planets?limit=2&sort=-population').headers['X-Next-Cursor']
+    assert client.get('/planets?after=' + sorted_after).status_code == 400
+    assert client.get('/planets?sort=population&after=' + sorted_after).status_code == 400
@@ -0,0 +1,64 @@
+"""The collection endpoints must run the same number of statements whatever the row count"""
+import pytest
+from sqlalchemy import event
+from models import db, User, People, Planet, Film, Vehicle, Gender, Specie, Director, Favorite
+
+
+def seed_reference():
+    db.session.add_all([
+        Director(directo_id=1, name='George Lucas'),
+        Planet(planet_id=1, name='Tatooine', population=200000, terrain='desert', diameter=10465),
+        User(id=1, name='Luke', lastname='Skywalker', username='luke', suscription_dates='1977-05-25',
+             password='secret', email='luke@example.com'),
+    ])
+    db.session.commit()
+
+
+def add_people(start, stop):
+    # distinct related rows per person: a lazy load per relationship would show up as 4 statements a row
+    for pk in range(start, stop):
+        db.session.add_all([
+            Gender(gender_id=pk, type='gender {}'.format(pk)),
+            Specie(specie_id=pk, languaje='language {}'.format(pk)),
+            Vehicle(vehicle_id=pk, name='vehicle {}'.format(pk), model='model {}'.format(pk)),
+            Film(film_id=pk, title='film {}'.format(pk), director_id=1, opening='...'),
+        ])
+        db.session.add(People(character_id=pk, name='Person {}'.format(pk), height=170, gender_id=pk,
+                              specie_id=pk, vehicle_id=pk, film_id=pk, planet_id=1))
+        db.session.add(Favorite(user_id=1, people_id=pk))
+    db.session.commit()
+
+
+def count_statements(app, client, path):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'after_cursor_execute', count)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(engine, 'after_cursor_execute', count)
+    assert response.status_code == 200
+    return len(statements), response.get_json()
+
+
+@pytest.mark.parametrize('path', ['/people', '/user/1/favorites'])
+def test_statement_count_does_not_grow_with_rows(app, client, path):
+    with app.app_context():
+        seed_reference()
+        add_people(1, 6)
+    # the first request pays for one-off work (loading the change stamps)
+    client.get(path)
+    few, rows = count_statements(app, client, path)
+    assert len(rows) == 5
+
+    with app.app_context():
+        add_people(6, 41)
+    client.get(path)
+    many, rows = count_statements(app, client, path)
+    assert len(rows) == 40
+    assert many == few
@@ -0,0 +1,47 @@
+"""The concurrency gate counts requests across every worker sharing its store"""
+import time
+from cache_backends import SharedMemoryBackend
+from ratelimit import ConcurrencyGate
+
+
+def shared_store(tmp_path):
+    return SharedMemoryBackend(path=str(tmp_path / 'ratelimit'), slots=64, slot_size=128)
+
+
+def test_gate_is_shared_between_workers(tmp_path):
+    # two gates on one file, as two worker processes would have
+    first, second = ConcurrencyGate(shared_store(tmp_path), 2), ConcurrencyGate(shared_store(tmp_path), 2)
+    release = first.enter()
+    assert second.enter() is not None
+    assert first.enter() is None
+    assert second.enter() is None
+    release()
+    release()  # a second call gives nothing more back
+    assert second.enter() is not None
+    assert first.enter() is None
+
+
+def test_slot_of_a_dead_worker_is_freed_by_its_lease(tmp_path):
+    gate = ConcurrencyGate(shared_store(tmp_path), 1, lease=0.05)
+    assert gate.enter() is not None  # never released
+    assert gate.enter() is None
+    time.sleep(0.1)
+    assert gate.enter() is not None
+
+
+def test_requests_past_the_limit_are_shed(make_app, tmp_path):
+    app = make_app(ENABLE_RATE_LIMIT=True, RATE_LIMIT_PATH=str(tmp_path / 'ratelimit'), MAX_CONCURRENCY=1)
+    gate = app.extensions['rate_limit']['gate']
+    gate.store.clear()
+    client = app.test_client()
+    assert client.get('/planets').status_code == 200
+    # the first request gave its slot back
+    assert client.get('/planets').status_code == 200
+
+    # a request in flight in another worker
+    release = ConcurrencyGate(gate.store, 1).enter()
+    response = client.get('/planets')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    release()
+    assert client.get('/planets').status_code == 200
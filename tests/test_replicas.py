@@ -0,0 +1,123 @@
+"""GET requests read from a replica only while it has every write the primary has stamped"""
+import time
+import pytest
+from sqlalchemy import func, select, update
+from models import db, User, Planet, People, Favorite
+from stamps import replica_stamps
+
+
+def replica_config(tmp_path, name='replica.db', **config):
+    return dict({
+        'DATABASE_REPLICA_URLS': ['sqlite:///' + str(tmp_path / name)],
+        'REPLICA_CHECK_INTERVAL': 3600,
+    }, **config)
+
+
+def replica_engine():
+    return db.engines['replica_0']
+
+
+def replicate(app):
+    """Copy every row of the primary to the replica, as streaming replication would"""
+    with app.app_context():
+        db.metadata.create_all(replica_engine())
+        with db.engine.connect() as source, replica_engine().begin() as target:
+            for table in reversed(db.metadata.sorted_tables):
+                target.execute(table.delete())
+            for table in db.metadata.sorted_tables:
+                rows = [row._asdict() for row in source.execute(table.select())]
+                if rows:
+                    target.execute(table.insert(), rows)
+    replica_stamps.clear()  # as STAMP_TTL running out would
+
+
+def seed(app):
+    with app.app_context():
+        db.session.add_all([
+            Planet(planet_id=1, name='Tatooine', population=200000, terrain='desert', diameter=10465),
+            People(character_id=1, name='Luke', height=172, planet_id=1),
+            User(id=1, name='Luke', lastname='Skywalker', username='luke', suscription_dates='1977-05-25',
+                 password='secret', email='luke@example.com'),
+        ])
+        db.session.commit()
+
+
+def write_primary(app, model, **values):
+    with app.app_context():
+        db.session.execute(update(model).values(**values))
+        db.session.commit()
+
+
+def write_replica(app, model, **values):
+    with app.app_context(), replica_engine().begin() as connection:
+        connection.execute(update(model).values(**values))
+
+
+def count(engine, model):
+    with engine.connect() as connection:
+        return connection.execute(select(func.count()).select_from(model)).scalar()
+
+
+def test_get_reads_from_replica(make_app, tmp_path):
+    app = make_app(**replica_config(tmp_path))
+    seed(app)
+    replicate(app)
+    write_replica(app, Planet, name='Tatooine (replica)')
+    assert app.test_client().get('/planets/1').get_json()['name'] == 'Tatooine (replica)'
+
+
+def test_writes_and_read_your_writes_use_primary(make_app, tmp_path):
+    app = make_app(**replica_config(tmp_path))
+    seed(app)
+    replicate(app)
+    write_replica(app, Planet, name='Tatooine (replica)')
+    client = app.test_client()
+
+    assert client.post('/favorite/user/1/planet/1').status_code == 200
+    with app.app_context():
+        assert count(db.engine, Favorite) == 1
+        assert count(replica_engine(), Favorite) == 0
+    # the writer is pinned to the primary for a while
+    assert client.get('/planets/1').get_json()['name'] == 'Tatooine'
+    assert len(client.get('/user/1/favorites').get_json()) == 1
+
+
+@pytest.mark.parametrize('catch_up', [False, True])
+def test_lagging_replica_falls_back_to_primary(make_app, tmp_path, catch_up):
+    app = make_app(**replica_config(tmp_path, REPLICA_MAX_LAG=0.05))
+    seed(app)
+    if catch_up:
+        replicate(app)
+    else:
+        # a replica that never replayed a write: no TableStamp rows at all
+        with app.app_context():
+            db.metadata.create_all(replica_engine())
+    write_primary(app, Planet, name='Alderaan')
+    time.sleep(0.1)
+    app.extensions['replicas'].check()
+    assert app.extensions['replicas'].snapshot()[0]['healthy'] is False
+    assert app.test_client().get('/planets/1').get_json()['name'] == 'Alderaan'
+
+
+def test_missing_replica_falls_back_to_primary(make_app, tmp_path):
+    app = make_app(**replica_config(tmp_path, name='missing/replica.db'))
+    seed(app)
+    assert app.test_client().get('/planets/1').get_json()['name'] == 'Tatooine'
+    assert app.extensions['replicas'].snapshot()[0]['healthy'] is False
+
+
+def test_caches_skip_responses_from_a_replica_behind(make_app, tmp_path):
+    app = make_app(**replica_config(tmp_path, REPLICA_MAX_LAG=30))
+    seed(app)
+    replicate(app)
+    write_primary(app, Planet, name='Alderaan')
+    write_primary(app, People, name='Leia')
+    client = app.test_client()
+
+    # still in rotation, so these come from the replica and may be stale: not cached
+    assert client.get('/planets/1').get_json()['name'] == 'Tatooine'  # response cache
+    assert client.get('/people/1').get_json()['name'] == 'Luke'  # entity cache
+
+    replicate(app)
+    assert client.get('/planets/1').get_json()['name'] == 'Alderaan'
+    assert client.get('/people/1').get_json()['name'] == 'Leia'
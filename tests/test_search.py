@@ -0,0 +1,22 @@
+"""Search works on a database built with create_all(), as the tests and bench/datagen.py build it"""
+from models import db, People, Planet
+
+
+def test_search_after_create_all(app, client):
+    with app.app_context():
+        db.session.add_all([Planet(planet_id=1, name='Tatooine'), People(character_id=1, name='Luke Skywalker'),
+                            People(character_id=2, name='Leia Organa')])
+        db.session.commit()
+    response = client.get('/people?q=Luke')
+    assert response.status_code == 200
+    assert [row['name'] for row in response.get_json()] == ['Luke Skywalker']
+    assert [(row['kind'], row['id']) for row in client.get('/search?q=tato').get_json()] == [('planets', 1)]
+
+
+def test_drop_all_removes_the_index(app):
+    with app.app_context():
+        db.drop_all(bind_key=None)
+        db.create_all(bind_key=None)
+        db.session.add(People(character_id=1, name='Luke Skywalker'))
+        db.session.commit()
+    assert [row['name'] for row in app.test_client().get('/people?q=Luke').get_json()] == ['Luke Skywalker']
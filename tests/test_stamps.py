@@ -0,0 +1,27 @@
+"""Change stamps are written after the commit and only ever move forward"""
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import select
+from models import db, Planet, TableStamp
+from stamps import stamp_tables
+
+
+def stamps():
+    return dict(db.session.execute(select(TableStamp.table_name, TableStamp.modified)).all())
+
+
+def test_stamp_never_moves_back(app):
+    newer, older = datetime(2030, 1, 2), datetime(2030, 1, 1)
+    with app.app_context():
+        with db.engine.begin() as connection:
+            stamp_tables(connection, {'Planet'}, newer)
+            # a commit that stamps later with an earlier time, as concurrent writers can
+            stamp_tables(connection, {'Planet', 'People'}, older)
+        assert stamps() == {'Planet': newer, 'People': older}
+
+
+def test_commit_stamps_its_tables(app):
+    with app.app_context():
+        before = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=1)
+        db.session.add(Planet(planet_id=1, name='Tatooine'))
+        db.session.commit()
+        assert stamps()['Planet'] > before
@@ -0,0 +1,69 @@
+"""The /stats counters follow every write and stats-rebuild repairs drift"""
+import pytest
+from sqlalchemy import update
+from models import db, User, Planet, People, Stat
+
+
+@pytest.fixture
+def seeded(app):
+    with app.app_context():
+        db.session.add_all([
+            User(id=1, name='Luke', lastname='Skywalker', username='luke', suscription_dates='1977-05-25',
+                 password='secret', email='luke@example.com'),
+            Planet(planet_id=1, name='Tatooine'),
+            Planet(planet_id=2, name='Alderaan'),
+            People(character_id=1, name='Luke', planet_id=1),
+        ])
+        db.session.commit()
+
+
+def count(client, metric, group_id):
+    return client.get('/stats/{}/{}'.format(metric, group_id)).get_json()['count']
+
+
+def test_favorite_counters(client, seeded):
+    assert count(client, 'favorites_by_planet', 1) == 0
+    assert client.post('/favorite/user/1/planet/1').status_code == 200
+    assert count(client, 'favorites_by_planet', 1) == 1
+    # a duplicate add inserts nothing, so counts nothing
+    client.post('/favorite/user/1/planet/1')
+    client.post('/user/1/favorites:batch', json=[{'kind': 'planet', 'id': 1}, {'kind': 'planet', 'id': 2}])
+    assert count(client, 'favorites_by_planet', 1) == 1
+    assert count(client, 'favorites_by_planet', 2) == 1
+    assert client.delete('/favorite/user/1/planet/1').status_code == 200
+    assert client.delete('/favorite/user/1/planet/1').status_code == 404
+    assert count(client, 'favorites_by_planet', 1) == 0
+    assert client.get('/stats/favorites_by_planet').get_json() == [{'id': 2, 'count': 1}]
+
+
+def test_orm_writes_move_counters(app, client, seeded):
+    with app.app_context():
+        db.session.add(People(character_id=2, name='Biggs', planet_id=1))
+        db.session.commit()
+        db.session.get(People, 1).planet_id = 2
+        db.session.commit()
+        db.session.delete(db.session.get(People, 2))
+        db.session.commit()
+    assert count(client, 'people_by_planet', 1) == 0
+    assert count(client, 'people_by_planet', 2) == 1
+
+
+def test_failed_write_counts_nothing(app, client, seeded):
+    with app.app_context():
+        db.session.add(People(character_id=2, name='Biggs', planet_id=1))
+        db.session.flush()
+        db.session.rollback()
+    assert count(client, 'people_by_planet', 1) == 1
+
+
+def test_stats_rebuild_repairs_drift(app, client, seeded):
+    client.post('/favorite/user/1/planet/1')
+    with app.app_context():
+        db.session.execute(update(Stat).values(count=42))
+        db.session.commit()
+    assert count(client, 'favorites_by_planet', 1) == 42
+    result = app.test_cli_runner().invoke(args=['stats-rebuild'])
+    assert result.exit_code == 0
+    assert '2 had drifted' in result.output
+    assert count(client, 'favorites_by_planet', 1) == 1
+    assert count(client, 'people_by_planet', 1) == 1
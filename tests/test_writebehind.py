@@ -0,0 +1,97 @@
+"""Queued favorite writes are read back at once and applied exactly once, even after a crash"""
+import os
+import pytest
+from sqlalchemy import select
+from models import db, User, Planet, People, Favorite, Stat
+from writebehind import FavoriteQueue
+
+
+@pytest.fixture
+def queued_app(make_app, tmp_path):
+    app = make_app(FAVORITES_WRITE_BEHIND=True, FAVORITES_QUEUE_PATH=str(tmp_path / 'queue.log'),
+                   FAVORITES_FLUSH_INTERVAL=3600, FAVORITES_QUEUE_FSYNC=False)
+    with app.app_context():
+        db.session.add_all([
+            User(id=1, name='Luke', lastname='Skywalker', username='luke', suscription_dates='1977-05-25',
+                 password='secret', email='luke@example.com'),
+            Planet(planet_id=1, name='Tatooine'),
+            Planet(planet_id=2, name='Alderaan'),
+            People(character_id=1, name='Leia'),
+        ])
+        db.session.commit()
+    return app
+
+
+def targets(rows):
+    return sorted(('planet', planet_id) if planet_id is not None else ('people', people_id)
+                  for planet_id, people_id in rows)
+
+
+def listed(client):
+    return targets((row['planet_id'], row['people_id']) for row in client.get('/user/1/favorites').get_json())
+
+
+def stored(app):
+    with app.app_context():
+        return targets(db.session.execute(select(Favorite.planet_id, Favorite.people_id)))
+
+
+def test_queued_writes_are_read_back_before_the_flush(queued_app):
+    client = queued_app.test_client()
+    assert client.post('/favorite/user/1/planet/1').status_code == 202
+    assert client.post('/favorite/user/1/planet/2').status_code == 202
+    assert client.post('/favorite/user/1/people/1').status_code == 202
+    assert listed(client) == [('people', 1), ('planet', 1), ('planet', 2)]
+
+    # added then removed before any flush: gone from the listing, and nothing left to remove
+    assert client.delete('/favorite/user/1/planet/2').status_code == 202
+    assert listed(client) == [('people', 1), ('planet', 1)]
+    assert client.delete('/favorite/user/1/planet/2').status_code == 404
+    assert client.post('/favorite/user/1/planet/3').status_code == 404
+    assert stored(queued_app) == []
+
+    with queued_app.app_context():
+        assert queued_app.extensions['favorite_queue'].flush(wait=True) == 3
+    assert stored(queued_app) == [('people', 1), ('planet', 1)]
+    assert listed(client) == [('people', 1), ('planet', 1)]
+
+
+def test_flush_is_idempotent(queued_app):
+    client = queued_app.test_client()
+    queue = queued_app.extensions['favorite_queue']
+    client.post('/favorite/user/1/planet/1')
+    with queued_app.app_context():
+        assert queue.flush(wait=True) == 1
+        assert queue.flush(wait=True) == 0
+    # the same op queued again once it is applied changes nothing
+    client.post('/favorite/user/1/planet/1')
+    with queued_app.app_context():
+        assert queue.flush(wait=True) == 1
+        assert db.session.execute(
+            select(Stat.count).where(Stat.metric == 'favorites_by_planet', Stat.group_id == 1)
+        ).scalar() == 1
+    assert stored(queued_app) == [('planet', 1)]
+
+
+def test_interrupted_flush_is_replayed(queued_app):
+    client = queued_app.test_client()
+    queue = queued_app.extensions['favorite_queue']
+    client.post('/favorite/user/1/planet/1')
+    client.post('/favorite/user/1/people/1')
+    # a flush that renamed the log aside and then died part way through applying it,
+    # in a worker that crashed while appending its last op
+    with queued_app.app_context():
+        queue._apply_batch([((1, 'planet', 1), 'add')])
+    os.rename(queue.path, queue.flushing_path)
+    with open(queue.flushing_path, 'ab') as f:
+        f.write(b'{"user_id":1,"op":"add","ki')
+    client.post('/favorite/user/1/planet/2')
+    assert listed(client) == [('people', 1), ('planet', 1), ('planet', 2)]
+
+    # a fresh worker's queue picks the leftover file up before the log
+    restarted = FavoriteQueue(queued_app, path=queue.path, interval=3600, fsync=False)
+    with queued_app.app_context():
+        assert restarted.flush(wait=True) == 3
+    assert not os.path.exists(queue.flushing_path)
+    assert stored(queued_app) == [('people', 1), ('planet', 1), ('planet', 2)]
+    assert listed(client) == [('people', 1), ('planet', 1), ('planet', 2)]